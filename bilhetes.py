@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from openpyxl import Workbook, load_workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, Alignment
@@ -9,7 +9,18 @@ import shutil
 import os
 import sys
 import tkinter.font as tkfont
+import csv
+import io
 import json
+import queue
+from collections import deque
+from decimal import Decimal, ROUND_HALF_UP
+from enum import IntEnum
+import re
+import threading
+import random
+import socket
+import time
 
 # Valores de configuração
 TICKET_PRICE = 2.0  # preço por bilhete em euros
@@ -65,6 +76,13 @@ try:
 except Exception:
     WIN32_AVAILABLE = False
 
+# Pillow (opcional) para converter os logótipos em imagem raster ESC/POS
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except Exception:
+    PIL_AVAILABLE = False
+
 # Imports opcionais para geração de PDF (reportlab). Se não estiverem presentes,
 # funções PDF deverão falhar com uma mensagem amigável.
 try:
@@ -120,485 +138,2812 @@ def _send_raw_to_printer(printer_name, data_bytes):
             pass
 
 
-def imprimir_bilhetes_multiplo_pdf(bilhetes, data_hora, assistente, metodo_pagamento=None, recebido=None, troco=None, quantidade=None, preco=None):
-    """Gera um único PDF com uma página por bilhete (80mm largura x altura dinâmica por página).
-    Cada bilhete contém: título, imagem.png (se existir) logo a seguir ao título, nº do bilhete,
-    data/hora e logo.png (se existir). Depois tenta enviar o PDF para a impressora predefinida.
+# ==========================
+# CACHE DE LOGÓTIPOS
+# ==========================
+class _CacheLogos:
+    """Cache (partilhada pelo processo) dos logótipos já reduzidos à largura do bilhete.
+
+    Cada imagem é lida e convertida uma única vez por largura: fica em memória como PNG
+    reduzido (para o PDF) e como raster ESC/POS de 1 bit com dithering. A entrada é
+    invalidada quando o mtime do ficheiro muda. Segura para uso a partir da fila de impressão.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._itens = {}
+
+    def _obter(self, caminho, largura_px):
+        try:
+            mtime = os.path.getmtime(caminho)
+        except OSError:
+            return None
+        chave = (os.path.abspath(caminho), int(largura_px))
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item['mtime'] == mtime:
+                return item
+            item = self._carregar(caminho, int(largura_px), mtime)
+            self._itens[chave] = item
+            return item
+
+    def _carregar(self, caminho, largura_px, mtime):
+        item = {'mtime': mtime, 'proporcao': None, 'png': None, 'raster': b""}
+        if not PIL_AVAILABLE:
+            # sem Pillow guardamos só a proporção (lida uma vez pelo reportlab)
+            if REPORTLAB_AVAILABLE:
+                from reportlab.lib.utils import ImageReader
+                iw, ih = ImageReader(caminho).getSize()
+                if iw > 0:
+                    item['proporcao'] = ih / float(iw)
+            return item
+        with PILImage.open(caminho) as img:
+            img = img.convert("RGBA")
+            # fundo branco para as zonas transparentes
+            fundo = PILImage.new("RGBA", img.size, (255, 255, 255, 255))
+            fundo.alpha_composite(img)
+            largura = max(8, (largura_px // 8) * 8)
+            altura = max(1, int(round(img.height * largura / float(img.width))))
+            item['proporcao'] = img.height / float(img.width)
+        reduzida = fundo.convert("RGB").resize((largura, altura))
+        buf = io.BytesIO()
+        reduzida.save(buf, format="PNG")
+        item['png'] = buf.getvalue()
+        item['raster'] = _raster_escpos(reduzida.convert("L").convert("1"))
+        return item
+
+    def proporcao(self, caminho):
+        """Altura/largura da imagem original, ou None se não existir/for inválida."""
+        item = self._obter(caminho, ESCPOS_LARGURA_PONTOS)
+        return item['proporcao'] if item else None
+
+    def ficheiro_pdf(self, caminho, largura_px=None):
+        """Ficheiro em memória com a imagem reduzida (para reportlab), ou o caminho original sem Pillow."""
+        item = self._obter(caminho, largura_px or ESCPOS_LARGURA_PONTOS)
+        if item and item['png']:
+            return io.BytesIO(item['png'])
+        return caminho
+
+    def raster(self, caminho, largura_px):
+        """Comando raster ESC/POS da imagem reduzida a largura_px pontos (b'' se indisponível)."""
+        item = self._obter(caminho, largura_px)
+        return item['raster'] if item else b""
+
+
+def _raster_escpos(mono):
+    """Converte uma imagem PIL em modo '1' num comando raster GS v 0."""
+    largura, altura = mono.size
+    # em modo '1' do PIL o bit 1 é branco; em ESC/POS o bit 1 imprime (preto)
+    dados = bytes(b ^ 0xFF for b in mono.tobytes())
+    bytes_linha = largura // 8
+    return b"\x1dv0\x00" + bytes([bytes_linha & 0xFF, bytes_linha >> 8, altura & 0xFF, altura >> 8]) + dados
+
+
+LOGOS = _CacheLogos()
+
+
+# ==========================
+# MODELO DO BILHETE
+# ==========================
+# Descrição declarativa do bilhete. Pode ser substituída pela chave 'modelo_bilhete'
+# do config.json (lista com o mesmo formato). Cada elemento tem um 'tipo':
+#   - imagem: 'ficheiro' (relativo à pasta do programa) e 'escala' (fração da largura)
+#   - texto: 'texto' com campos {numero}, {data_hora}, {preco}, {total}, {quantidade},
+#     {metodo_pagamento}, {recebido}, {troco}, {assistente}; 'estilo' titulo|pequeno|recibo
+#   - espaco: 'linhas' (cada linha = 2 mm no PDF, uma linha vazia em ESC/POS)
+# O campo opcional 'se' (texto ou lista) só mostra o elemento quando todas as condições
+# são verdadeiras: agrupado, individual, dinheiro, metodo_pagamento, recebido, troco.
+MODELO_BILHETE_OMISSAO = [
+    {"tipo": "imagem", "ficheiro": "logo.png", "escala": 1.0},
+    {"tipo": "texto", "texto": "Bilhete", "estilo": "titulo"},
+    {"tipo": "texto", "texto": "Igreja Nossa Senhora da Oliveira", "estilo": "titulo"},
+    {"tipo": "espaco"},
+    {"tipo": "texto", "texto": "Preço total: €{total:.2f}", "estilo": "titulo", "se": "agrupado"},
+    {"tipo": "texto", "texto": "Preço: {preco:.2f}€", "estilo": "titulo", "se": "individual"},
+    {"tipo": "espaco"},
+    {"tipo": "imagem", "ficheiro": "imagem.png", "escala": 0.5, "espaco_depois": 1},
+    {"tipo": "texto", "texto": "Data/Hora: {data_hora}", "estilo": "pequeno"},
+    {"tipo": "espaco"},
+    {"tipo": "texto", "texto": "Donativo sem contrapartida nos termos do artigo 61 do EBF", "estilo": "pequeno"},
+    {"tipo": "espaco", "linhas": 2},
+    {"tipo": "texto", "texto": "Quantidade: {quantidade}", "estilo": "recibo", "se": "agrupado"},
+    {"tipo": "texto", "texto": "Pagamento: {metodo_pagamento}", "estilo": "recibo", "se": "metodo_pagamento"},
+    {"tipo": "texto", "texto": "Recebido: €{recebido:.2f}", "estilo": "recibo", "se": ["dinheiro", "tem_recebido"]},
+    {"tipo": "texto", "texto": "Troco: €{troco:.2f}", "estilo": "recibo", "se": ["dinheiro", "tem_troco"]},
+    {"tipo": "espaco", "se": "dinheiro"},
+]
+
+
+class ModeloBilhete:
+    """Modelo de bilhete compilado uma única vez e reutilizado em cada venda.
+
+    Na compilação validam-se os elementos, resolvem-se os caminhos das imagens, criam-se
+    os estilos do reportlab e codificam-se em ESC/POS os textos sem campos variáveis.
+    Cada venda só preenche os campos (número, data/hora, quantidade, recebido, troco).
+    """
+
+    LARGURA_MM = 80
+    ALTURA_MM = 127  # altura por página (usar valor dentro do intervalo permitido)
+    MARGEM_MM = 1
+
+    # estilo -> (fonte, tamanho, alinhamento, entrelinha) no PDF; (centrado, negrito) em ESC/POS
+    ESTILOS = {
+        'titulo': ('Helvetica-Bold', 12, 'centro', 13),
+        'pequeno': ('Helvetica', 10, 'centro', 11),
+        'recibo': ('Helvetica', 9, 'esquerda', 11),
+    }
+
+    def __init__(self, elementos=None):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.elementos = []
+        for el in elementos or MODELO_BILHETE_OMISSAO:
+            try:
+                self.elementos.append(self._compilar(el, base_dir))
+            except Exception as e:
+                print(f"Elemento do modelo de bilhete ignorado ({el!r}): {e}")
+        self._pdf_estilos = None
+
+    def _compilar(self, el, base_dir):
+        tipo = el.get('tipo')
+        se = el.get('se') or ()
+        c = {'tipo': tipo, 'se': (se,) if isinstance(se, str) else tuple(se)}
+        if tipo == 'texto':
+            estilo = el.get('estilo', 'pequeno')
+            if estilo not in self.ESTILOS:
+                raise ValueError(f"estilo desconhecido: {estilo}")
+            texto = str(el.get('texto', ''))
+            c['estilo'] = estilo
+            c['texto'] = texto
+            # textos sem campos são formatados e codificados já aqui
+            c['fixo'] = '{' not in texto
+            if c['fixo']:
+                c['escpos'] = _escpos_texto(texto)
+        elif tipo == 'imagem':
+            c['caminho'] = os.path.join(base_dir, el.get('ficheiro', 'logo.png'))
+            c['escala'] = max(0.05, min(1.0, float(el.get('escala', 1.0))))
+            c['espaco_depois'] = int(el.get('espaco_depois', 0))
+        elif tipo == 'espaco':
+            c['linhas'] = int(el.get('linhas', 1))
+        else:
+            raise ValueError(f"tipo desconhecido: {tipo}")
+        return c
+
+    @staticmethod
+    def _ativo(el, ctx):
+        return all(ctx.get(cond) for cond in el['se'])
+
+    @staticmethod
+    def _texto(el, ctx):
+        return el['texto'] if el['fixo'] else el['texto'].format_map(ctx)
+
+    # ---------- PDF ----------
+    def _estilos_pdf(self):
+        if self._pdf_estilos is None:
+            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+            from reportlab.lib.enums import TA_CENTER, TA_LEFT
+            normal = getSampleStyleSheet()['Normal']
+            self._pdf_estilos = {
+                nome: ParagraphStyle(nome, parent=normal, fontName=fonte, fontSize=tamanho,
+                                     alignment=TA_CENTER if alinhamento == 'centro' else TA_LEFT,
+                                     leading=entrelinha)
+                for nome, (fonte, tamanho, alinhamento, entrelinha) in self.ESTILOS.items()
+            }
+        return self._pdf_estilos
+
+    def tamanho_pagina_pdf(self):
+        from reportlab.lib.units import mm
+        return self.LARGURA_MM * mm, self.ALTURA_MM * mm, self.MARGEM_MM * mm
+
+    def pdf_flowables(self, ctx):
+        """Flowables de um bilhete (uma página) preenchido com o contexto dado."""
+        from reportlab.lib.units import mm
+        from reportlab.platypus import Paragraph, Image, Spacer
+
+        estilos = self._estilos_pdf()
+        largura, _altura, margem = self.tamanho_pagina_pdf()
+        largura_conteudo = largura - 2 * margem
+        story = []
+        for el in self.elementos:
+            if not self._ativo(el, ctx):
+                continue
+            try:
+                if el['tipo'] == 'texto':
+                    story.append(Paragraph(self._texto(el, ctx), estilos[el['estilo']]))
+                elif el['tipo'] == 'espaco':
+                    story.extend(Spacer(1, 2 * mm) for _ in range(el['linhas']))
+                elif el['tipo'] == 'imagem':
+                    prop = LOGOS.proporcao(el['caminho'])
+                    if not prop:
+                        continue
+                    w = largura_conteudo * el['escala']
+                    img = Image(LOGOS.ficheiro_pdf(el['caminho'], int(ESCPOS_LARGURA_PONTOS * el['escala'])),
+                                width=w, height=w * prop)
+                    img.hAlign = 'CENTER'
+                    story.append(img)
+                    story.extend(Spacer(1, 2 * mm) for _ in range(el['espaco_depois']))
+            except Exception:
+                # um elemento com problemas não impede o resto do bilhete
+                pass
+        return story
+
+    # ---------- ESC/POS ----------
+    def escpos(self, ctx):
+        """Comandos ESC/POS de um bilhete preenchido com o contexto dado (inclui o corte)."""
+        out = bytearray()
+        alinhamento = negrito = None
+        for el in self.elementos:
+            if not self._ativo(el, ctx):
+                continue
+            try:
+                if el['tipo'] == 'texto':
+                    _fonte, _tam, alin, _ent = self.ESTILOS[el['estilo']]
+                    bold = el['estilo'] == 'titulo'
+                    if alin != alinhamento:
+                        out += _ESC_ALIGN_CENTER if alin == 'centro' else _ESC_ALIGN_LEFT
+                        alinhamento = alin
+                    if bold != negrito:
+                        out += _ESC_BOLD_ON if bold else _ESC_BOLD_OFF
+                        negrito = bold
+                    out += el['escpos'] if el['fixo'] else _escpos_texto(self._texto(el, ctx))
+                elif el['tipo'] == 'espaco':
+                    out += b"\n" * el['linhas']
+                elif el['tipo'] == 'imagem':
+                    raster = LOGOS.raster(el['caminho'], int(ESCPOS_LARGURA_PONTOS * el['escala']))
+                    if raster:
+                        if alinhamento != 'centro':
+                            out += _ESC_ALIGN_CENTER
+                            alinhamento = 'centro'
+                        out += raster + b"\n" * el['espaco_depois']
+            except Exception:
+                pass
+        if negrito:
+            out += _ESC_BOLD_OFF
+        # avançar o papel para lá da lâmina e cortar
+        out += b"\n\n\n\n" + _GS_CUT
+        return bytes(out)
+
+
+_MODELO_BILHETE = None
+_MODELO_BILHETE_LOCK = threading.Lock()
+
+
+def modelo_bilhete():
+    """Modelo de bilhete em uso (compilado na primeira chamada a partir do config.json)."""
+    global _MODELO_BILHETE
+    with _MODELO_BILHETE_LOCK:
+        if _MODELO_BILHETE is None:
+            elementos = None
+            try:
+                extra = load_config().get('modelo_bilhete')
+                if isinstance(extra, list) and extra:
+                    elementos = extra
+            except Exception:
+                pass
+            _MODELO_BILHETE = ModeloBilhete(elementos)
+        return _MODELO_BILHETE
+
+
+def _contextos_bilhetes(bilhetes, data_hora, assistente, metodo_pagamento=None, recebido=None, troco=None, quantidade=None, preco=None):
+    """Campos variáveis de cada página a imprimir.
+
+    Uma venda agrupada (quantidade > 1) dá uma única página com o preço total e a
+    quantidade; caso contrário há uma página por número de bilhete.
+    """
+    try:
+        unit = float(preco) if preco is not None else TICKET_PRICE
+    except Exception:
+        unit = TICKET_PRICE
+    try:
+        qtd = int(quantidade) if quantidade else 0
+    except Exception:
+        qtd = 0
+    agrupado = qtd > 1
+    dinheiro = bool(metodo_pagamento) and str(metodo_pagamento).strip().lower() == 'dinheiro'
+    base = {
+        'data_hora': data_hora,
+        'assistente': assistente or '',
+        'metodo_pagamento': metodo_pagamento or '',
+        'preco': unit,
+        'total': qtd * unit if agrupado else unit,
+        'quantidade': qtd if agrupado else 1,
+        'recebido': float(recebido) if recebido is not None else None,
+        'troco': float(troco) if troco is not None else None,
+        # troco 0.0 (pagamento certo) também se imprime: condição pela presença, não pelo valor
+        'tem_recebido': recebido is not None,
+        'tem_troco': troco is not None,
+        'agrupado': agrupado,
+        'individual': not agrupado,
+        'dinheiro': dinheiro,
+    }
+    numeros = [bilhetes[0] if bilhetes else ''] if agrupado else list(bilhetes)
+    return [dict(base, numero=numero) for numero in numeros]
+
+
+# PDFs temporários de bilhetes: numa pasta só da aplicação, dentro da pasta temporária
+PDF_TEMP_PASTA = "venda-bilhetes"
+PDF_TEMP_PREFIXO = "bilhetes_"
+# PDFs enviados há mais do que isto (s) já foram lidos pelo spooler e podem ser apagados
+PDF_TEMP_IDADE_MAXIMA = 600
+# PDFs enviados ainda por apagar quando a aplicação fecha (ver _limpar_pdfs_enviados)
+PDF_TEMP_REGISTO = "enviados.json"
+
+
+def _pasta_pdfs_temporarios():
+    import tempfile
+    pasta = os.path.join(tempfile.gettempdir(), PDF_TEMP_PASTA)
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def _gerar_pdf_contextos(contextos):
+    """Gera um PDF com uma página por contexto (pode juntar bilhetes de várias vendas).
+
+    O nome do ficheiro é único (tempfile.mkstemp): duas vendas no mesmo segundo já não
+    escrevem por cima uma da outra.
     """
     if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("A biblioteca 'reportlab' não está instalada. Instale com: pip install reportlab")
+
+    try:
+        from reportlab.platypus import SimpleDocTemplate, PageBreak
+    except Exception as e:
+        raise RuntimeError(f"Falha ao carregar módulos do reportlab: {e}")
+
+    import tempfile
+
+    modelo = modelo_bilhete()
+    story = []
+    for idx, ctx in enumerate(contextos):
+        story.extend(modelo.pdf_flowables(ctx))
+        # PageBreak entre bilhetes (não após o último)
+        if idx != len(contextos) - 1:
+            story.append(PageBreak())
+
+    # criar ficheiro PDF temporário com nome único
+    fd, filename = tempfile.mkstemp(prefix=PDF_TEMP_PREFIXO, suffix=".pdf", dir=_pasta_pdfs_temporarios())
+    os.close(fd)
+
+    # gerar PDF com páginas do mesmo tamanho (compatível com impressora térmica 80mm)
+    width_pt, height_pt, margin_pt = modelo.tamanho_pagina_pdf()
+    doc = SimpleDocTemplate(filename, pagesize=(width_pt, height_pt),
+                            leftMargin=margin_pt, rightMargin=margin_pt,
+                            topMargin=margin_pt, bottomMargin=margin_pt)
+    try:
+        doc.build(story)
+    except Exception:
         try:
-            messagebox.showwarning(
-                "Dependência em Falta",
-                "A biblioteca 'reportlab' não está instalada. Instale com: pip install reportlab"
-            )
-        except Exception:
-            print("Dependência em Falta: reportlab")
+            os.remove(filename)
+        except OSError:
+            pass
+        raise
+    return filename
+
+
+def _limpar_pdfs_enviados(enviados, idade_minima=PDF_TEMP_IDADE_MAXIMA):
+    """Apaga os PDFs da lista [(caminho, instante do envio)] enviados há mais de
+    'idade_minima' segundos e devolve os que ficam por apagar.
+
+    O ShellExecute "print" devolve antes de o visualizador ler o ficheiro, por isso os
+    PDFs não podem ser apagados logo após o envio; ficam até já estarem de certeza no
+    spooler. Só se apagam PDFs cujo envio foi confirmado.
+    """
+    limite = time.time() - idade_minima
+    restantes = []
+    for caminho, enviado in enviados:
+        if enviado >= limite:
+            restantes.append((caminho, enviado))
+            continue
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # ainda aberto pelo visualizador (Windows): fica para a próxima
+            restantes.append((caminho, enviado))
+    return restantes
+
+
+def _ler_registo_pdfs():
+    """PDFs enviados que uma sessão anterior deixou por apagar."""
+    try:
+        with open(os.path.join(_pasta_pdfs_temporarios(), PDF_TEMP_REGISTO), encoding="utf-8") as f:
+            return [(caminho, float(enviado)) for caminho, enviado in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return []
+
+
+def _gravar_registo_pdfs(enviados):
+    caminho = os.path.join(_pasta_pdfs_temporarios(), PDF_TEMP_REGISTO)
+    if not enviados:
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
         return
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(enviados, f)
+
+
+def _enviar_pdf_para_impressora(filename):
+    """Manda imprimir o PDF na impressora predefinida do sistema (Windows preferencialmente).
+
+    Em sistemas não-Windows abre o PDF (o utilizador imprime manualmente).
+    Lança exceção se nenhum dos métodos funcionar.
+    """
+    import webbrowser
+    if sys.platform.startswith("win") and WIN32_AVAILABLE:
+        try:
+            import win32api
+            win32api.ShellExecute(0, "print", filename, None, ".", 0)
+            return
+        except Exception:
+            pass
+        try:
+            os.startfile(filename, "print")
+            return
+        except Exception:
+            pass
+    if not webbrowser.open(filename):
+        raise RuntimeError(f"Não foi possível imprimir nem abrir {filename}")
+
 
+# ==========================
+# BILHETES ESC/POS
+# ==========================
+# Impressora térmica 80mm (Birch CP-Q5): 576 pontos de largura útil a 203 dpi.
+ESCPOS_LARGURA_PONTOS = 576
+# Página de código PC858 (inclui o símbolo €); ESC t 19 na maioria das impressoras compatíveis Epson.
+ESCPOS_CODEPAGE = 19
+ESCPOS_ENCODING = "cp858"
+
+_ESC_INIT = b"\x1b@"
+_ESC_ALIGN_LEFT = b"\x1ba\x00"
+_ESC_ALIGN_CENTER = b"\x1ba\x01"
+_ESC_BOLD_ON = b"\x1bE\x01"
+_ESC_BOLD_OFF = b"\x1bE\x00"
+_GS_CUT = b"\x1dV\x00"
+
+
+def carregar_config_impressao():
+    """Configuração de impressão (chave 'impressao' do config.json).
+
+    - modo: 'escpos' (RAW direto para a impressora), 'pdf' (reportlab + visualizador)
+      ou 'auto' (ESC/POS se o pywin32 estiver disponível, senão PDF)
+    - impressora: nome da impressora Windows (por omissão a predefinida)
+    - destino: 'windows', 'ficheiro' ou 'rede' (ver criar_impressora)
+    """
+    cfg = {'modo': 'auto', 'impressora': None, 'destino': 'windows'}
     try:
-        from reportlab.lib.units import mm
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, PageBreak
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_LEFT
-        from reportlab.lib.utils import ImageReader
+        extra = load_config().get('impressao') or {}
+        if isinstance(extra, dict):
+            cfg.update(extra)
     except Exception:
+        pass
+    if cfg.get('modo') not in ('escpos', 'pdf'):
+        cfg['modo'] = 'escpos' if WIN32_AVAILABLE or cfg.get('destino') in ('ficheiro', 'rede') else 'pdf'
+    return cfg
+
+
+def _escpos_texto(texto):
+    return str(texto).encode(ESCPOS_ENCODING, errors="replace") + b"\n"
+
+
+def contar_cortes_escpos(dados):
+    """Número de cortes de papel (GS V) num trabalho ESC/POS, saltando os dados das
+    imagens raster (GS v 0), que podem conter os mesmos bytes."""
+    cortes = 0
+    i = 0
+    while True:
+        i = dados.find(b"\x1d", i)
+        if i < 0 or i + 1 >= len(dados):
+            return cortes
+        if dados.startswith(b"\x1dv0", i) and i + 8 <= len(dados):
+            largura = dados[i + 4] | dados[i + 5] << 8
+            altura = dados[i + 6] | dados[i + 7] << 8
+            i += 8 + largura * altura
+        elif dados.startswith(_GS_CUT, i):
+            cortes += 1
+            i += len(_GS_CUT)
+        else:
+            i += 1
+
+
+def _gerar_escpos_contextos(contextos):
+    """Comandos ESC/POS de vários bilhetes (pode juntar várias vendas num só trabalho)."""
+    modelo = modelo_bilhete()
+    out = bytearray(_ESC_INIT + b"\x1bt" + bytes([ESCPOS_CODEPAGE]))
+    for ctx in contextos:
+        out += modelo.escpos(ctx)
+    return bytes(out)
+
+
+# ==========================
+# IMPRESSORAS (DESTINOS ESC/POS)
+# ==========================
+class ImpressoraWindows:
+    """Impressora instalada no Windows, alimentada em RAW através do win32print."""
+
+    def __init__(self, nome=None):
+        self.nome = nome
+
+    def enviar(self, dados, bilhetes=None):
+        _send_raw_to_printer(self.nome or _get_default_printer_name(), dados)
+
+    def __repr__(self):
+        return f"ImpressoraWindows({self.nome or 'predefinida'})"
+
+
+class ImpressoraVirtual:
+    """Impressora ESC/POS simulada: grava os bytes recebidos num ficheiro e imita o tempo
+    que uma impressora térmica real levaria a imprimi-los.
+
+    - ficheiro: onde acrescentar os bytes (None = não gravar)
+    - velocidade: bytes por segundo que a "cabeça" consegue imprimir (0 = instantâneo)
+    - tempo_corte: segundos por corte de papel (GS V)
+    Permite testar e medir a impressão em Linux sem hardware (ver teste_impressao.py).
+    """
+
+    def __init__(self, ficheiro=None, velocidade=0, tempo_corte=0.0):
+        self.ficheiro = ficheiro
+        self.velocidade = float(velocidade or 0)
+        self.tempo_corte = float(tempo_corte or 0)
+        self.trabalhos = 0
+        self.bytes = 0
+        self.bilhetes = 0
+        self._lock = threading.Lock()
+
+    def enviar(self, dados, bilhetes=None):
+        """Imprime um trabalho; 'bilhetes' é o nº de bilhetes (cortes) do trabalho, se
+        conhecido — vindo da rede só há os bytes e os cortes são contados nos comandos."""
+        cortes = bilhetes if bilhetes is not None else contar_cortes_escpos(dados)
+        espera = cortes * self.tempo_corte
+        if self.velocidade > 0:
+            espera += len(dados) / self.velocidade
+        if espera > 0:
+            time.sleep(espera)
+        with self._lock:
+            if self.ficheiro:
+                with open(self.ficheiro, "ab") as f:
+                    f.write(dados)
+            self.trabalhos += 1
+            self.bytes += len(dados)
+            self.bilhetes += cortes
+
+    def __repr__(self):
+        return f"ImpressoraVirtual({self.ficheiro or 'memória'})"
+
+
+class ImpressoraRede:
+    """Impressora ESC/POS acessível por TCP (porta RAW 9100, tal como as impressoras
+    térmicas de rede) — serve também para uma impressora virtual noutro processo."""
+
+    def __init__(self, host="127.0.0.1", porta=9100, timeout=10.0):
+        self.host = host
+        self.porta = int(porta)
+        self.timeout = timeout
+
+    def enviar(self, dados, bilhetes=None):
+        with socket.create_connection((self.host, self.porta), timeout=self.timeout) as s:
+            s.sendall(dados)
+
+    def __repr__(self):
+        return f"ImpressoraRede({self.host}:{self.porta})"
+
+
+def criar_impressora(config=None):
+    """Cria o destino ESC/POS a partir da configuração de impressão.
+
+    Chave 'destino': 'windows' (omissão), 'ficheiro' (ImpressoraVirtual; chaves
+    'ficheiro', 'velocidade', 'tempo_corte') ou 'rede' (chaves 'host', 'porta').
+    """
+    config = config if config is not None else carregar_config_impressao()
+    destino = config.get('destino') or 'windows'
+    if destino == 'ficheiro':
+        return ImpressoraVirtual(config.get('ficheiro') or "impressora_virtual.bin",
+                                 config.get('velocidade', 0), config.get('tempo_corte', 0.0))
+    if destino == 'rede':
+        return ImpressoraRede(config.get('host') or "127.0.0.1", config.get('porta', 9100))
+    return ImpressoraWindows(config.get('impressora'))
+
+
+# ==========================
+# FILA DE IMPRESSÃO
+# ==========================
+class FilaImpressao:
+    """Fila de trabalhos de impressão servida por uma thread própria.
+
+    A venda só espera pelo commit na BD: o PDF é gerado e enviado em segundo plano.
+    Vendas submetidas dentro de 'janela' segundos umas das outras (até 'max_lote'
+    vendas) são juntas num único trabalho do spooler: um só PDF ou um só envio RAW.
+    Trabalhos que falham são repetidos até 'tentativas' vezes, com 'espera' segundos
+    entre tentativas. As mensagens para o utilizador ficam numa fila que a interface
+    lê na thread do Tk (ver JanelaPrincipal._verificar_fila_impressao).
+    """
+
+    def __init__(self, tentativas=3, espera=2.0, config=None, janela=None, max_lote=None, impressora=None):
+        self.tentativas = tentativas
+        self.espera = espera
+        self.config = config if config is not None else carregar_config_impressao()
+        self.impressora = impressora if impressora is not None else criar_impressora(self.config)
+        self.janela = float(janela if janela is not None else self.config.get('janela_agrupamento', 0.3))
+        self.max_lote = max(1, int(max_lote if max_lote is not None else self.config.get('max_lote', 20)))
+        self.trabalhos_enviados = 0
+        # PDFs já enviados, por apagar: [(caminho, instante do envio)]
+        self.pdfs_enviados = []
+        # segundos entre a submissão de cada venda e o fim do seu envio (últimas 1000 vendas)
+        self.latencias = deque(maxlen=1000)
+        # compilar o modelo do bilhete já no arranque (não na primeira venda)
+        self.modelo = modelo_bilhete()
+        self.mensagens = queue.Queue()
+        self._fila = queue.Queue()
+        self._thread = threading.Thread(target=self._trabalhar, name="fila-impressao", daemon=True)
+        self._thread.start()
+
+    def submeter(self, bilhetes, data_hora, assistente, **kwargs):
+        """Acrescenta uma venda à fila (mesmos argumentos que _contextos_bilhetes)."""
+        self._fila.put({'bilhetes': list(bilhetes), 'data_hora': data_hora, 'assistente': assistente,
+                        'kwargs': kwargs, 'tentativa': 1, 'submetido': time.monotonic()})
+
+    def pendentes(self):
+        return self._fila.qsize()
+
+    def parar(self, timeout=5.0):
+        """Pede à thread para terminar depois dos trabalhos já na fila."""
+        self._fila.put(None)
+        self._thread.join(timeout)
         try:
-            messagebox.showwarning("Dependência em Falta", "Falha ao carregar módulos do reportlab.")
+            # os que ainda não podem ser apagados ficam registados para a próxima sessão
+            _gravar_registo_pdfs(_limpar_pdfs_enviados(self.pdfs_enviados))
         except Exception:
-            print("Falha ao carregar módulos do reportlab.")
-        return
-
-    import tempfile, time, webbrowser
+            pass
 
-    # Configurações de página compatíveis com impressora térmica 80mm
-    WIDTH_MM = 80
-    PAGE_HEIGHT_MM = 127  # altura por página (usar valor dentro do intervalo permitido)
-    MARGIN_MM = 1
+    def _recolher_lote(self, primeiro):
+        """Junta ao primeiro trabalho os que chegarem dentro da janela de agrupamento.
 
-    width_pt = WIDTH_MM * mm
-    height_pt = PAGE_HEIGHT_MM * mm
-    margin_pt = MARGIN_MM * mm
-    content_width_pt = width_pt - 2 * margin_pt
+        Devolve (lote, parar) — parar é True se entretanto foi pedido o fim da thread.
+        """
+        lote = [primeiro]
+        limite = time.monotonic() + self.janela
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                trabalho = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+            except queue.Empty:
+                break
+            if trabalho is None:
+                return lote, True
+            lote.append(trabalho)
+        return lote, False
+
+    def _trabalhar(self):
+        try:
+            # PDFs enviados por sessões anteriores e ainda por apagar
+            self.pdfs_enviados = _limpar_pdfs_enviados(_ler_registo_pdfs() + self.pdfs_enviados)
+            _gravar_registo_pdfs(self.pdfs_enviados)
+        except Exception:
+            pass
+        while True:
+            trabalho = self._fila.get()
+            if trabalho is None:
+                return
+            lote, parar = self._recolher_lote(trabalho)
+            try:
+                self._imprimir(lote)
+                self.trabalhos_enviados += 1
+                fim = time.monotonic()
+                self.latencias.extend(fim - t['submetido'] for t in lote)
+            except Exception as e:
+                for trabalho in lote:
+                    self._repetir(trabalho, e)
+            if parar:
+                return
 
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('TitleStyle', parent=styles['Normal'],
-                                 fontName='Helvetica-Bold', fontSize=12, alignment=TA_CENTER, leading=13)
-    small_style = ParagraphStyle('Small', parent=styles['Normal'],
-                                 fontName='Helvetica', fontSize=10, alignment=TA_CENTER, leading=11)
-    receipt_style = ParagraphStyle('Small', parent=styles['Normal'],
-                                 fontName='Helvetica', fontSize=9, alignment=TA_LEFT, leading=11)
-
-    titulo_text = "Bilhete"
-    titulo_text2 = "Igreja Nossa Senhora da Oliveira"
-
-    # preparar imagem.png (após o título) e logo.png (no final), calcular tamanhos
-    base_dir = os.path.dirname(__file__)
-    imagem_path = os.path.join(base_dir, "imagem.png")
-    imagem_exists = False
-    imagem_w_pt = imagem_h_pt = 0
-
-    logo_path = os.path.join(base_dir, "logo.png")
-    logo_exists = False
-    logo_w_pt = logo_h_pt = 0
-
-    if os.path.exists(imagem_path):
-        try:
-            ir = ImageReader(imagem_path)
-            iw, ih = ir.getSize()
-            if iw > 0:
-                # reduzir imagem.png para metade da largura de conteúdo por defeito
-                imagem_w_pt = content_width_pt * 0.50
-                imagem_h_pt = imagem_w_pt * (ih / float(iw))
-                imagem_exists = True
+    def _repetir(self, trabalho, erro):
+        numero = trabalho['bilhetes'][0] if trabalho['bilhetes'] else ''
+        if trabalho['tentativa'] < self.tentativas:
+            trabalho['tentativa'] += 1
+            self.mensagens.put(f"Falha a imprimir {numero} ({erro}). Nova tentativa em {self.espera:.0f}s...")
+            # voltar a pôr na fila mais tarde, sem bloquear os trabalhos seguintes
+            t = threading.Timer(self.espera, self._fila.put, args=(trabalho,))
+            t.daemon = True
+            t.start()
+        else:
+            self.mensagens.put(f"Impressão de {numero} falhou após {self.tentativas} tentativas: {erro}")
+
+    def _imprimir(self, lote):
+        contextos = []
+        for trabalho in lote:
+            contextos.extend(_contextos_bilhetes(trabalho['bilhetes'], trabalho['data_hora'],
+                                                 trabalho['assistente'], **trabalho['kwargs']))
+        if self.config.get('modo') == 'escpos':
+            # comandos ESC/POS enviados em RAW: sem PDF nem visualizador externo.
+            # Quando o envio devolve, os dados já estão no spooler: não há ficheiros a limpar.
+            # cada bilhete termina num corte
+            self.impressora.enviar(_gerar_escpos_contextos(contextos), bilhetes=len(contextos))
+            return
+        filename = _gerar_pdf_contextos(contextos)
+        try:
+            _enviar_pdf_para_impressora(filename)
         except Exception:
-            imagem_exists = False
+            # não foi enviado: o PDF desta tentativa já não serve
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            raise
+        # apagar mais tarde, quando o spooler já o tiver lido (tal como os envios anteriores)
+        self.pdfs_enviados.append((filename, time.time()))
+        self.pdfs_enviados = _limpar_pdfs_enviados(self.pdfs_enviados)
+
+
+# ==========================
+# UTILITÁRIOS
+# ==========================
+def hoje_str():
+    return datetime.now().strftime("%Y-%m-%d")
+
+class Centimos(int):
+    """Montante em cêntimos (inteiro), para somas e trocos exatos.
+
+    Somar, subtrair ou multiplicar por inteiros devolve Centimos; 'euros' dá o valor
+    em euros para mostrar ou imprimir.
+    """
+
+    @classmethod
+    def de_euros(cls, valor):
+        """Converte euros (número ou texto, aceita vírgula) em cêntimos, arredondando ao cêntimo."""
+        if isinstance(valor, str):
+            valor = valor.strip().replace(',', '.')
+        return cls(Decimal(str(valor)).scaleb(2).to_integral_value(ROUND_HALF_UP))
+
+    @property
+    def euros(self):
+        return int(self) / 100
+
+    def formatar(self):
+        """Texto '€12.50' (como f"€{valor:.2f}"), sem passar por vírgula flutuante."""
+        inteiro, resto = divmod(abs(int(self)), 100)
+        return f"€{'-' if self < 0 else ''}{inteiro}.{resto:02d}"
+
+    def __add__(self, outro):
+        return Centimos(int(self) + outro) if isinstance(outro, int) else NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, outro):
+        return Centimos(int(self) - outro) if isinstance(outro, int) else NotImplemented
+
+    def __rsub__(self, outro):
+        return Centimos(outro - int(self)) if isinstance(outro, int) else NotImplemented
+
+    def __mul__(self, outro):
+        return Centimos(int(self) * outro) if isinstance(outro, int) else NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Centimos(-int(self))
+
+
+MESES_PT = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+
+# intervalo (ms) entre sincronizações com vendas de outras caixas
+SINCRONIZACAO_MS = 5000
+
+# Accessibility: increase font sizes for better readability
+FONT_INCREASE = 2  # change this number to increase/decrease size
+def AF(size, *opts):
+    # returns a font tuple with increased size and any extra options (e.g., 'bold')
+    try:
+        sz = int(size) + FONT_INCREASE
+    except Exception:
+        sz = size
+    return ("Segoe UI", sz) + tuple(opts)
+
+
+def agora_str():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def intervalo_dia(dia_str):
+    """Devolve o intervalo semiaberto [inicio, fim) de 'data_hora' para o dia 'YYYY-MM-DD'.
+
+    Comparar a coluna diretamente com estes limites permite ao SQLite usar o índice
+    sobre data_hora (ao contrário de date(data_hora) = ?, que obriga a ler a tabela toda).
+    """
+    inicio = datetime.strptime(dia_str, "%Y-%m-%d")
+    fim = inicio + timedelta(days=1)
+    return inicio.strftime("%Y-%m-%d"), fim.strftime("%Y-%m-%d")
 
-    if os.path.exists(logo_path):
+
+def intervalo_mes(mes_key):
+    """Devolve o intervalo semiaberto [inicio, fim) de 'data_hora' para o mês 'YYYY-MM'."""
+    ano, mes = (int(x) for x in mes_key.split("-"))
+    if mes == 12:
+        ano_fim, mes_fim = ano + 1, 1
+    else:
+        ano_fim, mes_fim = ano, mes + 1
+    return f"{ano:04d}-{mes:02d}-01", f"{ano_fim:04d}-{mes_fim:02d}-01"
+
+
+# Increase common Tk named fonts for accessibility. Call after creating a Tk root.
+def adjust_fonts(delta=FONT_INCREASE):
+    names = [
+        "TkDefaultFont", "TkTextFont", "TkMenuFont", "TkHeadingFont",
+        "TkCaptionFont", "TkSmallCaptionFont", "TkIconFont", "TkTooltipFont"
+    ]
+    for n in names:
         try:
-            ir = ImageReader(logo_path)
-            iw, ih = ir.getSize()
-            if iw > 0:
-                # logo ocupa toda a largura de conteúdo por defeito
-                logo_w_pt = content_width_pt
-                logo_h_pt = logo_w_pt * (ih / float(iw))
-                logo_exists = True
+            f = tkfont.nametofont(n)
+            # some fonts report negative sizes on Windows; handle gracefully
+            try:
+                current = int(f['size'])
+            except Exception:
+                current = f['size']
+            try:
+                f.configure(size=current + delta)
+            except Exception:
+                pass
         except Exception:
-            logo_exists = False
+            pass
 
-    # criar ficheiro PDF temporário
-    tmpdir = tempfile.gettempdir()
-    filename = os.path.join(tmpdir, f"bilhetes_batch_{int(time.time())}.pdf")
 
-    story = []
-    # Se for uma venda agrupada (quantidade > 1) geramos uma única página
+# ==========================
+# GESTOR DE BASE DE DADOS
+# ==========================
+# nº de linhas pedidas de cada vez ao percorrer resultados de pesquisa
+PAGINA_PESQUISA = 200
+
+# colunas da tabela 'vendas' (a vista 'registos' tem as mesmas, com nomes em vez de ids)
+COLUNAS_VENDAS = ("id", "data_hora", "assistente_id", "nacionalidade_id", "numero_bilhete", "metodo_id",
+                  "fatura", "contribuinte", "preco_centimos", "anotacoes", "caixa")
+# 'fatura' é guardada como 1 (Sim) / 0 (Não) / NULL
+_SQL_FATURA = "CASE WHEN {coluna} IS NULL OR trim({coluna}) = '' THEN NULL WHEN lower(trim({coluna})) = 'sim' THEN 1 ELSE 0 END"
+_SQL_FATURA_TEXTO = "CASE {coluna} WHEN 1 THEN 'Sim' WHEN 0 THEN 'Não' END"
+# preço em euros (vista, versões antigas) <-> cêntimos (vendas.preco_centimos)
+_SQL_CENTIMOS = "CAST(round({coluna} * 100) AS INTEGER)"
+
+# colunas da tabela estatisticas_horarias, pela ordem das colunas do Estatísticas.xlsx
+COLUNAS_ESTATISTICAS = [
+    "dia", "intervalo", "dia_semana", "assistente_1", "assistente_1_qtd", "assistente_2", "assistente_2_qtd",
+    "organista", "nacionalidades_base", "total_base", "outras_nacionalidades", "total_outras",
+    "nao_pagantes", "total_visitantes", "anotacoes",
+]
+CABECALHO_ESTATISTICAS = [
+    "Dia", "Intervalo", "Dia da Semana", "Assistente 1", "Assistente 1 Quantidade", "Assistente 2",
+    "Assistente 2 Quantidade", "Organista (S/N)", "Nacionalidades Base (contagens)", "Total Base",
+    "Outras Nacionalidades (list)", "Total Outras", "Nao Pagantes Hora", "Total Visitantes Hora",
+    "Anotacoes (Registos + Finais)",
+]
+
+_RE_NUMERO_BILHETE = re.compile(r"^IG\d{4}-\d+$", re.IGNORECASE)
+
+
+def interpretar_pesquisa(termo):
+    """Traduz o texto da pesquisa em (modo, valor).
+
+    - 'IG2026-123'  -> ('exato', 'IG2026-123')   número completo, usa o índice
+    - 'IG2026-12*'  -> ('prefixo', 'IG2026-12')  usa o índice
+    - '*12' / '*12*' ou qualquer outro texto -> ('substring', '12')  percorre a tabela
+    """
+    termo = (termo or "").strip()
+    if termo.startswith('*'):
+        return 'substring', termo.strip('*')
+    if termo.endswith('*') and '*' not in termo[:-1]:
+        return 'prefixo', termo[:-1].upper()
+    if _RE_NUMERO_BILHETE.match(termo):
+        return 'exato', termo.upper()
+    return 'substring', termo.replace('*', '')
+
+
+def _filtro_bilhete(termo, modo):
+    """Cláusula WHERE e parâmetros para pesquisar numero_bilhete no modo indicado."""
+    if modo == 'exato':
+        return "numero_bilhete = ?", (termo,)
+    if modo == 'prefixo':
+        # intervalo [prefixo, prefixo + maior carácter) — pode usar idx_registos_numero_bilhete
+        return "numero_bilhete >= ? AND numero_bilhete < ?", (termo, termo + "\U0010ffff")
+    return "numero_bilhete LIKE ?", (f"%{termo}%",)
+
+# Perfil de ligação por omissão. Pode ser alterado em config.json na chave "database".
+# WAL permite que os relatórios leiam a BD enquanto as vendas continuam a ser gravadas
+# e, com synchronous=NORMAL, cada commit deixa de pagar um fsync completo.
+DB_PROFILE_DEFAULT = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,      # negativo = KiB (aprox. 16 MB)
+    "mmap_size": 134217728,    # 128 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,      # ms à espera de outra caixa que esteja a escrever
+}
+
+# valores aceites por cada PRAGMA (evita injetar texto arbitrário vindo do config)
+_PRAGMAS_TEXTO = {
+    "journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"),
+    "synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+    "temp_store": ("DEFAULT", "FILE", "MEMORY"),
+}
+_PRAGMAS_INTEIRO = ("cache_size", "mmap_size", "busy_timeout")
+
+# tentativas extra quando outra caixa tem a BD bloqueada para além do busy_timeout
+DB_TENTATIVAS = 5
+
+
+def caixa_id_omissao():
+    """Identificador desta caixa: chave 'caixa' do config ou, na falta dela, o nome do computador."""
     try:
-        if quantidade and int(quantidade) > 1:
-            numero = bilhetes[0] if bilhetes else ''
-            # logo
-            if logo_exists and logo_h_pt > 0:
-                try:
-                    logo_img = Image(logo_path, width=logo_w_pt, height=logo_h_pt)
-                    logo_img.hAlign = 'CENTER'
-                    story.append(logo_img)
-                except Exception:
-                    pass
+        caixa = load_config().get('caixa')
+        if caixa:
+            return str(caixa)
+    except Exception:
+        pass
+    try:
+        return socket.gethostname() or "caixa"
+    except Exception:
+        return "caixa"
+
+
+def load_db_profile():
+    """Devolve o perfil de ligação (DB_PROFILE_DEFAULT sobreposto pela chave 'database' do config)."""
+    perfil = dict(DB_PROFILE_DEFAULT)
+    try:
+        cfg = load_config()
+        extra = cfg.get('database') or {}
+        if isinstance(extra, dict):
+            perfil.update({k: v for k, v in extra.items() if k in perfil})
+    except Exception:
+        pass
+    return perfil
 
-            # título
-            story.append(Paragraph(titulo_text, title_style))
-            story.append(Paragraph(titulo_text2, title_style))
-            story.append(Spacer(1, 2 * mm))
 
-            # preço total (usar preço fornecido, se houver)
+class DatabaseManager:
+    def __init__(self, path="bilhetes.db", perfil=None, caixa=None):
+        self.path = path
+        # caixa (till) que grava nesta ligação; várias caixas podem partilhar o mesmo ficheiro
+        self.caixa = caixa if caixa is not None else caixa_id_omissao()
+        self.conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        self.cursor = self.conn.cursor()
+        # (tabela de consulta, nome) -> id, para gravar vendas sem reler as tabelas de consulta
+        self._ids_consulta = {}
+        self._aplicar_perfil(perfil if perfil is not None else load_db_profile())
+        self._criar_tabela()
+
+    def _aplicar_perfil(self, perfil):
+        """Aplica os PRAGMAs do perfil de ligação. Valores inválidos são ignorados."""
+        for nome, valor in perfil.items():
             try:
-                unit = float(preco) if preco is not None else TICKET_PRICE
-                total_price = float(quantidade) * unit
-                story.append(Paragraph(f"Preço total: €{total_price:.2f}", title_style))
+                if nome in _PRAGMAS_TEXTO:
+                    valor = str(valor).strip().upper()
+                    if valor not in _PRAGMAS_TEXTO[nome]:
+                        continue
+                elif nome in _PRAGMAS_INTEIRO:
+                    valor = int(valor)
+                else:
+                    continue
+                self.cursor.execute(f"PRAGMA {nome} = {valor}")
+                # journal_mode devolve o modo efetivo; consumir o resultado
+                self.cursor.fetchall()
             except Exception:
-                unit = float(preco) if preco is not None else TICKET_PRICE
-                story.append(Paragraph(f"Preço: {unit:.2f}€", title_style))
-            story.append(Spacer(1, 2 * mm))
+                pass
 
-            # imagem.png logo
-            if imagem_exists and imagem_h_pt > 0:
+    def _com_retentativa(self, operacao):
+        """Executa operacao() repetindo-a se a BD estiver bloqueada por outra caixa.
+
+        O busy_timeout já faz esperar; isto cobre os casos em que o SQLite devolve
+        'database is locked/busy' de imediato (p.ex. snapshot desatualizado em WAL).
+        """
+        for tentativa in range(DB_TENTATIVAS + 1):
+            try:
+                return operacao()
+            except sqlite3.OperationalError as e:
+                msg = str(e).lower()
+                if tentativa >= DB_TENTATIVAS or ('locked' not in msg and 'busy' not in msg):
+                    raise
                 try:
-                    img = Image(imagem_path, width=imagem_w_pt, height=imagem_h_pt)
-                    img.hAlign = 'CENTER'
-                    story.append(img)
-                    story.append(Spacer(1, 2 * mm))
+                    self.conn.rollback()
                 except Exception:
                     pass
+                time.sleep(0.05 * (2 ** tentativa) + random.uniform(0, 0.05))
 
-            # data/hora e mensagem
-            story.append(Paragraph(f"Data/Hora: {data_hora}", small_style))
-            story.append(Spacer(1, 2 * mm))
+    def _tipo_objeto(self, nome):
+        """'table', 'view' ou None consoante o que existe com esse nome na BD."""
+        row = self.conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (nome,)).fetchone()
+        return row[0] if row else None
 
+    def _completar_registos_antigos(self):
+        """Acrescenta à tabela 'registos' de versões antigas as colunas em falta, antes
+        de ser convertida para o esquema normalizado."""
+        # Verificar se a coluna 'anotacoes' existe; se não, adicioná-la (migração para versões antigas)
+        try:
+            self.cursor.execute("PRAGMA table_info(registos)")
+            cols = [r[1] for r in self.cursor.fetchall()]
+            # adicionar colunas ausentes por migração simples
+            if 'anotacoes' not in cols:
+                self.cursor.execute("ALTER TABLE registos ADD COLUMN anotacoes TEXT")
+                self.conn.commit()
+                cols.append('anotacoes')
+            if 'preco' not in cols:
+                try:
+                    self.cursor.execute("ALTER TABLE registos ADD COLUMN preco REAL")
+                    self.conn.commit()
+                except Exception:
+                    pass
+            if 'caixa' not in cols:
+                try:
+                    self.cursor.execute("ALTER TABLE registos ADD COLUMN caixa TEXT")
+                    self.conn.commit()
+                except Exception:
+                    pass
+            # Se houver linhas sem preco (migração de versões antigas), preencher com preço padrão do config ou constante
             try:
-                story.append(Paragraph(f"Donativo sem contrapartida nos termos do artigo 61 do EBF", small_style))
-                story.append(Spacer(1, 2 * mm))
-                story.append(Spacer(1, 2 * mm))
+                cfg = load_config()
+                default_price = float(cfg.get('ticket_price', TICKET_PRICE))
             except Exception:
-                pass
-
-            # quantidade
+                default_price = TICKET_PRICE
             try:
-                story.append(Paragraph(f"Quantidade: {int(quantidade)}", receipt_style))
-            except Exception:
+                self.cursor.execute("UPDATE registos SET preco = ? WHERE preco IS NULL", (default_price,))
+                self.conn.commit()
+            except Exception:
                 pass
+        except Exception:
+            # Se qualquer erro ocorrer aqui, não queremos quebrar a inicialização; seguir em frente
+            pass
+
+    def _normalizar_registos(self):
+        """Cria o esquema normalizado das vendas e converte a tabela 'registos' antiga.
+
+        As vendas ficam em 'vendas', com chaves inteiras para as tabelas de consulta
+        'nacionalidades', 'assistentes' e 'metodos_pagamento' (ids 1 e 2 = MetodoPagamento)
+        e 'fatura' como 0/1 e o preço em cêntimos. 'registos' passa a ser uma vista com as
+        colunas e a ordem de sempre (ver _criar_vista_registos).
+        Tudo numa só transação: se falhar, a tabela antiga fica como estava.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # outra caixa pode ter feito a conversão enquanto se esperava pelo bloqueio
+            tipo = self._tipo_objeto('registos')
+            if tipo == 'view':
+                self.conn.rollback()
+                return
+            for tabela in ('nacionalidades', 'assistentes', 'metodos_pagamento'):
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {tabela} (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)")
+            self.conn.executemany("INSERT OR IGNORE INTO metodos_pagamento (id, nome) VALUES (?, ?)",
+                                  [(m.value, m.rotulo) for m in MetodoPagamento])
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS vendas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    data_hora TEXT,
+                    assistente_id INTEGER REFERENCES assistentes (id),
+                    nacionalidade_id INTEGER REFERENCES nacionalidades (id),
+                    numero_bilhete TEXT,
+                    metodo_id INTEGER REFERENCES metodos_pagamento (id),
+                    fatura INTEGER,
+                    contribuinte TEXT,
+                    preco_centimos INTEGER,
+                    anotacoes TEXT,
+                    caixa TEXT
+                )
+            """)
+            if tipo == 'table':
+                for tabela, coluna in (('nacionalidades', 'nacionalidade'), ('assistentes', 'assistente'),
+                                       ('metodos_pagamento', 'metodo_pagamento')):
+                    self.conn.execute(f"""
+                        INSERT OR IGNORE INTO {tabela} (nome)
+                        SELECT DISTINCT {coluna} FROM registos WHERE {coluna} IS NOT NULL ORDER BY {coluna}
+                    """)
+                self.conn.execute(f"""
+                    INSERT INTO vendas (id, data_hora, assistente_id, nacionalidade_id, numero_bilhete, metodo_id,
+                                        fatura, contribuinte, preco_centimos, anotacoes, caixa)
+                    SELECT r.id, r.data_hora, a.id, n.id, r.numero_bilhete, m.id,
+                           {_SQL_FATURA.format(coluna='r.fatura')}, r.contribuinte,
+                           {_SQL_CENTIMOS.format(coluna='r.preco')}, r.anotacoes, r.caixa
+                    FROM registos r
+                    LEFT JOIN assistentes a ON a.nome = r.assistente
+                    LEFT JOIN nacionalidades n ON n.nome = r.nacionalidade
+                    LEFT JOIN metodos_pagamento m ON m.nome = r.metodo_pagamento
+                """)
+                # leva consigo os índices e triggers da tabela antiga
+                self.conn.execute("DROP TABLE registos")
+            # índice sobre data_hora: as consultas por dia usam um intervalo semiaberto
+            # (ver intervalo_dia) e assim só percorrem as linhas desse dia
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_data_hora ON vendas (data_hora)")
+            # pesquisa exata/por prefixo do nº do bilhete (validação à porta)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_numero_bilhete ON vendas (numero_bilhete)")
+            self._criar_vista_registos()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if tipo == 'table':
+            # devolver ao sistema o espaço da tabela antiga (só na conversão)
+            try:
+                self.conn.execute("VACUUM")
+            except Exception:
+                pass
+
+    def _criar_vista_registos(self):
+        """(Re)cria a vista 'registos' sobre 'vendas' e os triggers INSTEAD OF que permitem
+        continuar a escrever nela (chamado dentro da transação de quem altera o esquema)."""
+        self.conn.execute("DROP VIEW IF EXISTS registos")
+        self.conn.execute(f"""
+            CREATE VIEW registos AS
+            SELECT v.id, v.data_hora, a.nome AS assistente, n.nome AS nacionalidade, v.numero_bilhete,
+                   m.nome AS metodo_pagamento, {_SQL_FATURA_TEXTO.format(coluna='v.fatura')} AS fatura,
+                   v.contribuinte, v.preco_centimos / 100.0 AS preco, v.anotacoes, v.caixa
+            FROM vendas v
+            LEFT JOIN assistentes a ON a.id = v.assistente_id
+            LEFT JOIN nacionalidades n ON n.id = v.nacionalidade_id
+            LEFT JOIN metodos_pagamento m ON m.id = v.metodo_id
+        """)
+        # escrever na vista: acrescentar os nomes novos às tabelas de consulta e gravar os ids
+        consultas = """
+                INSERT OR IGNORE INTO assistentes (nome) SELECT NEW.assistente WHERE NEW.assistente IS NOT NULL;
+                INSERT OR IGNORE INTO nacionalidades (nome) SELECT NEW.nacionalidade WHERE NEW.nacionalidade IS NOT NULL;
+                INSERT OR IGNORE INTO metodos_pagamento (nome) SELECT NEW.metodo_pagamento WHERE NEW.metodo_pagamento IS NOT NULL;
+        """
+        valores = {
+            'assistente_id': "(SELECT id FROM assistentes WHERE nome = NEW.assistente)",
+            'nacionalidade_id': "(SELECT id FROM nacionalidades WHERE nome = NEW.nacionalidade)",
+            'metodo_id': "(SELECT id FROM metodos_pagamento WHERE nome = NEW.metodo_pagamento)",
+            'fatura': _SQL_FATURA.format(coluna='NEW.fatura'),
+            'preco_centimos': _SQL_CENTIMOS.format(coluna='NEW.preco'),
+        }
+        valores = {c: valores.get(c, f"NEW.{c}") for c in COLUNAS_VENDAS}
+        self.conn.execute(f"""
+            CREATE TRIGGER registos_inserir INSTEAD OF INSERT ON registos
+            BEGIN
+                {consultas}
+                INSERT INTO vendas ({', '.join(COLUNAS_VENDAS)}) VALUES ({', '.join(valores.values())});
+            END
+        """)
+        self.conn.execute(f"""
+            CREATE TRIGGER registos_atualizar INSTEAD OF UPDATE ON registos
+            BEGIN
+                {consultas}
+                UPDATE vendas SET {', '.join(f'{c} = {v}' for c, v in valores.items())} WHERE id = OLD.id;
+            END
+        """)
+        self.conn.execute("""
+            CREATE TRIGGER registos_apagar INSTEAD OF DELETE ON registos
+            BEGIN
+                DELETE FROM vendas WHERE id = OLD.id;
+            END
+        """)
+
+    def _migrar_preco_centimos(self):
+        """Converte vendas.preco (REAL, em euros) em vendas.preco_centimos (INTEGER).
+
+        As alterações anotadas pela conversão são descartadas e o contador de 'alteracoes'
+        volta atrás: as linhas da vista 'registos' não mudam, pelo que não há nada a
+        replicar, e o replicador não deve ver um salto na numeração.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            cols = [r[1] for r in self.conn.execute("PRAGMA table_info(vendas)")]
+            if 'preco_centimos' in cols:
+                self.conn.rollback()
+                return
+            seq = ultima_seq_alteracoes(self.conn)
+            self.conn.execute("DROP VIEW IF EXISTS registos")
+            self.conn.execute("ALTER TABLE vendas ADD COLUMN preco_centimos INTEGER")
+            self.conn.execute(f"UPDATE vendas SET preco_centimos = {_SQL_CENTIMOS.format(coluna='preco')}")
+            try:
+                self.conn.execute("ALTER TABLE vendas DROP COLUMN preco")
+            except sqlite3.OperationalError:
+                # SQLite anterior a 3.35: a coluna antiga fica, sem uso
+                pass
+            self._criar_vista_registos()
+            self.conn.execute("DELETE FROM alteracoes WHERE seq > ?", (seq,))
+            self.conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'alteracoes'", (seq,))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _criar_tabela(self):
+        # vendas normalizadas, com 'registos' como vista compatível (ver _normalizar_registos);
+        # BDs de versões anteriores têm 'registos' como tabela e são convertidas
+        tipo = self._tipo_objeto('registos')
+        if tipo == 'table':
+            self._completar_registos_antigos()
+        if tipo != 'view':
+            self._normalizar_registos()
+
+        # sequência de números de bilhete por ano (ver reservar_bilhetes)
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sequencias (
+                    ano INTEGER PRIMARY KEY,
+                    proximo INTEGER NOT NULL
+                )
+            """)
+            self.conn.commit()
+        except Exception:
+            pass
+
+        # tabela para eventos (registos auxiliares como 'nao_entraram')
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS eventos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT,
+                    event_type TEXT,
+                    count INTEGER,
+                    assistente TEXT,
+                    notes TEXT,
+                    caixa TEXT
+                )
+            """)
+            self.conn.commit()
+            self.cursor.execute("PRAGMA table_info(eventos)")
+            if 'caixa' not in [r[1] for r in self.cursor.fetchall()]:
+                self.cursor.execute("ALTER TABLE eventos ADD COLUMN caixa TEXT")
+                self.conn.commit()
+            # as consultas filtram sempre por tipo e por dia (intervalo sobre timestamp)
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_tipo_timestamp ON eventos (event_type, timestamp)")
+            self.conn.commit()
+        except Exception:
+            pass
+
+        # registo de alterações a registos/eventos, lido pela replicação contínua
+        # (ReplicadorAlteracoes); os triggers apanham as escritas de todas as caixas, mas só
+        # enquanto alguma caixa tiver a replicação ligada (linha na tabela 'replicacao')
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS alteracoes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tabela TEXT NOT NULL,
+                    linha_id INTEGER NOT NULL,
+                    op TEXT NOT NULL
+                )
+            """)
+            # uma linha por caixa a replicar, com o último 'seq' que essa caixa já copiou
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS replicacao (
+                    caixa TEXT PRIMARY KEY,
+                    desde TEXT NOT NULL,
+                    seq INTEGER
+                )
+            """)
+            if 'seq' not in [r[1] for r in self.conn.execute("PRAGMA table_info(replicacao)")]:
+                self.cursor.execute("ALTER TABLE replicacao ADD COLUMN seq INTEGER")
+            for tabela in TABELAS_REPLICADAS:
+                base = TABELAS_BASE.get(tabela, tabela)
+                for evento, op, linha in (("INSERT", "i", "NEW"), ("UPDATE", "u", "NEW"), ("DELETE", "d", "OLD")):
+                    nome = f"trg_{base}_{op}"
+                    row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                            (nome,)).fetchone()
+                    if row is not None and 'replicacao' in row[0]:
+                        continue
+                    # triggers antigos anotavam sempre, mesmo sem replicação
+                    self.cursor.execute(f"DROP TRIGGER IF EXISTS {nome}")
+                    self.cursor.execute(f"""
+                        CREATE TRIGGER {nome} AFTER {evento} ON {base}
+                        WHEN EXISTS (SELECT 1 FROM replicacao)
+                        BEGIN
+                            INSERT INTO alteracoes (tabela, linha_id, op) VALUES ('{tabela}', {linha}.id, '{op}');
+                        END
+                    """)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+
+        # preços em cêntimos (BDs convertidas antes de existir vendas.preco_centimos)
+        if 'preco' in [r[1] for r in self.conn.execute("PRAGMA table_info(vendas)")]:
+            self._migrar_preco_centimos()
+
+        # estatísticas horárias dos dias fechados (base de relatorios/Estatísticas.xlsx)
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS estatisticas_horarias (
+                    dia TEXT NOT NULL,
+                    intervalo TEXT NOT NULL,
+                    dia_semana TEXT,
+                    assistente_1 TEXT,
+                    assistente_1_qtd INTEGER,
+                    assistente_2 TEXT,
+                    assistente_2_qtd INTEGER,
+                    organista TEXT,
+                    nacionalidades_base TEXT,
+                    total_base INTEGER,
+                    outras_nacionalidades TEXT,
+                    total_outras INTEGER,
+                    nao_pagantes INTEGER,
+                    total_visitantes INTEGER,
+                    anotacoes TEXT,
+                    PRIMARY KEY (dia, intervalo)
+                )
+            """)
+            # folhas mensais e anuais já calculadas (linhas em JSON), chave 'AAAA-MM' ou 'AAAA'
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS estatisticas_mensais (
+                    mes TEXT PRIMARY KEY,
+                    linhas TEXT NOT NULL
+                )
+            """)
+            self.conn.commit()
+        except Exception:
+            pass
+
+        # resumo de cada dia (contagens em JSON), base das folhas mensais e anuais
+        try:
+            self.cursor.execute("PRAGMA table_info(resumo_diario)")
+            if 'receita' in [r[1] for r in self.cursor.fetchall()]:
+                # receita em euros (REAL) de versões anteriores: a tabela é só um resumo de
+                # vendas/eventos e volta a ser preenchida por preencher_resumos_em_falta
+                self.cursor.execute("DROP TABLE resumo_diario")
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS resumo_diario (
+                    dia TEXT PRIMARY KEY,
+                    visitantes INTEGER NOT NULL,
+                    receita_centimos INTEGER NOT NULL,
+                    nao_entraram INTEGER NOT NULL,
+                    por_nacionalidade TEXT NOT NULL,
+                    por_pagamento TEXT NOT NULL,
+                    por_hora TEXT NOT NULL,
+                    por_assistente TEXT NOT NULL,
+                    horas_organista TEXT NOT NULL
+                )
+            """)
+            self.conn.commit()
+        except Exception:
+            pass
+
+    def inserir_evento(self, event_type, count=None, assistente=None, notes=None, timestamp=None):
+        """Grava um evento; devolve True se ficou gravado."""
+        try:
+            ts = timestamp if timestamp is not None else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            def _inserir():
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO eventos (timestamp, event_type, count, assistente, notes, caixa) VALUES (?, ?, ?, ?, ?, ?)",
+                        (ts, event_type, count, assistente, notes, self.caixa)
+                    )
+            self._com_retentativa(_inserir)
+            return True
+        except Exception:
+            return False
+
+    def obter_eventos_por_tipo(self, event_type, dia_str=None):
+        """Eventos do dia (hoje por omissão) de um tipo, ou de vários se 'event_type' for
+        uma lista/tuplo, do mais recente para o mais antigo."""
+        if dia_str is None:
+            dia_str = hoje_str()
+        tipos = [event_type] if isinstance(event_type, str) else list(event_type)
+        try:
+            inicio, fim = intervalo_dia(dia_str)
+            # (event_type, timestamp) usa idx_eventos_tipo_timestamp para cada tipo
+            self.cursor.execute(
+                f"SELECT id, timestamp, event_type, count, assistente, notes FROM eventos "
+                f"WHERE event_type IN ({', '.join('?' * len(tipos))}) AND timestamp >= ? AND timestamp < ? ORDER BY id DESC",
+                (*tipos, inicio, fim)
+            )
+            return self.cursor.fetchall()
+        except Exception:
+            return []
+
+    def resumo_eventos_dia(self, dia_str=None, tipos=('nao_entraram', 'organista_entrada', 'organista_saida')):
+        """Contagens dos tipos de evento do dia numa só consulta:
+        {event_type: {'eventos': nº de eventos, 'total': soma de 'count'}}."""
+        if dia_str is None:
+            dia_str = hoje_str()
+        tipos = list(tipos)
+        try:
+            inicio, fim = intervalo_dia(dia_str)
+            # com os tipos na condição, cada um é um intervalo em idx_eventos_tipo_timestamp
+            self.cursor.execute(
+                f"SELECT event_type, COUNT(*), SUM(count) FROM eventos "
+                f"WHERE event_type IN ({', '.join('?' * len(tipos))}) AND timestamp >= ? AND timestamp < ? "
+                f"GROUP BY event_type",
+                (*tipos, inicio, fim)
+            )
+            return {tipo: {'eventos': n, 'total': int(total or 0)} for tipo, n, total in self.cursor.fetchall()}
+        except Exception:
+            return {}
+
+    def apagar_evento_por_id(self, event_id):
+        try:
+            self.cursor.execute("DELETE FROM eventos WHERE id = ?", (event_id,))
+            self.conn.commit()
+            return True
+        except Exception:
+            return False
+
+    def _id_consulta(self, tabela, nome, novos):
+        """Id de 'nome' na tabela de consulta, acrescentando-o se for novo (dentro da transação).
+
+        Os ids já gravados ficam em cache; os acabados de criar vão para 'novos' e só
+        entram na cache depois do commit (ver _gravar_vendas).
+        """
+        if nome is None:
+            return None
+        chave = (tabela, nome)
+        rid = self._ids_consulta.get(chave) or novos.get(chave)
+        if rid is None:
+            self.conn.execute(f"INSERT OR IGNORE INTO {tabela} (nome) VALUES (?)", (nome,))
+            rid = novos[chave] = self.conn.execute(f"SELECT id FROM {tabela} WHERE nome = ?", (nome,)).fetchone()[0]
+        return rid
+
+    def _gravar_vendas(self, linhas):
+        """Grava linhas (data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento,
+        fatura, contribuinte, preco, anotacoes) diretamente em 'vendas', numa só transação.
+        O preço vem em euros e é gravado em cêntimos."""
+        novos = {}
+
+        def _inserir():
+            novos.clear()
+            with self.conn:
+                self.conn.executemany("""
+                    INSERT INTO vendas (data_hora, assistente_id, nacionalidade_id, numero_bilhete, metodo_id, fatura, contribuinte, preco_centimos, anotacoes, caixa)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(data_hora, self._id_consulta('assistentes', assistente, novos),
+                       self._id_consulta('nacionalidades', nacionalidade, novos), numero,
+                       self._id_consulta('metodos_pagamento', metodo, novos), fatura_para_int(fatura),
+                       contribuinte, Centimos.de_euros(preco) if preco is not None else None, anotacoes, self.caixa)
+                      for data_hora, assistente, nacionalidade, numero, metodo, fatura, contribuinte, preco, anotacoes in linhas])
+        self._com_retentativa(_inserir)
+        self._ids_consulta.update(novos)
+
+    def inserir_registo(self, data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, anotacoes=None, preco=None):
+        self._gravar_vendas([(data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes)])
+
+    def inserir_venda(self, bilhetes, data_hora, assistente, nacionalidade, metodo_pagamento, fatura, contribuinte, anotacoes=None, preco=None):
+        """Grava todos os bilhetes de uma venda numa única transação (um só commit).
+
+        Numa venda agrupada (mais de um bilhete) o primeiro registo leva a anotação
+        'Qtd:N' (junta às anotações da venda, se as houver).
+        """
+        if not bilhetes:
+            return
+        linhas = []
+        for idx, numero in enumerate(bilhetes):
+            anot = anotacoes
+            if idx == 0 and len(bilhetes) > 1:
+                qtd = f"Qtd:{len(bilhetes)}"
+                anot = f"{anotacoes} | {qtd}" if anotacoes and anotacoes.strip() else qtd
+            linhas.append((data_hora, assistente, nacionalidade, numero, metodo_pagamento, fatura, contribuinte, preco, anot))
+        self._gravar_vendas(linhas)
+
+    def reservar_bilhetes(self, quantidade, ano=None):
+        """Reserva 'quantidade' números consecutivos de bilhete para o ano e devolve-os.
+
+        A tabela 'sequencias' guarda o próximo número de cada ano e é avançada com um
+        único UPDATE ... RETURNING, pelo que várias caixas a partilhar a BD nunca
+        recebem números repetidos. Na primeira utilização de um ano a sequência é
+        inicializada com o maior número já gravado nesse ano.
+        """
+        quantidade = int(quantidade)
+        if quantidade <= 0:
+            return []
+        ano = int(ano or datetime.now().year)
+        prefixo = f"IG{ano}-"
+
+        def _reservar():
+            with self.conn:
+                # '.' é o carácter seguinte a '-': [prefixo, 'IG{ano}.') cobre todos os números do ano
+                self.conn.execute("""
+                    INSERT INTO sequencias (ano, proximo)
+                    SELECT ?, COALESCE(MAX(CAST(substr(numero_bilhete, ?) AS INTEGER)), 0) + 1
+                    FROM vendas
+                    WHERE numero_bilhete >= ? AND numero_bilhete < ?
+                    ON CONFLICT(ano) DO NOTHING
+                """, (ano, len(prefixo) + 1, prefixo, f"IG{ano}."))
+                return self.conn.execute(
+                    "UPDATE sequencias SET proximo = proximo + ? WHERE ano = ? RETURNING proximo",
+                    (quantidade, ano)
+                ).fetchone()
+        row = self._com_retentativa(_reservar)
+        primeiro = row[0] - quantidade
+        return [f"{prefixo}{primeiro + i}" for i in range(quantidade)]
+
+    def obter_registos_do_dia(self, dia_str=None):
+        if dia_str is None:
+            dia_str = hoje_str()
+        # Assumimos data_hora armazenada como 'YYYY-MM-DD HH:MM:SS'
+        inicio, fim = intervalo_dia(dia_str)
+        self.cursor.execute("""
+            SELECT data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
+            FROM registos
+            WHERE data_hora >= ? AND data_hora < ?
+            ORDER BY id DESC
+        """, (inicio, fim))
+        return self.cursor.fetchall()
+
+    def iterar_registos_do_dia(self, dia_str=None, bloco=500):
+        """Como obter_registos_do_dia, mas lido aos blocos de um cursor próprio
+        (a memória usada não depende do número de registos do dia)."""
+        if dia_str is None:
+            dia_str = hoje_str()
+        inicio, fim = intervalo_dia(dia_str)
+        cur = self.conn.execute("""
+            SELECT data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
+            FROM registos
+            WHERE data_hora >= ? AND data_hora < ?
+            ORDER BY id DESC
+        """, (inicio, fim))
+        try:
+            while True:
+                linhas = cur.fetchmany(bloco)
+                if not linhas:
+                    return
+                yield from linhas
+        finally:
+            cur.close()
+
+    def obter_registos_apos_id(self, ultimo_id=0, dia_str=None):
+        """Registos do dia com id > ultimo_id (mais recentes primeiro), com o id na 1ª coluna.
+
+        Usado para atualizar incrementalmente o agregado do dia: após uma venda só
+        são lidas as linhas novas (pesquisa pela chave primária).
+        """
+        if dia_str is None:
+            dia_str = hoje_str()
+        inicio, fim = intervalo_dia(dia_str)
+        self.cursor.execute("""
+            SELECT id, data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
+            FROM registos
+            WHERE id > ? AND data_hora >= ? AND data_hora < ?
+            ORDER BY id DESC
+        """, (ultimo_id or 0, inicio, fim))
+        return self.cursor.fetchall()
+
+    def contar_por_bilhete(self, termo, modo='substring'):
+        """Número total de registos que correspondem à pesquisa."""
+        where, params = _filtro_bilhete(termo, modo)
+        self.cursor.execute(f"SELECT COUNT(*) FROM registos WHERE {where}", params)
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def procurar_por_bilhete_pagina(self, termo, antes_id=None, limite=PAGINA_PESQUISA, modo='substring'):
+        """Uma página de resultados da pesquisa (id na 1ª coluna), mais recentes primeiro.
+
+        Paginação por chave (keyset): a página seguinte pede os registos com id < antes_id,
+        pelo que o custo de cada página não depende de quantas já foram lidas.
+        """
+        where, params = _filtro_bilhete(termo, modo)
+        if antes_id is not None:
+            where += " AND id < ?"
+            params = params + (antes_id,)
+        self.cursor.execute(f"""
+            SELECT id, data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
+            FROM registos
+            WHERE {where}
+            ORDER BY id DESC
+            LIMIT ?
+        """, params + (limite,))
+        return self.cursor.fetchall()
+
+    # ---------- relatórios ----------
+    def resumo_horario(self, dia_str=None):
+        """Agregados por hora do dia, calculados pelo SQLite (base do relatório horário).
+
+        Devolve uma lista ordenada de dicionários, um por hora com vendas:
+        {'hora': 'HH', 'visitantes', 'nacionalidades': {nac: n}, 'assistentes': {nome: n},
+         'nao_entraram', 'organista' (bool), 'anotacoes': [texto, ...]}.
+        Os eventos 'nao_entraram' e 'organista_entrada' da mesma hora vêm juntos na consulta.
+        Serve também para gráficos horários no ecrã.
+        """
+        if dia_str is None:
+            dia_str = hoje_str()
+        inicio, fim = intervalo_dia(dia_str)
+        self.cursor.execute("""
+            WITH por_hora AS (
+                SELECT strftime('%H', data_hora) AS hora, nacionalidade_id, assistente_id, COUNT(*) AS n
+                FROM vendas
+                WHERE data_hora >= ? AND data_hora < ?
+                GROUP BY strftime('%H', data_hora), nacionalidade_id, assistente_id
+            ),
+            nao AS (
+                SELECT strftime('%H', timestamp) AS hora, SUM(count) AS n
+                FROM eventos
+                WHERE event_type = 'nao_entraram' AND timestamp >= ? AND timestamp < ?
+                GROUP BY strftime('%H', timestamp)
+            ),
+            org AS (
+                SELECT DISTINCT strftime('%H', timestamp) AS hora
+                FROM eventos
+                WHERE event_type = 'organista_entrada' AND timestamp >= ? AND timestamp < ?
+            )
+            SELECT v.hora, nac.nome, ass.nome, v.n, COALESCE(nao.n, 0), org.hora IS NOT NULL
+            FROM por_hora v
+            LEFT JOIN nacionalidades nac ON nac.id = v.nacionalidade_id
+            LEFT JOIN assistentes ass ON ass.id = v.assistente_id
+            LEFT JOIN nao ON nao.hora = v.hora
+            LEFT JOIN org ON org.hora = v.hora
+            ORDER BY v.hora
+        """, (inicio, fim) * 3)
+        horas = {}
+        for hora, nac, assistente, n, nao_entraram, organista in self.cursor.fetchall():
+            h = horas.get(hora)
+            if h is None:
+                h = horas[hora] = {'hora': hora, 'visitantes': 0, 'nacionalidades': {}, 'assistentes': {},
+                                   'nao_entraram': int(nao_entraram or 0), 'organista': bool(organista),
+                                   'anotacoes': []}
+            h['visitantes'] += n
+            nac = (nac or '').strip()
+            if nac:
+                h['nacionalidades'][nac] = h['nacionalidades'].get(nac, 0) + n
+            if assistente:
+                h['assistentes'][assistente] = h['assistentes'].get(assistente, 0) + n
+        # anotações dos registos, pela ordem em que foram feitas
+        self.cursor.execute("""
+            SELECT strftime('%H', data_hora), trim(anotacoes)
+            FROM vendas
+            WHERE data_hora >= ? AND data_hora < ? AND anotacoes IS NOT NULL AND trim(anotacoes) <> ''
+            ORDER BY id
+        """, (inicio, fim))
+        for hora, texto in self.cursor.fetchall():
+            if hora in horas:
+                horas[hora]['anotacoes'].append(texto)
+        return [horas[h] for h in sorted(horas)]
+
+    def totais_pagamento(self, dia_str=None, apos_id=0, ate_id=None, preco_omissao=TICKET_PRICE):
+        """Montantes do dia por método de pagamento, somados pelo SQLite em cêntimos numa
+        só consulta: {MetodoPagamento ou None: Centimos}.
+
+        'apos_id'/'ate_id' limitam às vendas com id nesse intervalo (atualização
+        incremental do agregado do dia).
+        """
+        if dia_str is None:
+            dia_str = hoje_str()
+        inicio, fim = intervalo_dia(dia_str)
+        where, params = "data_hora >= ? AND data_hora < ? AND id > ?", [inicio, fim, apos_id or 0]
+        if ate_id is not None:
+            where += " AND id <= ?"
+            params.append(ate_id)
+        self.cursor.execute(f"""
+            SELECT m.nome, t.valor
+            FROM (
+                SELECT metodo_id, SUM(COALESCE(preco_centimos, ?)) AS valor
+                FROM vendas
+                WHERE {where}
+                GROUP BY metodo_id
+            ) t
+            LEFT JOIN metodos_pagamento m ON m.id = t.metodo_id
+        """, [Centimos.de_euros(preco_omissao)] + params)
+        totais = {}
+        for metodo, valor in self.cursor.fetchall():
+            tipo = MetodoPagamento.de_texto(metodo)
+            totais[tipo] = totais.get(tipo, Centimos(0)) + (valor or 0)
+        return totais
+
+    # ---------- resumo diário ----------
+    def calcular_resumo_diario(self, dia_str):
+        """Resumo de um dia: visitantes, receita (Centimos), não pagantes e contagens por
+        nacionalidade, método de pagamento, hora e assistente, e as horas (com vendas)
+        em que o organista entrou."""
+        horas = self.resumo_horario(dia_str)
+        inicio, fim = intervalo_dia(dia_str)
+        por_nacionalidade, por_hora, por_assistente, horas_organista = {}, {}, {}, []
+        for h in horas:
+            por_hora[h['hora']] = h['visitantes']
+            if h['organista']:
+                horas_organista.append(h['hora'])
+            for nac, n in h['nacionalidades'].items():
+                por_nacionalidade[nac] = por_nacionalidade.get(nac, 0) + n
+            for nome, n in h['assistentes'].items():
+                por_assistente[nome] = por_assistente.get(nome, 0) + n
+        self.cursor.execute("""
+            SELECT COALESCE(m.nome, ''), v.n, v.valor
+            FROM (
+                SELECT metodo_id, COUNT(*) AS n, SUM(COALESCE(preco_centimos, ?)) AS valor
+                FROM vendas
+                WHERE data_hora >= ? AND data_hora < ?
+                GROUP BY metodo_id
+            ) v
+            LEFT JOIN metodos_pagamento m ON m.id = v.metodo_id
+        """, (Centimos.de_euros(TICKET_PRICE), inicio, fim))
+        por_pagamento = {}
+        receita = Centimos(0)
+        for metodo, n, valor in self.cursor.fetchall():
+            por_pagamento[metodo] = n
+            receita += valor or 0
+        # não pagantes do dia inteiro (inclui horas sem vendas)
+        self.cursor.execute(
+            "SELECT SUM(count) FROM eventos WHERE event_type = 'nao_entraram' AND timestamp >= ? AND timestamp < ?",
+            (inicio, fim)
+        )
+        nao_entraram = int(self.cursor.fetchone()[0] or 0)
+        return {
+            'dia': dia_str,
+            'visitantes': sum(por_hora.values()),
+            'receita': receita,
+            'nao_entraram': nao_entraram,
+            'por_nacionalidade': por_nacionalidade,
+            'por_pagamento': por_pagamento,
+            'por_hora': por_hora,
+            'por_assistente': por_assistente,
+            'horas_organista': horas_organista,
+        }
+
+    def gravar_resumo_diario(self, dia_str):
+        """(Re)calcula e grava o resumo do dia (no fecho do dia). Devolve o resumo."""
+        r = self.calcular_resumo_diario(dia_str)
+
+        def _gravar():
+            with self.conn:
+                self.conn.execute("""
+                    INSERT INTO resumo_diario (dia, visitantes, receita_centimos, nao_entraram, por_nacionalidade,
+                                               por_pagamento, por_hora, por_assistente, horas_organista)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(dia) DO UPDATE SET
+                        visitantes = excluded.visitantes, receita_centimos = excluded.receita_centimos,
+                        nao_entraram = excluded.nao_entraram, por_nacionalidade = excluded.por_nacionalidade,
+                        por_pagamento = excluded.por_pagamento, por_hora = excluded.por_hora,
+                        por_assistente = excluded.por_assistente, horas_organista = excluded.horas_organista
+                """, (dia_str, r['visitantes'], r['receita'], r['nao_entraram'],
+                      json.dumps(r['por_nacionalidade'], ensure_ascii=False),
+                      json.dumps(r['por_pagamento'], ensure_ascii=False),
+                      json.dumps(r['por_hora']),
+                      json.dumps(r['por_assistente'], ensure_ascii=False),
+                      json.dumps(r['horas_organista'])))
+        self._com_retentativa(_gravar)
+        return r
+
+    def preencher_resumos_em_falta(self, inicio, fim):
+        """Grava o resumo dos dias em [inicio, fim) com movimento mas sem resumo
+        (dias anteriores a esta versão ou que não chegaram a ser fechados).
+
+        Cada dia em falta custa uma consulta por índice; dias já resumidos não são lidos.
+        Devolve o número de dias acrescentados.
+        """
+        self.cursor.execute("SELECT dia FROM resumo_diario WHERE dia >= ? AND dia < ?", (inicio, fim))
+        existentes = {r[0] for r in self.cursor.fetchall()}
+        dia = datetime.strptime(inicio, "%Y-%m-%d")
+        limite = min(datetime.strptime(fim, "%Y-%m-%d"), datetime.strptime(hoje_str(), "%Y-%m-%d") + timedelta(days=1))
+        novos = 0
+        while dia < limite:
+            dia_str = dia.strftime("%Y-%m-%d")
+            dia += timedelta(days=1)
+            if dia_str in existentes:
+                continue
+            a, b = intervalo_dia(dia_str)
+            self.cursor.execute("""
+                SELECT EXISTS(SELECT 1 FROM vendas WHERE data_hora >= ? AND data_hora < ?)
+                    OR EXISTS(SELECT 1 FROM eventos WHERE event_type = 'nao_entraram' AND timestamp >= ? AND timestamp < ?)
+            """, (a, b, a, b))
+            if self.cursor.fetchone()[0]:
+                self.gravar_resumo_diario(dia_str)
+                novos += 1
+        return novos
+
+    def obter_resumos_diarios(self, inicio, fim):
+        """Resumos dos dias em [inicio, fim), por ordem (no máximo 31 ou 366 linhas)."""
+        self.cursor.execute("""
+            SELECT dia, visitantes, receita_centimos, nao_entraram, por_nacionalidade, por_pagamento,
+                   por_hora, por_assistente, horas_organista
+            FROM resumo_diario
+            WHERE dia >= ? AND dia < ?
+            ORDER BY dia
+        """, (inicio, fim))
+        return [{
+            'dia': dia, 'visitantes': visitantes, 'receita': Centimos(receita), 'nao_entraram': nao_entraram,
+            'por_nacionalidade': json.loads(nac), 'por_pagamento': json.loads(pag),
+            'por_hora': json.loads(hora), 'por_assistente': json.loads(ass), 'horas_organista': json.loads(org),
+        } for dia, visitantes, receita, nao_entraram, nac, pag, hora, ass, org in self.cursor.fetchall()]
+
+    def desligar_replicacao(self):
+        """Retira esta caixa da replicação contínua (quando esta não está configurada).
+
+        Das alterações anotadas só se apagam as que as outras caixas a replicar já
+        copiaram (todas, se não houver nenhuma): as restantes ainda lhes pertencem.
+        """
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("DELETE FROM replicacao WHERE caixa = ?", (self.caixa,))
+            self.cursor.execute(
+                "DELETE FROM alteracoes WHERE NOT EXISTS (SELECT 1 FROM replicacao)"
+                " OR seq <= (SELECT MIN(COALESCE(seq, 0)) FROM replicacao)"
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+
+    # ---------- estatísticas horárias ----------
+    def gravar_estatisticas_dia(self, dia_str, linhas):
+        """Substitui as linhas horárias do dia (fechar o dia duas vezes não duplica linhas).
+
+        Cada linha segue COLUNAS_ESTATISTICAS sem a coluna 'dia'.
+        """
+        marcadores = ", ".join("?" * len(COLUNAS_ESTATISTICAS))
+
+        def _gravar():
+            with self.conn:
+                self.conn.execute("DELETE FROM estatisticas_horarias WHERE dia = ?", (dia_str,))
+                self.conn.executemany(
+                    f"INSERT INTO estatisticas_horarias ({', '.join(COLUNAS_ESTATISTICAS)}) VALUES ({marcadores})",
+                    [(dia_str,) + tuple(linha) for linha in linhas]
+                )
+        self._com_retentativa(_gravar)
+
+    def contar_estatisticas_horarias(self):
+        self.cursor.execute("SELECT COUNT(*) FROM estatisticas_horarias")
+        return self.cursor.fetchone()[0]
+
+    def iterar_estatisticas_horarias(self):
+        """Cursor próprio sobre todas as linhas horárias, por dia e intervalo (lido em fluxo)."""
+        return self.conn.execute(
+            f"SELECT {', '.join(COLUNAS_ESTATISTICAS)} FROM estatisticas_horarias ORDER BY dia, intervalo"
+        )
+
+    def larguras_estatisticas_horarias(self):
+        """Comprimento máximo de cada coluna, calculado pelo SQLite (sem ler as linhas)."""
+        expr = ", ".join(f"MAX(length({c}))" for c in COLUNAS_ESTATISTICAS)
+        self.cursor.execute(f"SELECT {expr} FROM estatisticas_horarias")
+        return [int(v or 0) for v in self.cursor.fetchone()]
+
+    def nao_entraram_por_dia(self):
+        """Total de 'nao_entraram' por dia (inclui horas sem vendas)."""
+        self.cursor.execute(
+            "SELECT substr(timestamp, 1, 10), SUM(count) FROM eventos WHERE event_type = 'nao_entraram' GROUP BY 1"
+        )
+        return {dia: int(total or 0) for dia, total in self.cursor.fetchall()}
+
+    def gravar_estatisticas_mes(self, mes_key, linhas):
+        def _gravar():
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO estatisticas_mensais (mes, linhas) VALUES (?, ?) "
+                    "ON CONFLICT(mes) DO UPDATE SET linhas = excluded.linhas",
+                    (mes_key, json.dumps(linhas, ensure_ascii=False))
+                )
+        self._com_retentativa(_gravar)
+
+    def obter_estatisticas_mensais(self):
+        """[(chave, linhas)] de todas as folhas guardadas (meses e anos), por ordem."""
+        self.cursor.execute("SELECT mes, linhas FROM estatisticas_mensais ORDER BY mes")
+        return [(mes, json.loads(linhas)) for mes, linhas in self.cursor.fetchall()]
+
+    def fechar(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class MetodoPagamento(IntEnum):
+    """Métodos de pagamento; o valor é o id na tabela 'metodos_pagamento'.
+
+    Outros textos (de versões antigas) ficam na tabela com ids seguintes e são
+    classificados pelo texto em de_texto.
+    """
+    DINHEIRO = 1
+    CARTAO = 2
+
+    @property
+    def rotulo(self):
+        return _ROTULOS_PAGAMENTO[self]
+
+    @classmethod
+    def de_texto(cls, metodo):
+        """Método correspondente ao texto gravado, ou None. Cada texto diferente só é
+        analisado uma vez (o resultado fica em cache)."""
+        try:
+            return _CLASSIFICACAO_PAGAMENTO[metodo]
+        except KeyError:
+            pass
+        texto = (metodo or "").strip().lower()
+        if texto == 'dinheiro':
+            membro = cls.DINHEIRO
+        elif texto.startswith('cart') or 'multibanco' in texto or 'cartão' in texto:
+            membro = cls.CARTAO
+        else:
+            membro = None
+        _CLASSIFICACAO_PAGAMENTO[metodo] = membro
+        return membro
+
+
+_ROTULOS_PAGAMENTO = {MetodoPagamento.DINHEIRO: "Dinheiro", MetodoPagamento.CARTAO: "Cartão"}
+_CLASSIFICACAO_PAGAMENTO = {rotulo: membro for membro, rotulo in _ROTULOS_PAGAMENTO.items()}
+
+
+def fatura_para_int(fatura):
+    """'Sim' -> 1, outro texto -> 0, vazio -> None (coluna vendas.fatura)."""
+    if fatura is None or not str(fatura).strip():
+        return None
+    return 1 if str(fatura).strip().lower() == 'sim' else 0
+
+
+# ==========================
+# AGREGADO DO DIA
+# ==========================
+class DayAggregate:
+    """Totais do dia mantidos em memória.
+
+    É carregado uma vez (arranque ou mudança de dia) e depois atualizado apenas com
+    os registos novos, de forma que cada venda custa O(bilhetes vendidos) em vez de
+    voltar a ler e percorrer todos os registos do dia.
+    """
+
+    def __init__(self, preco_omissao=TICKET_PRICE):
+        self.preco_omissao = preco_omissao
+        self.dia = None
+        self.versao = 0
+        self._limpar()
+
+    def _limpar(self):
+        self.total = 0
+        self.por_nacionalidade = {}
+        self.dinheiro = Centimos(0)
+        self.cartao = Centimos(0)
+        self.ultimo_id = 0
+        self._alterados = set()
+
+    def carregar(self, db, dia_str=None):
+        """(Re)carrega o agregado a partir da BD para o dia indicado (hoje por omissão)."""
+        self.dia = dia_str or hoje_str()
+        self._limpar()
+        self.versao += 1
+        return self.sincronizar(db)
+
+    def sincronizar(self, db):
+        """Acrescenta os registos gravados desde a última sincronização e devolve-os."""
+        if self.dia != hoje_str():
+            # mudou o dia: recomeçar com os totais do novo dia
+            self.dia = hoje_str()
+            self._limpar()
+            self.versao += 1
+        novos = db.obter_registos_apos_id(self.ultimo_id, self.dia)
+        if novos:
+            # montantes das mesmas linhas somados pelo SQLite, em cêntimos
+            totais = db.totais_pagamento(self.dia, self.ultimo_id, novos[0][0], self.preco_omissao)
+            self.dinheiro += totais.get(MetodoPagamento.DINHEIRO, 0)
+            self.cartao += totais.get(MetodoPagamento.CARTAO, 0)
+        for row in reversed(novos):
+            self.adicionar(row)
+        return novos
+
+    def adicionar(self, row):
+        """Conta um registo (formato de obter_registos_apos_id) no total e na sua
+        nacionalidade; os montantes vêm de totais_pagamento (ver sincronizar)."""
+        rid, nat = row[0], row[3]
+        self.total += 1
+        nat = nat or "Outros"
+        self.por_nacionalidade[nat] = self.por_nacionalidade.get(nat, 0) + 1
+        self._alterados.add(nat)
+        if rid and rid > self.ultimo_id:
+            self.ultimo_id = rid
+
+    @property
+    def numerario(self):
+        """Dinheiro em caixa: caixa inicial mais as vendas a dinheiro (Centimos)."""
+        return Centimos.de_euros(INITIAL_CASH) + self.dinheiro
+
+    @property
+    def caixa_total(self):
+        """Numerário mais multibanco (Centimos)."""
+        return self.numerario + self.cartao
+
+    def consumir_alteracoes(self):
+        """Devolve (e esquece) as nacionalidades alteradas desde a última chamada."""
+        alterados, self._alterados = self._alterados, set()
+        return alterados
+
+
+# ==========================
+# EXPORTAÇÃO INCREMENTAL DO DIA
+# ==========================
+class ExportadorDiario:
+    """Diário CSV das vendas do dia, escrito à medida que as vendas acontecem.
+
+    Cada registo novo é acrescentado (e enviado para o disco) a
+    relatorios/<dia>/Bilhetes_<dia>.csv, pelo que existe sempre um relatório parcial
+    mesmo que o computador desligue a meio do dia. As larguras das colunas vão sendo
+    calculadas à medida, e no fecho o Excel é gerado em modo write-only a partir do
+    diário, sem voltar a percorrer a BD nem as células da folha.
+    """
+
+    CABECALHO = ["Data/Hora", "Assistente", "Nacionalidade", "Número Bilhete", "Método Pagamento",
+                 "Recibo", "Contribuinte", "Preço", "Anotações"]
+
+    def __init__(self, pasta_base="relatorios"):
+        self.pasta_base = pasta_base
+        self.dia = None
+        self.caminho = None
+        self.ultimo_id = 0
+        self.total = 0
+        self.larguras = [0] * len(self.CABECALHO)
+
+    def _abrir(self, dia_str):
+        """Prepara o diário do dia; se já existir (reinício a meio do dia) retoma-o."""
+        self.dia = dia_str
+        pasta = os.path.join(self.pasta_base, dia_str)
+        os.makedirs(pasta, exist_ok=True)
+        self.caminho = os.path.join(pasta, f"Bilhetes_{dia_str}.csv")
+        self.ultimo_id = 0
+        self.total = 0
+        self.larguras = [len(c) for c in self.CABECALHO]
+        if os.path.exists(self.caminho):
+            with open(self.caminho, newline='', encoding='utf-8-sig') as f:
+                leitor = csv.reader(f, delimiter=';')
+                next(leitor, None)
+                for linha in leitor:
+                    if not linha:
+                        continue
+                    try:
+                        self.ultimo_id = max(self.ultimo_id, int(linha[0]))
+                    except ValueError:
+                        continue
+                    self.total += 1
+                    self._medir(linha[1:])
+        else:
+            with open(self.caminho, 'w', newline='', encoding='utf-8-sig') as f:
+                csv.writer(f, delimiter=';').writerow(["ID"] + self.CABECALHO)
+
+    def _medir(self, valores):
+        for i, v in enumerate(valores[:len(self.larguras)]):
+            n = len(v)
+            if n > self.larguras[i]:
+                self.larguras[i] = n
+
+    def acrescentar(self, rows, dia_str=None):
+        """Acrescenta ao diário os registos (formato de obter_registos_apos_id) ainda não escritos."""
+        dia_str = dia_str or hoje_str()
+        if self.dia != dia_str:
+            self._abrir(dia_str)
+        novos = sorted((r for r in rows if r and r[0] and r[0] > self.ultimo_id), key=lambda r: r[0])
+        if not novos:
+            return 0
+        with open(self.caminho, 'a', newline='', encoding='utf-8-sig') as f:
+            escritor = csv.writer(f, delimiter=';')
+            for row in novos:
+                valores = [str(x) if x is not None else "" for x in row[1:]]
+                escritor.writerow([row[0]] + valores)
+                self._medir(valores)
+            f.flush()
+            os.fsync(f.fileno())
+        self.ultimo_id = novos[-1][0]
+        self.total += len(novos)
+        return len(novos)
+
+    def sincronizar(self, db, dia_str=None):
+        """Acrescenta os registos gravados na BD desde o último escrito (p.ex. antes do fecho)."""
+        dia_str = dia_str or hoje_str()
+        if self.dia != dia_str:
+            self._abrir(dia_str)
+        return self.acrescentar(db.obter_registos_apos_id(self.ultimo_id, dia_str), dia_str)
+
+    def _linhas_mais_recentes_primeiro(self):
+        """Registos do diário do mais recente para o mais antigo (a ordem do Excel do dia).
+
+        O diário é escrito por ordem de venda; uma primeira passagem guarda só a posição
+        de cada registo e depois cada um é lido com seek, sem carregar o ficheiro.
+        """
+        with open(self.caminho, newline='', encoding='utf-8-sig') as f:
+            # readline (e não a iteração do ficheiro) para poder usar tell()
+            linhas = iter(f.readline, '')
+            leitor = csv.reader(linhas, delimiter=';')
+            next(leitor, None)
+            posicoes = []
+            while True:
+                posicao = f.tell()
+                linha = next(leitor, None)
+                if linha is None:
+                    break
+                if linha:
+                    posicoes.append(posicao)
+            for posicao in reversed(posicoes):
+                f.seek(posicao)
+                yield next(csv.reader(iter(f.readline, ''), delimiter=';'))
+
+    def gerar_excel(self, filename, rodape=(), notas_finais=None):
+        """Gera o Excel do dia em modo write-only a partir do diário.
+
+        'rodape' são linhas acrescentadas depois dos registos (totais, eventos); as
+        larguras das colunas já estão calculadas, só falta considerar o rodapé.
+        """
+        from openpyxl.cell import WriteOnlyCell
+
+        larguras = list(self.larguras)
+        for linha in rodape:
+            for i, v in enumerate(linha):
+                n = len(str(v)) if v not in (None, "") else 0
+                if i >= len(larguras):
+                    larguras.append(n)
+                elif n > larguras[i]:
+                    larguras[i] = n
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Bilhetes do Dia")
+        for i, largura in enumerate(larguras, 1):
+            # limitar largura máxima razoável
+            ws.column_dimensions[get_column_letter(i)].width = min(largura + 5, 100)
+
+        negrito = Font(bold=True)
+        cabecalho = []
+        for titulo in self.CABECALHO:
+            c = WriteOnlyCell(ws, value=titulo)
+            c.font = negrito
+            cabecalho.append(c)
+        ws.append(cabecalho)
+
+        # aplicar wrap na coluna 'Anotações' (última coluna)
+        wrap = Alignment(wrap_text=True, vertical='top')
+        for linha in self._linhas_mais_recentes_primeiro():
+            valores = linha[1:]
+            anot = WriteOnlyCell(ws, value=valores[-1] if valores else "")
+            anot.alignment = wrap
+            ws.append(valores[:-1] + [anot])
+
+        for linha in rodape:
+            ws.append(list(linha))
+
+        if notas_finais:
+            # página separada com as notas (maior legibilidade)
+            notas_ws = wb.create_sheet("Notas Finais")
+            notas_ws.append(["Anotações Finais"])
+            for ln in notas_finais.split('\n'):
+                c = WriteOnlyCell(notas_ws, value=ln)
+                c.alignment = wrap
+                notas_ws.append([c])
+        wb.save(filename)
+        return filename
+
+
+# ==========================
+# RELATÓRIO DE ESTATÍSTICAS
+# ==========================
+def _valor_celula(v):
+    """Valor de uma célula lida do Excel antigo, em tipos que o SQLite/JSON aceitam."""
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d")
+    return v
+
+
+# cabeçalhos usados por versões anteriores do Estatísticas.xlsx
+_NOMES_ANTIGOS_ESTATISTICAS = {
+    "Assistente 1": ("assistente",),
+    "Assistente 1 Quantidade": ("assistente 1 (cnt)",),
+    "Assistente 2 Quantidade": ("assistente 2 (cnt)",),
+}
+
+
+def importar_estatisticas_xlsx(db, caminho):
+    """Importa para a BD o Estatísticas.xlsx antigo (uma única vez, com a tabela vazia).
+
+    Lê em modo read-only: as linhas horárias (Dia, Intervalo, ...) vão para
+    estatisticas_horarias e as folhas Mensal_AAAA-MM para estatisticas_mensais.
+    Devolve o número de linhas horárias importadas.
+    """
+    wb = load_workbook(caminho, read_only=True)
+    importadas = 0
+    try:
+        ws = wb[wb.sheetnames[0]]
+        indices = None
+        por_dia = {}
+        for linha in ws.iter_rows(values_only=True):
+            valores = [_valor_celula(v) for v in linha]
+            if indices is None:
+                titulos = [str(v or '').strip().lower() for v in valores]
+                if len(titulos) > 1 and titulos[0] == 'dia' and titulos[1] == 'intervalo':
+                    # mapear cabeçalho -> coluna (o layout antigo tinha menos colunas)
+                    pos = {t: i for i, t in enumerate(titulos)}
+                    indices = []
+                    for titulo in CABECALHO_ESTATISTICAS:
+                        nomes = (titulo.lower(),) + _NOMES_ANTIGOS_ESTATISTICAS.get(titulo, ())
+                        indices.append(next((pos[n] for n in nomes if n in pos), None))
+                continue
+            dia = str(valores[0] or '') if valores else ''
+            if not re.match(r"^\d{4}-\d{2}-\d{2}$", dia) or len(valores) < 2 or not valores[1]:
+                # totais do dia, linhas vazias, títulos
+                continue
+            registo = tuple(valores[i] if i is not None and i < len(valores) else None for i in indices[1:])
+            por_dia.setdefault(dia, []).append(registo)
+        for dia, linhas in por_dia.items():
+            db.gravar_estatisticas_dia(dia, linhas)
+            importadas += len(linhas)
+
+        for nome in wb.sheetnames:
+            if nome.startswith("Mensal_"):
+                linhas = [[_valor_celula(v) for v in linha] for linha in wb[nome].iter_rows(values_only=True)]
+                # tirar as células vazias do fim de cada linha
+                for linha in linhas:
+                    while linha and linha[-1] is None:
+                        linha.pop()
+                db.gravar_estatisticas_mes(nome[len("Mensal_"):], linhas)
+    finally:
+        wb.close()
+    return importadas
+
+
+# cabeçalhos das tabelas da folha mensal (linhas a negrito)
+_CABECALHOS_MENSAIS = ('nacionalidade', 'intervalo hora', 'diasemana', 'métrica', 'intervalo', 'mês', 'método de pagamento')
+
+
+def escrever_estatisticas_xlsx(db, caminho):
+    """Gera o Estatísticas.xlsx a partir da BD, em modo write-only.
+
+    As linhas horárias são lidas de um cursor e escritas em fluxo; as larguras das
+    colunas vêm de MAX(length()) no SQLite. O ficheiro antigo nunca é aberto, pelo que
+    o custo não cresce com leituras e reescritas do histórico.
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment
+
+    negrito = Font(bold=True)
+    centrado = Alignment(horizontal='center', vertical='center')
+    wrap = Alignment(wrap_text=True)
+    ncols = len(CABECALHO_ESTATISTICAS)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Estatísticas')
+
+    # larguras com padding e limites mínimos/máximos
+    larguras = db.larguras_estatisticas_horarias()
+    larguras[11] = max(larguras[11], len('Total não pagantes:'))
+    larguras[13] = max(larguras[13], len('Total visitantes:'))
+    for i, (largura, titulo) in enumerate(zip(larguras, CABECALHO_ESTATISTICAS), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = min(max(max(largura, len(titulo)) + 2, 8), 100)
+    # congelar painéis após o cabeçalho (linha 2)
+    ws.freeze_panes = 'A3'
+
+    ws.append(["Estatísticas Horário"])
+    cabecalho = []
+    for titulo in CABECALHO_ESTATISTICAS:
+        c = WriteOnlyCell(ws, value=titulo)
+        c.font = negrito
+        c.alignment = centrado
+        cabecalho.append(c)
+    ws.append(cabecalho)
+
+    nao_entraram = db.nao_entraram_por_dia()
+    n_linhas = 2
+
+    def _totais(dia, visitantes):
+        ws.append([''] * 11 + ['Total não pagantes:', nao_entraram.get(dia, 0), 'Total visitantes:', visitantes])
+        ws.append([])
+
+    dia_atual = None
+    visitantes_dia = 0
+    for linha in db.iterar_estatisticas_horarias():
+        if linha[0] != dia_atual:
+            if dia_atual is not None:
+                _totais(dia_atual, visitantes_dia)
+                n_linhas += 2
+            dia_atual = linha[0]
+            visitantes_dia = 0
+        visitantes_dia += int(linha[13] or 0)
+        valores = list(linha[:8])
+        # wrap nas colunas de nacionalidades e anotações
+        for v in linha[8:]:
+            c = WriteOnlyCell(ws, value=v)
+            c.alignment = wrap
+            valores.append(c)
+        ws.append(valores)
+        n_linhas += 1
+    if dia_atual is not None:
+        _totais(dia_atual, visitantes_dia)
+        n_linhas += 2
+    ws.auto_filter.ref = f"A2:{get_column_letter(ncols)}{n_linhas}"
+
+    for chave, linhas in db.obter_estatisticas_mensais():
+        nome = f"Mensal_{chave}" if len(chave) == 7 else f"Anual_{chave}"
+        _escrever_folha_mensal(wb, nome, linhas, negrito, wrap)
+
+    # escrever para um temporário e substituir: um fecho interrompido não estraga o ficheiro
+    temporario = caminho + ".tmp"
+    wb.save(temporario)
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def _escrever_folha_mensal(wb, nome, linhas, negrito, wrap):
+    from openpyxl.cell import WriteOnlyCell
+
+    ws_m = wb.create_sheet(nome)
+    ncols = max((len(linha) for linha in linhas), default=0)
+    larguras = [0] * ncols
+    filtro = None
+    for idx, linha in enumerate(linhas, start=1):
+        for i, v in enumerate(linha):
+            if v is None:
+                continue
+            s = str(v)
+            comprimento = max((len(x) for x in s.splitlines()), default=len(s))
+            if comprimento > larguras[i]:
+                larguras[i] = comprimento
+        if filtro is None and linha and str(linha[0]).strip().lower() == 'intervalo hora':
+            filtro = idx
+    for i, largura in enumerate(larguras, start=1):
+        ws_m.column_dimensions[get_column_letter(i)].width = min(max(largura + 2, 8), 120)
+    # manter título/legenda visíveis
+    ws_m.freeze_panes = 'A6'
+    if filtro:
+        ws_m.auto_filter.ref = f"A{filtro}:B{len(linhas)}"
+
+    for idx, linha in enumerate(linhas, start=1):
+        primeira = str(linha[0] or '').lower() if linha else ''
+        destaque = idx == 4 or any(h in primeira for h in _CABECALHOS_MENSAIS)
+        celulas = []
+        for i, v in enumerate(linha):
+            c = WriteOnlyCell(ws_m, value=v)
+            c.alignment = wrap
+            if destaque and (i == 0 or idx != 4):
+                c.font = negrito
+            celulas.append(c)
+        ws_m.append(celulas)
+
+
+# ==========================
+# RELATÓRIO PDF DO DIA
+# ==========================
+# linhas por tabela no relatório PDF (cerca de uma página A4 deitada)
+PDF_LINHAS_POR_BLOCO = 30
+
+
+class _FluxoFlowables(list):
+    """Lista de flowables que se vai enchendo a partir de um gerador.
+
+    O reportlab consome a story pela frente (flowables[0] / del flowables[0]); assim
+    só existem em memória os flowables da página que está a ser composta.
+    """
 
-            # método de pagamento
+    def __init__(self, gerador, minimo=2):
+        super().__init__()
+        self._gerador = gerador
+        self._minimo = minimo
+
+    def _encher(self):
+        while self._gerador is not None and super().__len__() < self._minimo:
             try:
-                if metodo_pagamento:
-                    story.append(Paragraph(f"Pagamento: {metodo_pagamento}", receipt_style))
-                if metodo_pagamento and str(metodo_pagamento).strip().lower() == 'dinheiro':
-                    if recebido is not None:
-                        story.append(Paragraph(f"Recebido: €{float(recebido):.2f}", receipt_style))
-                    if troco is not None:
-                        story.append(Paragraph(f"Troco: €{float(troco):.2f}", receipt_style))
-                    story.append(Spacer(1, 2 * mm))
-            except Exception:
-                pass
-        else:
-            for idx, numero in enumerate(bilhetes):
-                # logo
-                if logo_exists and logo_h_pt > 0:
-                    try:
-                        logo_img = Image(logo_path, width=logo_w_pt, height=logo_h_pt)
-                        logo_img.hAlign = 'CENTER'
-                        story.append(logo_img)
-                    except Exception:
-                        pass
+                self.append(next(self._gerador))
+            except StopIteration:
+                self._gerador = None
 
-                # título
-                story.append(Paragraph(titulo_text, title_style))
-                story.append(Paragraph(titulo_text2, title_style))
-                story.append(Spacer(1, 2 * mm))
+    def __len__(self):
+        self._encher()
+        return super().__len__()
 
-                # preço (usar preço fornecido, se houver)
-                try:
-                    unit = float(preco) if preco is not None else TICKET_PRICE
-                except Exception:
-                    unit = TICKET_PRICE
-                story.append(Paragraph(f"Preço: {unit:.2f}€", title_style))
-                story.append(Spacer(1, 2 * mm))
+    def __getitem__(self, i):
+        self._encher()
+        return super().__getitem__(i)
 
-                # imagem.png logo
-                if imagem_exists and imagem_h_pt > 0:
-                    try:
-                        img = Image(imagem_path, width=imagem_w_pt, height=imagem_h_pt)
-                        img.hAlign = 'CENTER'
-                        story.append(img)
-                        story.append(Spacer(1, 2 * mm))
-                    except Exception:
-                        pass
 
-                # data/hora e mensagem
-                story.append(Paragraph(f"Data/Hora: {data_hora}", small_style))
-                story.append(Spacer(1, 2 * mm))
+def gerar_relatorio_pdf_dia(db, dia_str, filename, notas_finais=None, linhas_por_bloco=PDF_LINHAS_POR_BLOCO):
+    """Relatório PDF dos registos do dia, gerado em fluxo.
 
-                try:
-                    story.append(Paragraph(f"Donativo sem contrapartida nos termos do artigo 61 do EBF", small_style))
-                    story.append(Spacer(1, 2 * mm))
-                    story.append(Spacer(1, 2 * mm))
-                except Exception:
-                    pass
+    Os registos são lidos do cursor aos blocos e cada bloco vira uma tabela pequena
+    com o cabeçalho repetido e larguras de coluna fixas (todas as tabelas alinham).
+    O reportlab nunca compõe uma tabela gigante, pelo que o tempo cresce de forma
+    linear e a memória fica limitada mesmo em dias com milhares de bilhetes.
+    Devolve o número de registos; lança exceção em caso de falha.
+    """
+    from xml.sax.saxutils import escape
+    from reportlab.lib.pagesizes import landscape
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import Spacer
 
-                # método de pagamento
-                try:
-                    if metodo_pagamento:
-                        story.append(Paragraph(f"Pagamento: {metodo_pagamento}", receipt_style))
-                    # se pagamento em numerário e valores fornecidos, mostrar recebido e troco
-                    if metodo_pagamento and str(metodo_pagamento).strip().lower() == 'dinheiro':
-                        if recebido is not None:
-                            story.append(Paragraph(f"Recebido: €{float(recebido):.2f}", receipt_style))
-                        if troco is not None:
-                            story.append(Paragraph(f"Troco: €{float(troco):.2f}", receipt_style))
-                        story.append(Spacer(1, 2 * mm))
-                except Exception:
-                    pass
+    styles = getSampleStyleSheet()
+    celula = ParagraphStyle('Celula', parent=styles['BodyText'], fontSize=8, leading=9)
+    pagina = landscape(A4)
+    margem = 36
+    cabecalho = ["Data/Hora", "Assistente", "Nacionalidade", "Nº Bilhete", "Pagamento", "Recibo", "Contribuinte", "Preço", "Anotações"]
+    larguras = [82, 75, 75, 72, 62, 40, 68, 40]
+    larguras.append(pagina[0] - 2 * margem - sum(larguras))
+    estilo = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.whitesmoke),
+    ])
+    total = [0]
+
+    def _tabela(linhas):
+        t = Table([cabecalho] + linhas, colWidths=larguras, repeatRows=1)
+        t.setStyle(estilo)
+        return t
+
+    def _story():
+        yield Paragraph(f"<b>Relatório de Bilhetes - {dia_str}</b>", styles["Title"])
+        bloco = []
+        for row in db.iterar_registos_do_dia(dia_str):
+            r = ["" if v is None else v for v in row]
+            # só as anotações precisam de Paragraph (quebra de linha dentro da célula)
+            if r[-1]:
+                r[-1] = Paragraph(escape(str(r[-1])).replace('\n', '<br/>'), celula)
+            bloco.append(r)
+            total[0] += 1
+            if len(bloco) >= linhas_por_bloco:
+                yield _tabela(bloco)
+                bloco = []
+        if bloco:
+            yield _tabela(bloco)
+        yield Spacer(1, 12)
+        yield Paragraph(f"<b>Total de Bilhetes Vendidos:</b> {total[0]}", styles['BodyText'])
+        if notas_finais:
+            yield Spacer(1, 12)
+            yield Paragraph(escape(notas_finais).replace('\n', '<br/>'), styles['BodyText'])
+
+    doc = SimpleDocTemplate(filename, pagesize=pagina, leftMargin=margem, rightMargin=margem,
+                            topMargin=margem, bottomMargin=margem)
+    doc.build(_FluxoFlowables(_story()))
+    return total[0]
 
-                # adicionar PageBreak entre bilhetes (não após o último)
-                if idx != len(bilhetes) - 1:
-                    story.append(PageBreak())
+
+# ==========================
+# CÓPIAS DE SEGURANÇA
+# ==========================
+# quantas cópias guardar: as últimas N diárias, a mais recente de cada uma das
+# últimas N semanas e a mais recente de cada um dos últimos N meses
+BACKUP_OMISSAO = {
+    'pasta': "backups",
+    'comprimir': True,
+    'diarias': 7,
+    'semanais': 5,
+    'mensais': 12,
+}
+# páginas copiadas por passo da API de backup (entre passos a BD fica livre para vendas)
+BACKUP_PAGINAS_POR_PASSO = 256
+_RE_BACKUP = re.compile(r"^backup_bilhetes_(\d{4}-\d{2}-\d{2})\.db(\.gz)?$")
+
+
+def carregar_config_backup():
+    """Configuração das cópias de segurança (chave 'backup' do config.json)."""
+    cfg = dict(BACKUP_OMISSAO)
+    try:
+        extra = load_config().get('backup') or {}
+        if isinstance(extra, dict):
+            cfg.update(extra)
     except Exception:
-        # Em caso de erro na formatação do PDF, garantir que continuamos e tentamos gerar o que for possível
         pass
+    return cfg
 
-    # gerar PDF com páginas do mesmo tamanho
-    doc = SimpleDocTemplate(filename, pagesize=(width_pt, height_pt),
-                            leftMargin=margin_pt, rightMargin=margin_pt,
-                            topMargin=margin_pt, bottomMargin=margin_pt)
+
+def verificar_copia(caminho, comprimida=None):
+    """Corre PRAGMA integrity_check numa cópia (.db ou .db.gz). Lança exceção se falhar.
+
+    'comprimida' indica se é gzip (por omissão, pela extensão .gz).
+    """
+    import gzip
+    import tempfile
+    temporario = None
+    if comprimida is None:
+        comprimida = caminho.endswith(".gz")
     try:
-        doc.build(story)
-    except Exception as e:
+        if comprimida:
+            fd, temporario = tempfile.mkstemp(suffix=".db")
+            with os.fdopen(fd, "wb") as out, gzip.open(caminho, "rb") as gz:
+                shutil.copyfileobj(gz, out)
+            alvo = temporario
+        else:
+            alvo = caminho
+        conn = sqlite3.connect(f"file:{alvo}?mode=ro", uri=True)
         try:
-            messagebox.showerror("Erro PDF", f"Falha ao criar PDF dos bilhetes:\n{e}")
-        except Exception:
-            print("Falha ao criar PDF dos bilhetes:", e)
-        return
+            resultado = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if resultado != "ok":
+            raise RuntimeError(f"Cópia corrompida ({caminho}): {resultado}")
+    finally:
+        if temporario:
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+
+
+def criar_copia_seguranca(origem, pasta=None, comprimir=None, dia_str=None, retencao=None):
+    """Cópia consistente da BD com a API de backup do SQLite.
 
-    # tentar imprimir o PDF na impressora predefinida do sistema (Windows preferencialmente)
+    A cópia é feita por passos de BACKUP_PAGINAS_POR_PASSO páginas numa ligação
+    própria, pelo que as vendas continuam entre passos e nunca se copia um ficheiro
+    a meio de uma escrita. O ficheiro final (já comprimido com gzip, se for o caso) é
+    verificado com verificar_copia antes de substituir o do mesmo dia; no fim
+    aplica-se a rotação.
+    Devolve o caminho da cópia; lança exceção em caso de falha.
+    """
+    import gzip
+    cfg = carregar_config_backup()
+    pasta = pasta or cfg['pasta']
+    comprimir = cfg['comprimir'] if comprimir is None else comprimir
+    dia_str = dia_str or hoje_str()
+    os.makedirs(pasta, exist_ok=True)
+    if not os.path.exists(origem):
+        raise FileNotFoundError(f"Ficheiro de BD não encontrado: {origem}")
+
+    temporario = os.path.join(pasta, f"backup_bilhetes_{dia_str}.db.tmp")
+    destino = os.path.join(pasta, f"backup_bilhetes_{dia_str}.db" + (".gz" if comprimir else ""))
     try:
-        if sys.platform.startswith("win") and WIN32_AVAILABLE:
+        src = sqlite3.connect(origem, timeout=30)
+        try:
+            dst = sqlite3.connect(temporario)
             try:
-                import win32api
-                win32api.ShellExecute(0, "print", filename, None, ".", 0)
-            except Exception:
-                try:
-                    os.startfile(filename, "print")
-                except Exception:
-                    webbrowser.open(filename)
+                src.backup(dst, pages=BACKUP_PAGINAS_POR_PASSO, sleep=0.005)
+                # a cópia fica num único ficheiro (sem -wal), pronta a abrir noutro PC
+                dst.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        if comprimir:
+            with open(temporario, "rb") as f, gzip.open(destino + ".tmp", "wb", compresslevel=6) as gz:
+                shutil.copyfileobj(f, gz, 1024 * 1024)
+            os.remove(temporario)
+            # verificar o ficheiro que fica guardado (o .gz), não só a cópia antes de comprimir
+            verificar_copia(destino + ".tmp", comprimida=True)
+            os.replace(destino + ".tmp", destino)
         else:
+            verificar_copia(temporario, comprimida=False)
+            os.replace(temporario, destino)
+    except Exception:
+        for resto in (temporario, destino + ".tmp"):
             try:
-                # em sistemas não-Windows, tenta abrir o PDF (usuário imprime manualmente)
-                webbrowser.open(filename)
-            except Exception:
+                os.remove(resto)
+            except OSError:
                 pass
-    except Exception as e:
-        try:
-            messagebox.showinfo("PDF Gerado", f"PDF gerado em:\n{filename}\nImpressão automática falhou: {e}")
-        except Exception:
-            print("PDF gerado em:", filename, "Impressão automática falhou:", e)
-# ==========================
-# UTILITÁRIOS
-# ==========================
-def hoje_str():
-    return datetime.now().strftime("%Y-%m-%d")
-
-# Accessibility: increase font sizes for better readability
-FONT_INCREASE = 2  # change this number to increase/decrease size
-def AF(size, *opts):
-    # returns a font tuple with increased size and any extra options (e.g., 'bold')
+        raise
+    # não deixar ficar a versão do mesmo dia no outro formato
+    outro = destino[:-3] if destino.endswith(".gz") else destino + ".gz"
     try:
-        sz = int(size) + FONT_INCREASE
-    except Exception:
-        sz = size
-    return ("Segoe UI", sz) + tuple(opts)
+        os.remove(outro)
+    except OSError:
+        pass
+    rodar_copias(pasta, retencao or cfg)
+    return destino
 
 
-def agora_str():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def rodar_copias(pasta, retencao=None):
+    """Apaga as cópias que já não são precisas (avô-pai-filho).
 
+    Guarda as últimas 'diarias' cópias, a mais recente de cada uma das últimas
+    'semanais' semanas ISO e a mais recente de cada um dos últimos 'mensais' meses.
+    Devolve a lista de ficheiros apagados.
+    """
+    retencao = retencao or BACKUP_OMISSAO
+    copias = []
+    for nome in os.listdir(pasta):
+        m = _RE_BACKUP.match(nome)
+        if m:
+            copias.append((m.group(1), nome))
+    copias.sort(reverse=True)
+
+    manter = set(nome for _, nome in copias[:int(retencao.get('diarias', 7))])
+    for chave, limite in ((lambda d: datetime.strptime(d, "%Y-%m-%d").isocalendar()[:2], retencao.get('semanais', 5)),
+                          (lambda d: d[:7], retencao.get('mensais', 12))):
+        vistos = []
+        for dia, nome in copias:
+            k = chave(dia)
+            if k not in vistos:
+                if len(vistos) >= int(limite):
+                    break
+                vistos.append(k)
+                manter.add(nome)
 
-# Increase common Tk named fonts for accessibility. Call after creating a Tk root.
-def adjust_fonts(delta=FONT_INCREASE):
-    names = [
-        "TkDefaultFont", "TkTextFont", "TkMenuFont", "TkHeadingFont",
-        "TkCaptionFont", "TkSmallCaptionFont", "TkIconFont", "TkTooltipFont"
-    ]
-    for n in names:
-        try:
-            f = tkfont.nametofont(n)
-            # some fonts report negative sizes on Windows; handle gracefully
+    apagados = []
+    for _, nome in copias:
+        if nome not in manter:
             try:
-                current = int(f['size'])
-            except Exception:
-                current = f['size']
-            try:
-                f.configure(size=current + delta)
-            except Exception:
+                os.remove(os.path.join(pasta, nome))
+                apagados.append(nome)
+            except OSError:
                 pass
-        except Exception:
-            pass
+    return apagados
 
 
 # ==========================
-# GESTOR DE BASE DE DADOS
+# REPLICAÇÃO CONTÍNUA
 # ==========================
-class DatabaseManager:
-    def __init__(self, path="bilhetes.db"):
-        self.path = path
-        self.conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        self.cursor = self.conn.cursor()
-        self._criar_tabela()
-
-    def _criar_tabela(self):
-        # Cria tabela com coluna 'anotacoes' (opcional). Se a tabela já existir sem a coluna,
-        # fazemos uma migração simples adicionando a coluna.
-        # incluir coluna 'preco' para armazenar o preço unitário do bilhete ao registar
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS registos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                data_hora TEXT,
-                assistente TEXT,
-                nacionalidade TEXT,
-                numero_bilhete TEXT,
-                metodo_pagamento TEXT,
-                fatura TEXT,
-                contribuinte TEXT,
-                preco REAL,
-                anotacoes TEXT
-            )
-        """)
-        self.conn.commit()
+# tabelas copiadas linha a linha para o diário de alterações; 'registos' é uma vista
+# sobre 'vendas' (os triggers ficam na tabela base, o diário guarda as linhas da vista)
+TABELAS_REPLICADAS = ("registos", "eventos")
+TABELAS_BASE = {"registos": "vendas"}
+# alterações lidas de cada vez
+REPLICACAO_LOTE = 500
 
-        # Verificar se a coluna 'anotacoes' existe; se não, adicioná-la (migração para versões antigas)
-        try:
-            self.cursor.execute("PRAGMA table_info(registos)")
-            cols = [r[1] for r in self.cursor.fetchall()]
-            # adicionar colunas ausentes por migração simples
-            if 'anotacoes' not in cols:
-                self.cursor.execute("ALTER TABLE registos ADD COLUMN anotacoes TEXT")
-                self.conn.commit()
-                cols.append('anotacoes')
-            if 'preco' not in cols:
-                try:
-                    self.cursor.execute("ALTER TABLE registos ADD COLUMN preco REAL")
-                    self.conn.commit()
-                except Exception:
-                    pass
-            # Se houver linhas sem preco (migração de versões antigas), preencher com preço padrão do config ou constante
-            try:
-                cfg = load_config()
-                default_price = float(cfg.get('ticket_price', TICKET_PRICE))
-            except Exception:
-                default_price = TICKET_PRICE
-            try:
-                self.cursor.execute("UPDATE registos SET preco = ? WHERE preco IS NULL", (default_price,))
-                self.conn.commit()
-            except Exception:
-                pass
-        except Exception:
-            # Se qualquer erro ocorrer aqui, não queremos quebrar a inicialização; seguir em frente
-            pass
 
-        # tabela para eventos (registos auxiliares como 'nao_entraram')
-        try:
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS eventos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT,
-                    event_type TEXT,
-                    count INTEGER,
-                    assistente TEXT,
-                    notes TEXT
-                )
-            """)
-            self.conn.commit()
-        except Exception:
-            pass
+def ultima_seq_alteracoes(conn):
+    """Último 'seq' atribuído em 'alteracoes'.
 
-    def inserir_evento(self, event_type, count=None, assistente=None, notes=None, timestamp=None):
-        try:
-            ts = timestamp if timestamp is not None else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute(
-                "INSERT INTO eventos (timestamp, event_type, count, assistente, notes) VALUES (?, ?, ?, ?, ?)",
-                (ts, event_type, count, assistente, notes)
-            )
-            self.conn.commit()
-        except Exception:
-            pass
+    Vem do contador AUTOINCREMENT (sqlite_sequence) e não de MAX(seq): as alterações já
+    copiadas ou descartadas são apagadas, mas os seus números não voltam a ser usados.
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alteracoes'").fetchone()
+    if row is not None:
+        return row[0]
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM alteracoes").fetchone()[0]
+
+
+class ReplicadorAlteracoes:
+    """Copia continuamente as alterações de registos/eventos para outra pasta.
+
+    Enquanto houver um replicador ligado (linha da caixa na tabela 'replicacao'), os
+    triggers da BD anotam cada INSERT/UPDATE/DELETE na tabela 'alteracoes'; esta
+    thread (com a sua própria ligação) lê-as por ordem e acrescenta uma linha JSON por
+    alteração a <pasta>/alteracoes_<dia>.jsonl, com a linha completa identificada
+    pelo id. Cada venda custa assim umas centenas de bytes de escrita na pen/partilha,
+    em vez de uma cópia da BD. A posição já copiada fica em <pasta>/estado.json.
+    Na primeira vez (sem estado.json) é copiado o conteúdo atual das tabelas.
+    Repor com: python restaurar_jornal.py --jornal <pasta> --destino nova.db
+
+    Várias caixas podem replicar a mesma BD (cada uma para a sua pasta): cada caixa
+    guarda em 'replicacao' a posição que já copiou e só se apagam as alterações já
+    copiadas por todas.
+    """
 
-    def obter_eventos_por_tipo(self, event_type, dia_str=None):
-        if dia_str is None:
-            dia_str = hoje_str()
+    def __init__(self, db_path, pasta, intervalo=2.0, caixa=None):
+        self.db_path = db_path
+        self.pasta = pasta
+        self.caixa = caixa if caixa is not None else caixa_id_omissao()
+        self.intervalo = float(intervalo)
+        self.mensagens = queue.Queue()
+        self.copiadas = 0
+        self._acordar = threading.Event()
+        self._parar = False
+        self._falhou = False
+        self._thread = threading.Thread(target=self._trabalhar, name="replicacao", daemon=True)
+        self._thread.start()
+
+    def notificar(self):
+        """Pede uma cópia imediata (p.ex. logo após uma venda)."""
+        self._acordar.set()
+
+    def parar(self, timeout=10.0):
+        """Copia o que faltar e termina a thread."""
+        self._parar = True
+        self._acordar.set()
+        self._thread.join(timeout)
+
+    # ---------- thread ----------
+    def _trabalhar(self):
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    conn.row_factory = sqlite3.Row
+                    self._registar(conn)
+                while self._copiar(conn):
+                    pass
+                if self._falhou:
+                    self._falhou = False
+                    self.mensagens.put(f"Replicação retomada para {self.pasta}.")
+            except Exception as e:
+                if not self._falhou:
+                    # avisar só uma vez por falha (p.ex. pen retirada); tenta-se de novo depois
+                    self._falhou = True
+                    self.mensagens.put(f"Replicação para {self.pasta} falhou: {e}")
+            if self._parar:
+                break
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+        if conn is not None:
+            conn.close()
+
+    def _estado(self):
+        caminho = os.path.join(self.pasta, "estado.json")
         try:
-            self.cursor.execute(
-                "SELECT id, timestamp, event_type, count, assistente, notes FROM eventos WHERE event_type = ? AND date(timestamp) = ? ORDER BY id DESC",
-                (event_type, dia_str)
-            )
-            return self.cursor.fetchall()
-        except Exception:
-            return []
-
-    def apagar_evento_por_id(self, event_id):
+            with open(caminho, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _gravar_estado(self, seq):
+        caminho = os.path.join(self.pasta, "estado.json")
+        with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({'seq': seq, 'origem': os.path.abspath(self.db_path), 'atualizado': agora_str()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(caminho + ".tmp", caminho)
+
+    def _acrescentar(self, linhas):
+        caminho = os.path.join(self.pasta, f"alteracoes_{hoje_str()}.jsonl")
+        with open(caminho, "a", encoding="utf-8") as f:
+            for linha in linhas:
+                f.write(json.dumps(linha, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _registar(self, conn):
+        """Liga a anotação de alterações pelos triggers para esta caixa.
+
+        Se esta caixa não estava registada, as alterações feitas entretanto não foram
+        anotadas ou já foram apagadas por outra caixa: a cópia no destino deixa de servir
+        e recomeça-se com uma cópia completa. A posição inicial é o contador atual, para
+        que as outras caixas não apaguem o que esta ainda vai copiar.
+        """
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            self.cursor.execute("DELETE FROM eventos WHERE id = ?", (event_id,))
-            self.conn.commit()
-            return True
+            registada = conn.execute("SELECT 1 FROM replicacao WHERE caixa = ?", (self.caixa,)).fetchone() is not None
+            if not registada:
+                conn.execute("INSERT INTO replicacao (caixa, desde, seq) VALUES (?, ?, ?)",
+                             (self.caixa, agora_str(), ultima_seq_alteracoes(conn)))
+            conn.commit()
         except Exception:
-            return False
+            conn.rollback()
+            raise
+        if not registada:
+            try:
+                os.remove(os.path.join(self.pasta, "estado.json"))
+            except FileNotFoundError:
+                pass
 
-    def inserir_registo(self, data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, anotacoes=None):
-        # manter compatibilidade: aceitar um parametro opcional 'preco' via kwargs se fornecido
-        preco = None
-        # detectar se 'anotacoes' foi passado como positional (legacy) ou se foi fornecido preço via keyword
-        # chamada típica: inserir_registo(..., anotacoes)
-        # Para chamadas internas novas, passamos preco como a última positional ou via keyword
+    def _semear(self, conn):
+        """Primeira cópia: conteúdo atual das tabelas, numa leitura consistente."""
+        os.makedirs(self.pasta, exist_ok=True)
+        conn.execute("BEGIN")
         try:
-            # tentar obter de self if foi anexado temporariamente (não ideal, mas compatível)
-            preco = getattr(self, '_pending_preco', None)
-        except Exception:
-            preco = None
-        # executar insert incluindo preco
-        self.cursor.execute("""
-            INSERT INTO registos (data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes))
-        self.conn.commit()
-
-    def atualizar_anotacoes_por_numero(self, numero_bilhete, novo_texto):
-        """Anexa (ou define) o texto de anotacoes para o registo mais recente com o numero_bilhete.
-
-        Retorna True se actualizado com sucesso, False caso contrario.
+            # lido na mesma transação que as tabelas: a cópia inclui tudo até esta posição
+            seq = ultima_seq_alteracoes(conn)
+            for tabela in TABELAS_REPLICADAS:
+                cur = conn.execute(f"SELECT * FROM {tabela} ORDER BY id")
+                while True:
+                    bloco = cur.fetchmany(REPLICACAO_LOTE)
+                    if not bloco:
+                        break
+                    self._acrescentar([{'seq': seq, 'tabela': tabela, 'id': r['id'], 'op': 'u', 'linha': dict(r)}
+                                       for r in bloco])
+        finally:
+            conn.rollback()
+        self._gravar_estado(seq)
+        if not self._avancar(conn, seq):
+            return None
+        return seq
+
+    def _avancar(self, conn, seq):
+        """Regista a posição já copiada por esta caixa e apaga o que todas já copiaram.
+
+        Devolve False se a caixa deixou de estar registada (p.ex. desligada noutra janela
+        com o mesmo nome de caixa): nesse caso volta-se a registar e a copiar tudo.
         """
-        try:
-            self.cursor.execute("SELECT id, anotacoes FROM registos WHERE numero_bilhete = ? ORDER BY id DESC LIMIT 1", (numero_bilhete,))
-            row = self.cursor.fetchone()
-            if not row:
-                return False
-            rid, existing = row
-            if existing and existing.strip():
-                combinado = f"{existing} | {novo_texto}"
-            else:
-                combinado = novo_texto
-            self.cursor.execute("UPDATE registos SET anotacoes = ? WHERE id = ?", (combinado, rid))
-            self.conn.commit()
+        with conn:
+            registada = conn.execute("UPDATE replicacao SET seq = ? WHERE caixa = ?", (seq, self.caixa)).rowcount > 0
+            if registada:
+                conn.execute(
+                    "DELETE FROM alteracoes WHERE seq <= (SELECT MIN(COALESCE(seq, 0)) FROM replicacao)"
+                )
+        if not registada:
+            self._registar(conn)
+        return registada
+
+    def _copiar(self, conn):
+        """Copia um lote de alterações. Devolve True se pode haver mais."""
+        estado = self._estado()
+        seq = estado['seq'] if estado else self._semear(conn)
+        if seq is None:
             return True
-        except Exception:
+        alteracoes = conn.execute(
+            "SELECT seq, tabela, linha_id, op FROM alteracoes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (seq, REPLICACAO_LOTE)
+        ).fetchall()
+        if not alteracoes:
             return False
+        if alteracoes[0]['seq'] > seq + 1:
+            # faltam alterações (replicação desligada entretanto): recomeçar com uma cópia completa
+            self.mensagens.put(f"Replicação para {self.pasta}: alterações em falta, a copiar tudo de novo.")
+            os.remove(os.path.join(self.pasta, "estado.json"))
+            return True
+        linhas = []
+        for a in alteracoes:
+            linha = None
+            if a['op'] != 'd' and a['tabela'] in TABELAS_REPLICADAS:
+                row = conn.execute(f"SELECT * FROM {a['tabela']} WHERE id = ?", (a['linha_id'],)).fetchone()
+                linha = dict(row) if row is not None else None
+            # se a linha já não existe, a alteração equivale a apagá-la
+            linhas.append({'seq': a['seq'], 'tabela': a['tabela'], 'id': a['linha_id'],
+                           'op': 'u' if linha is not None else 'd', 'linha': linha})
+        self._acrescentar(linhas)
+        ultimo = alteracoes[-1]['seq']
+        self._gravar_estado(ultimo)
+        self.copiadas += len(linhas)
+        # já estão no destino: deixam de ser precisas na BD quando as outras caixas as copiarem
+        if not self._avancar(conn, ultimo):
+            return True
+        return len(alteracoes) == REPLICACAO_LOTE
 
-    def ultimo_numero_bilhete(self):
-        self.cursor.execute("SELECT numero_bilhete FROM registos ORDER BY id DESC LIMIT 1")
-        row = self.cursor.fetchone()
-        return row[0] if row else None
-
-    def obter_registos_do_dia(self, dia_str=None):
-        if dia_str is None:
-            dia_str = hoje_str()
-        # Assumimos data_hora armazenada como 'YYYY-MM-DD HH:MM:SS'
-        self.cursor.execute("""
-            SELECT data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
-            FROM registos
-            WHERE date(data_hora) = ?
-            ORDER BY id DESC
-        """, (dia_str,))
-        return self.cursor.fetchall()
-
-    def procurar_por_bilhete(self, termo):
-        termo_like = f"%{termo}%"
-        self.cursor.execute("""
-            SELECT data_hora, assistente, nacionalidade, numero_bilhete, metodo_pagamento, fatura, contribuinte, preco, anotacoes
-            FROM registos
-            WHERE numero_bilhete LIKE ?
-            ORDER BY id DESC
-        """, (termo_like,))
-        return self.cursor.fetchall()
 
-    def fechar(self):
-        try:
-            self.conn.close()
-        except Exception:
-            pass
+def criar_replicador(db_path, config=None, caixa=None):
+    """Replicador configurado pela chave 'replicacao' do config.json ({'pasta', 'intervalo'}),
+    ou None se a replicação não estiver configurada."""
+    config = config if config is not None else (load_config().get('replicacao') or {})
+    if not isinstance(config, dict) or not config.get('pasta'):
+        return None
+    return ReplicadorAlteracoes(db_path, config['pasta'], config.get('intervalo', 2.0), caixa=caixa)
 
 
 # ==========================
@@ -689,19 +3034,46 @@ class JanelaPrincipal:
         self.dia_fechado = False
 
         # carregar configuração (preço persistido)
+        cfg = load_config()
         try:
-            cfg = load_config()
             self.ticket_price = float(cfg.get('ticket_price', TICKET_PRICE))
         except Exception:
             self.ticket_price = TICKET_PRICE
 
         # DB
         try:
-            self.db = DatabaseManager("bilhetes.db")
+            # várias caixas podem apontar 'db_path' para o mesmo ficheiro (p.ex. numa partilha)
+            self.db = DatabaseManager(cfg.get('db_path') or "bilhetes.db")
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao abrir BD: {e}")
             return
 
+        # totais do dia em memória (carregados uma vez em atualizar_tabela, depois atualizados incrementalmente)
+        self.agregado = DayAggregate(self.ticket_price)
+        # diário CSV do dia, base do Excel gerado no fecho
+        self.exportador = ExportadorDiario()
+        self._nat_items = {}
+        self._nat_versao = None
+        # estado da tabela de registos: nº de linhas (para as riscas), versão do agregado
+        # que foi desenhada e se está a mostrar resultados de pesquisa
+        self._tabela_linhas = 0
+        self._tabela_versao = None
+        self._tabela_filtrada = False
+        self._pesquisa = None
+
+        # impressão dos bilhetes em segundo plano
+        self.fila_impressao = FilaImpressao()
+        self._backup_thread = None
+        # cópia contínua das vendas para outra pasta (pen/partilha), se configurada
+        try:
+            self.replicador = criar_replicador(self.db.path, cfg.get('replicacao') or {}, caixa=self.db.caixa)
+        except Exception as e:
+            print("Falha ao iniciar a replicação:", e)
+            self.replicador = None
+        if self.replicador is None:
+            # sem replicação esta caixa deixa de pedir que os triggers anotem alterações
+            self.db.desligar_replicacao()
+
         # Janela principal
         self.root = tk.Tk()
         # aplicar ajuste de fontes para acessibilidade
@@ -718,6 +3090,9 @@ class JanelaPrincipal:
         self._criar_interface()
         self.atualizar_tabela()
         self._atualizar_status()
+        # trazer periodicamente as vendas feitas noutras caixas que partilham a BD
+        self.root.after(SINCRONIZACAO_MS, self._sincronizar_periodicamente)
+        self.root.after(200, self._verificar_fila_impressao)
 
         # Fechar corretamente
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
@@ -1035,7 +3410,9 @@ class JanelaPrincipal:
         search_content = tk.Frame(search_frame, bg="white", padx=20, pady=15)
         search_content.pack(expand=True, fill="both")
 
-        tk.Label(search_content, text="Pesquisar Bilhetes", font=AF(11, "bold"), bg="white", fg="#4a5568").pack(anchor="w", pady=(0, 10))
+        tk.Label(search_content, text="Pesquisar Bilhetes", font=AF(11, "bold"), bg="white", fg="#4a5568").pack(anchor="w", pady=(0, 2))
+        tk.Label(search_content, text="Nº exato (IG2026-123), prefixo (IG2026-12*) ou parte do número (*12*)",
+                 font=AF(8), bg="white", fg="#a0aec0").pack(anchor="w", pady=(0, 8))
 
         search_controls = tk.Frame(search_content, bg="white")
         search_controls.pack(fill="x")
@@ -1044,6 +3421,8 @@ class JanelaPrincipal:
 
         self.entry_search = ttk.Entry(search_controls, font=AF(10), width=20)
         self.entry_search.pack(side="left", padx=8)
+        # Enter pesquisa logo (permite usar um leitor de códigos à porta)
+        self.entry_search.bind('<Return>', lambda e: self.pesquisar_bilhete())
 
         btn_pesquisar = tk.Button(search_controls, text="🔍 Pesquisar",
                                  font=AF(9),
@@ -1065,6 +3444,10 @@ class JanelaPrincipal:
                               command=self.atualizar_tabela)
         btn_limpar.pack(side="left")
 
+        # total de resultados da pesquisa (a tabela só carrega páginas à medida que se desce)
+        self.lbl_resultados = tk.Label(search_controls, text="", font=AF(9), bg="white", fg="#718096")
+        self.lbl_resultados.pack(side="left", padx=(10, 0))
+
         # Tabela principal de registos
         table_frame = tk.Frame(right_panel, bg="white", relief="flat", bd=1)
         table_frame.pack(expand=True, fill="both")
@@ -1097,7 +3480,9 @@ class JanelaPrincipal:
         # Scrollbars
         v_scroll = ttk.Scrollbar(table_content, orient="vertical", command=self.tree.yview)
         h_scroll = ttk.Scrollbar(table_content, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scroll.set, xscrollcommand=h_scroll.set)
+        self._tree_vscroll = v_scroll
+        # yscrollcommand passa por _on_tree_yscroll para carregar a página seguinte da pesquisa
+        self.tree.configure(yscrollcommand=self._on_tree_yscroll, xscrollcommand=h_scroll.set)
         
         # Usar grid para garantir que a scrollbar horizontal fique sempre visível
         # e que os componentes redimensionem corretamente dentro do frame
@@ -1219,7 +3604,9 @@ class JanelaPrincipal:
             else:
                 notes_field = organista
             try:
-                self.db.inserir_evento(event_type, count=None, assistente=self.assistente, notes=notes_field, timestamp=ts)
+                if not self.db.inserir_evento(event_type, count=None, assistente=self.assistente, notes=notes_field, timestamp=ts):
+                    raise RuntimeError("a base de dados não gravou o evento")
+                self._organista = {'dia': ts[:10], 'presente': event_type == 'organista_entrada'}
                 try:
                     hora = ts.split(' ')[1]
                 except Exception:
@@ -1287,6 +3674,7 @@ class JanelaPrincipal:
             # actualizar preço atual em memória e persistir no ficheiro de configuração
             try:
                 self.ticket_price = val
+                self.agregado.preco_omissao = val
                 cfg = load_config()
                 cfg['ticket_price'] = val
                 save_config(cfg)
@@ -1312,16 +3700,25 @@ class JanelaPrincipal:
     def _registrar_saida_organista(self):
         self._popup_registrar_organista('organista_saida')
 
+    def _organista_presente(self):
+        """Indica se o organista está presente (mais entradas do que saídas hoje).
+
+        O estado fica em memória e é atualizado a cada registo feito nesta caixa; só é
+        lido da BD (uma consulta agrupada) no arranque e quando muda o dia.
+        """
+        estado = getattr(self, '_organista', None)
+        if estado is None or estado['dia'] != hoje_str():
+            resumo = self.db.resumo_eventos_dia()
+            entradas = resumo.get('organista_entrada', {}).get('eventos', 0)
+            saidas = resumo.get('organista_saida', {}).get('eventos', 0)
+            estado = self._organista = {'dia': hoje_str(), 'presente': entradas > saidas}
+        return estado['presente']
+
     def _on_click_organista_toggle(self):
         """Decide automaticamente se o próximo evento deve ser entrada ou saída com base nos registos de hoje."""
         try:
-            entradas = self.db.obter_eventos_por_tipo('organista_entrada') or []
-            saidas = self.db.obter_eventos_por_tipo('organista_saida') or []
-            # Se houve mais entradas do que saídas, aguardamos uma saída
-            if len(entradas) > len(saidas):
-                ev = 'organista_saida'
-            else:
-                ev = 'organista_entrada'
+            # Se o organista está presente, aguardamos uma saída
+            ev = 'organista_saida' if self._organista_presente() else 'organista_entrada'
         except Exception:
             ev = 'organista_entrada'
         self._popup_registrar_organista(ev)
@@ -1329,10 +3726,8 @@ class JanelaPrincipal:
     def _update_organista_button_state(self):
         """Atualiza o rótulo do botão do organista consoante os eventos registados hoje."""
         try:
-            entradas = self.db.obter_eventos_por_tipo('organista_entrada') or []
-            saidas = self.db.obter_eventos_por_tipo('organista_saida') or []
-            # Se houve mais entradas do que saídas, o próximo passo é registar a saída
-            if len(entradas) > len(saidas):
+            # Se o organista está presente, o próximo passo é registar a saída
+            if self._organista_presente():
                 texto = "❌ Registar Saída Organista"
                 bg = "#f56565"        # vermelho
                 active_bg = "#c53030"
@@ -1367,17 +3762,6 @@ class JanelaPrincipal:
         txt.config(state="disabled")
         ttk.Button(popup, text="Fechar", command=popup.destroy).pack(pady=(0, 10))
 
-    def _proximo_numero_bilhete(self):
-        ultimo = self.db.ultimo_numero_bilhete()
-        ano = datetime.now().year
-        if ultimo and isinstance(ultimo, str) and ultimo.startswith(f"IG{ano}-"):
-            try:
-                n = int(ultimo.split("-")[1])
-            except Exception:
-                n = 0
-            return n + 1
-        return 1
-
     def _on_nacionalidade_change(self, event=None):
         try:
             val = self.combo_nacionalidade.get()
@@ -1466,11 +3850,8 @@ class JanelaPrincipal:
             # se por alguma razão não for ScrolledText (compatibilidade), tentar Entry
             anotacoes = getattr(self, 'entry_anotacoes').get().strip() or None
 
-        # preparar números dos bilhetes (ainda não gravar — pedir pagamento primeiro)
-        proximo = self._proximo_numero_bilhete()
-        ano = datetime.now().year
+        # os números dos bilhetes só são reservados ao gravar (depois de confirmado o pagamento)
         data_hora = agora_str()
-        bilhetes = [f"IG{ano}-{proximo + i}" for i in range(quantidade)]
 
         # limpar campos e atualizar
         self.combo_nacionalidade.set("Português")
@@ -1498,117 +3879,51 @@ class JanelaPrincipal:
         # - se for 'Dinheiro' abrir popup para introduzir valor recebido e calcular troco
         # - se for outro método (ex. cartão/multibanco) gravar diretamente e gerar o PDF
         try:
-            total_price = len(bilhetes) * getattr(self, 'ticket_price', TICKET_PRICE)
+            total_price = Centimos.de_euros(getattr(self, 'ticket_price', TICKET_PRICE)) * int(quantidade)
             metodo_norm = (metodo_pagamento or "").strip().lower()
             # Se quantidade > 1, vamos criar apenas um bilhete que indica a quantidade
-            agrupado = len(bilhetes) > 1
+            agrupado = quantidade > 1
             if metodo_norm and metodo_norm != 'dinheiro':
                 # pagamento por cartão: gravar registos e gerar PDF sem pedir valor recebido
+                try:
+                    bilhetes = self.db.reservar_bilhetes(quantidade)
+                    self.db.inserir_venda(bilhetes, data_hora, self.assistente, nacionalidade, metodo_pagamento, fatura, contribuinte, anotacoes,
+                                          preco=getattr(self, 'ticket_price', TICKET_PRICE))
+                except Exception as e:
+                    messagebox.showerror("Erro", f"Erro ao gravar registos:\n{e}")
+                    return
+                try:
+                    self._atualizar_tabela_incremental()
+                    self._atualizar_status()
+                except Exception:
+                    pass
+                # impressão em segundo plano: a caixa fica logo livre para a venda seguinte
                 try:
                     if agrupado:
-                        # gravar individualmente cada número no BD, mas imprimir apenas um bilhete com a quantidade
-                        # garantir que gravamos o preço unitário do bilhete para cada registo
-                        try:
-                            self.db._pending_preco = getattr(self, 'ticket_price', TICKET_PRICE)
-                        except Exception:
-                            pass
-                        try:
-                            self.db._pending_preco = getattr(self, 'ticket_price', TICKET_PRICE)
-                        except Exception:
-                            pass
-                        try:
-                            self.db._pending_preco = getattr(self, 'ticket_price', TICKET_PRICE)
-                        except Exception:
-                            pass
-                        for numero in bilhetes:
-                            try:
-                                self.db.inserir_registo(data_hora, self.assistente, nacionalidade, numero, metodo_pagamento, fatura, contribuinte, anotacoes)
-                            except Exception:
-                                pass
-                        try:
-                            delattr(self.db, '_pending_preco')
-                        except Exception:
-                            try:
-                                del self.db._pending_preco
-                            except Exception:
-                                pass
-                        try:
-                            delattr(self.db, '_pending_preco')
-                        except Exception:
-                            try:
-                                del self.db._pending_preco
-                            except Exception:
-                                pass
-                        try:
-                            delattr(self.db, '_pending_preco')
-                        except Exception:
-                            try:
-                                del self.db._pending_preco
-                            except Exception:
-                                pass
-                        # Anexar quantidade nas anotações do primeiro bilhete para exibição
-                        try:
-                            self.db.atualizar_anotacoes_por_numero(bilhetes[0], f"Qtd:{len(bilhetes)}")
-                        except Exception:
-                            pass
-                        try:
-                            self.atualizar_tabela()
-                            self._atualizar_status()
-                        except Exception:
-                            pass
-                        try:
-                            # mensagem de sucesso (listar primeiros/mostrar contagem)
-                            messagebox.showinfo("Sucesso", f"Foram registados {len(bilhetes)} bilhetes:\n{', '.join(bilhetes)}\n\nSerá impresso 1 bilhete com quantidade {len(bilhetes)}.")
-                            self._set_status(f"{len(bilhetes)} bilhetes registados. Impresso 1 bilhete com quantidade.")
-                        except Exception:
-                            pass
-                        try:
-                            imprimir_bilhetes_multiplo_pdf([bilhetes[0]], data_hora, self.assistente, metodo_pagamento=metodo_pagamento, quantidade=len(bilhetes), preco=getattr(self, 'ticket_price', TICKET_PRICE))
-                        except Exception as e:
-                            print(f"Erro ao gerar/mandar imprimir PDF dos bilhetes: {e}")
+                        self.fila_impressao.submeter([bilhetes[0]], data_hora, self.assistente, metodo_pagamento=metodo_pagamento, quantidade=len(bilhetes), preco=getattr(self, 'ticket_price', TICKET_PRICE))
                     else:
-                        # única entrada: inserir normalmente
-                        try:
-                            self.db._pending_preco = getattr(self, 'ticket_price', TICKET_PRICE)
-                        except Exception:
-                            pass
-                        for numero in bilhetes:
-                            try:
-                                self.db.inserir_registo(data_hora, self.assistente, nacionalidade, numero, metodo_pagamento, fatura, contribuinte, anotacoes)
-                            except Exception:
-                                pass
-                        try:
-                            delattr(self.db, '_pending_preco')
-                        except Exception:
-                            try:
-                                del self.db._pending_preco
-                            except Exception:
-                                pass
-                        try:
-                            self.atualizar_tabela()
-                            self._atualizar_status()
-                        except Exception:
-                            pass
-                        try:
-                            messagebox.showinfo("Sucesso", f"Foram registados {len(bilhetes)} bilhete(s):\n{', '.join(bilhetes)}")
-                            self._set_status(f"{len(bilhetes)} bilhete(s) registado(s).")
-                        except Exception:
-                            pass
-                        try:
-                            imprimir_bilhetes_multiplo_pdf(bilhetes, data_hora, self.assistente, metodo_pagamento=metodo_pagamento, preco=getattr(self, 'ticket_price', TICKET_PRICE))
-                        except Exception as e:
-                            print(f"Erro ao gerar/mandar imprimir PDF dos bilhetes: {e}")
+                        self.fila_impressao.submeter(bilhetes, data_hora, self.assistente, metodo_pagamento=metodo_pagamento, preco=getattr(self, 'ticket_price', TICKET_PRICE))
                 except Exception as e:
-                    messagebox.showerror("Erro", f"Erro ao gravar registos:\n{e}")
+                    print(f"Erro ao enviar bilhetes para a fila de impressão: {e}")
+                try:
+                    if agrupado:
+                        # mensagem de sucesso (listar primeiros/mostrar contagem)
+                        messagebox.showinfo("Sucesso", f"Foram registados {len(bilhetes)} bilhetes:\n{', '.join(bilhetes)}\n\nSerá impresso 1 bilhete com quantidade {len(bilhetes)}.")
+                        self._set_status(f"{len(bilhetes)} bilhetes registados. Impresso 1 bilhete com quantidade.")
+                    else:
+                        messagebox.showinfo("Sucesso", f"Foram registados {len(bilhetes)} bilhete(s):\n{', '.join(bilhetes)}")
+                        self._set_status(f"{len(bilhetes)} bilhete(s) registado(s).")
+                except Exception:
+                    pass
             else:
                 # pagamento em numerário: pedir valor recebido via popup
                 # passar informação de quantidade para que o popup grave agrupado se necessário
-                self._pedir_pagamento_e_imprimir(bilhetes, data_hora, total_price,
-                                                 nacionalidade, metodo_pagamento, fatura, contribuinte, anotacoes, quantidade=len(bilhetes))
+                self._pedir_pagamento_e_imprimir(data_hora, total_price,
+                                                 nacionalidade, metodo_pagamento, fatura, contribuinte, anotacoes, quantidade=quantidade)
         except Exception as e:
             print(f"Erro ao iniciar fluxo de pagamento: {e}")
 
-    def _pedir_pagamento_e_imprimir(self, bilhetes, data_hora, total_price,
+    def _pedir_pagamento_e_imprimir(self, data_hora, total_price,
                                     nacionalidade=None, metodo_pagamento=None, fatura=None, contribuinte=None, anotacoes=None, quantidade=1):
         """Abre um popup modal para introduzir o valor recebido pelo cliente, mostra o troco e confirma antes de gerar o PDF."""
         popup = tk.Toplevel(self.root)
@@ -1617,7 +3932,7 @@ class JanelaPrincipal:
         popup.transient(self.root)
         popup.grab_set()
 
-        tk.Label(popup, text=f"Total a Pagar: €{total_price:.2f}", font=AF(11, "bold")).pack(pady=(12, 6))
+        tk.Label(popup, text=f"Total a Pagar: {total_price.formatar()}", font=AF(11, "bold")).pack(pady=(12, 6))
 
         entry_frame = tk.Frame(popup)
         entry_frame.pack(pady=(6, 6))
@@ -1633,9 +3948,8 @@ class JanelaPrincipal:
         def _update_troco(*args):
             s = recebido_var.get().strip()
             try:
-                val = float(s.replace(',', '.')) if s else 0.0
-                troco = val - float(total_price)
-                troco_label.config(text=f"Troco: €{troco:.2f}")
+                val = Centimos.de_euros(s) if s else Centimos(0)
+                troco_label.config(text=f"Troco: {(val - total_price).formatar()}")
             except Exception:
                 troco_label.config(text="Troco: —")
 
@@ -1647,49 +3961,23 @@ class JanelaPrincipal:
         def confirmar_pagamento():
             s = recebido_var.get().strip()
             try:
-                received = float(s.replace(',', '.'))
+                received = Centimos.de_euros(s)
             except Exception:
                 messagebox.showwarning("Aviso", "Introduza um valor recebido válido (ex.: 10.00)")
-                return
-            if received < total_price:
-                if not messagebox.askyesno("Valor Inferior", "O valor recebido é inferior ao total. Deseja continuar mesmo assim?"):
-                    return
-            try:
-                troco = received - total_price
-            except Exception:
-                troco = 0.0
-            # mostrar troco final antes de prosseguir
-            messagebox.showinfo("Troco", f"Troco a entregar: €{troco:.2f}")
-            popup.destroy()
-            # após confirmação, gravar os registos no BD, atualizar UI e gerar PDF
-            try:
-                # gravar individualmente cada número no BD (mesmo que a impressão seja agrupada)
-                try:
-                    try:
-                        self.db._pending_preco = getattr(self, 'ticket_price', TICKET_PRICE)
-                    except Exception:
-                        pass
-                    for numero in bilhetes:
-                        try:
-                            self.db.inserir_registo(data_hora, self.assistente, nacionalidade, numero, metodo_pagamento, fatura, contribuinte, anotacoes)
-                        except Exception:
-                            # continuar a tentar inserir outros bilhetes
-                            pass
-                    try:
-                        delattr(self.db, '_pending_preco')
-                    except Exception:
-                        try:
-                            del self.db._pending_preco
-                        except Exception:
-                            pass
-                    # Anexar quantidade nas anotações do primeiro bilhete para exibição
-                    try:
-                        if quantidade and int(quantidade) > 1:
-                            self.db.atualizar_anotacoes_por_numero(bilhetes[0], f"Qtd:{int(quantidade)}")
-                    except Exception:
-                        pass
-                except Exception:
-                    pass
+                return
+            if received < total_price:
+                if not messagebox.askyesno("Valor Inferior", "O valor recebido é inferior ao total. Deseja continuar mesmo assim?"):
+                    return
+            troco = received - total_price
+            # mostrar troco final antes de prosseguir
+            messagebox.showinfo("Troco", f"Troco a entregar: {troco.formatar()}")
+            popup.destroy()
+            # após confirmação, gravar os registos no BD, atualizar UI e gerar PDF
+            try:
+                # reservar os números e gravar todos os bilhetes numa só transação (a anotação 'Qtd:N' vai no primeiro)
+                bilhetes = self.db.reservar_bilhetes(int(quantidade))
+                self.db.inserir_venda(bilhetes, data_hora, self.assistente, nacionalidade, metodo_pagamento, fatura, contribuinte, anotacoes,
+                                      preco=getattr(self, 'ticket_price', TICKET_PRICE))
                 # limpar campos e atualizar
                 try:
                     self.combo_nacionalidade.set("Português")
@@ -1717,12 +4005,21 @@ class JanelaPrincipal:
 
                 # atualizar tabela e estatísticas
                 try:
-                    self.atualizar_tabela()
+                    self._atualizar_tabela_incremental()
                     self._atualizar_status()
                 except Exception:
                     pass
 
-                # informar sucesso e gerar PDF
+                # impressão em segundo plano: a caixa fica logo livre para a venda seguinte
+                try:
+                    if quantidade and int(quantidade) > 1:
+                        self.fila_impressao.submeter([bilhetes[0]], data_hora, self.assistente, metodo_pagamento=metodo_pagamento, recebido=received.euros, troco=troco.euros, quantidade=quantidade, preco=getattr(self, 'ticket_price', TICKET_PRICE))
+                    else:
+                        self.fila_impressao.submeter(bilhetes, data_hora, self.assistente, metodo_pagamento=metodo_pagamento, recebido=received.euros, troco=troco.euros, preco=getattr(self, 'ticket_price', TICKET_PRICE))
+                except Exception as e:
+                    print(f"Erro ao enviar bilhetes para a fila de impressão: {e}")
+
+                # informar sucesso
                 try:
                     # mensagem de sucesso e resumo
                     if quantidade and int(quantidade) > 1:
@@ -1733,13 +4030,6 @@ class JanelaPrincipal:
                         self._set_status(f"{len(bilhetes)} bilhete(s) registado(s).")
                 except Exception:
                     pass
-                try:
-                    if quantidade and int(quantidade) > 1:
-                        imprimir_bilhetes_multiplo_pdf([bilhetes[0]], data_hora, self.assistente, metodo_pagamento=metodo_pagamento, recebido=received, troco=troco, quantidade=quantidade, preco=getattr(self, 'ticket_price', TICKET_PRICE))
-                    else:
-                        imprimir_bilhetes_multiplo_pdf(bilhetes, data_hora, self.assistente, metodo_pagamento=metodo_pagamento, recebido=received, troco=troco, preco=getattr(self, 'ticket_price', TICKET_PRICE))
-                except Exception as e:
-                    print(f"Erro ao gerar/mandar imprimir PDF dos bilhetes: {e}")
             except Exception as e:
                 messagebox.showerror("Erro", f"Erro ao gravar registos após confirmação do pagamento:\n{e}")
 
@@ -1752,19 +4042,107 @@ class JanelaPrincipal:
         popup.wait_window()
 
     def atualizar_tabela(self):
-        # refresh table with today's data
+        # reconstrução completa com os registos de hoje (arranque, 'Limpar Filtro' ou novo dia)
         for ch in self.tree.get_children():
             self.tree.delete(ch)
-        dados = self.db.obter_registos_do_dia()
-        for idx, row in enumerate(dados):
-            tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
-            # ensure data_hora is string
-            linha = list(row)
-            linha[0] = str(linha[0])
-            self.tree.insert("", "end", values=linha, tags=(tag,))
+        self._tabela_linhas = 0
+        self._tabela_filtrada = False
+        self._pesquisa = None
+        try:
+            self.lbl_resultados.config(text="")
+        except Exception:
+            pass
+        try:
+            dados = self.agregado.carregar(self.db)
+        except Exception:
+            dados = []
+        self._exportar(dados)
+        self._tabela_versao = self.agregado.versao
+        # dados vêm do mais recente para o mais antigo; inserir do fim para o início
+        for row in reversed(dados):
+            self._inserir_linha_tabela(row)
         self._atualizar_status()
+
+    def _atualizar_tabela_incremental(self):
+        """Acrescenta ao topo da tabela apenas os registos gravados desde a última atualização."""
+        if self._tabela_filtrada:
+            # a mostrar uma pesquisa: voltar à vista do dia
+            self.atualizar_tabela()
+            return
+        try:
+            novos = self.agregado.sincronizar(self.db)
+        except Exception:
+            novos = []
+        self._exportar(novos)
+        if novos and self.replicador is not None:
+            self.replicador.notificar()
+        if self._tabela_versao != self.agregado.versao:
+            # o dia mudou entretanto: reconstruir
+            self.atualizar_tabela()
+            return
+        for row in reversed(novos):
+            self._inserir_linha_tabela(row)
         self._atualizar_estatisticas()
 
+    def _exportar(self, rows):
+        """Acrescenta ao diário CSV do dia os registos acabados de ler da BD."""
+        try:
+            self.exportador.acrescentar(rows, self.agregado.dia)
+        except Exception as e:
+            print("Falha ao escrever o diário do dia:", e)
+
+    def _sincronizar_periodicamente(self):
+        """Acrescenta as vendas gravadas por outras caixas e volta a agendar-se."""
+        try:
+            if self._tabela_filtrada:
+                # não mexer nos resultados de pesquisa; atualizar só as estatísticas
+                self._exportar(self.agregado.sincronizar(self.db))
+                self._atualizar_estatisticas()
+            else:
+                self._atualizar_tabela_incremental()
+        except Exception:
+            pass
+        try:
+            self.root.after(SINCRONIZACAO_MS, self._sincronizar_periodicamente)
+        except Exception:
+            pass
+
+    def _verificar_fila_impressao(self):
+        """Mostra na barra de estado as mensagens da fila de impressão e da replicação
+        (corre na thread do Tk)."""
+        filas = [self.fila_impressao.mensagens]
+        if self.replicador is not None:
+            filas.append(self.replicador.mensagens)
+        for fila in filas:
+            try:
+                while True:
+                    self._set_status(fila.get_nowait(), timeout_ms=10000)
+            except queue.Empty:
+                pass
+            except Exception:
+                pass
+        try:
+            self.root.after(200, self._verificar_fila_impressao)
+        except Exception:
+            pass
+
+    def _inserir_linha_tabela(self, row, no_fim=False):
+        """Insere um registo (id na 1ª coluna) no topo da tabela (ou no fim, se no_fim).
+
+        A risca é decidida pela posição a contar do lado onde se insere, pelo que as
+        linhas já existentes nunca precisam de ser re-etiquetadas.
+        """
+        tag = 'evenrow' if self._tabela_linhas % 2 == 0 else 'oddrow'
+        # ensure data_hora is string
+        linha = list(row[1:])
+        linha[0] = str(linha[0])
+        try:
+            self.tree.insert("", "end" if no_fim else 0, iid=str(row[0]), values=linha, tags=(tag,))
+        except tk.TclError:
+            # id já presente na tabela
+            return
+        self._tabela_linhas += 1
+
     def pesquisar_bilhete(self):
         termo = self.entry_search.get().strip()
         if not termo:
@@ -1772,13 +4150,49 @@ class JanelaPrincipal:
             return
         for ch in self.tree.get_children():
             self.tree.delete(ch)
-        dados = self.db.procurar_por_bilhete(termo)
-        for idx, row in enumerate(dados):
-            tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
-            linha = list(row)
-            linha[0] = str(linha[0])
-            self.tree.insert("", "end", values=linha, tags=(tag,))
-        self._set_status(f"Filtro: '{termo}' ({len(dados)} resultados)")
+        self._tabela_filtrada = True
+        self._tabela_linhas = 0
+        modo, valor = interpretar_pesquisa(termo)
+        try:
+            total = self.db.contar_por_bilhete(valor, modo)
+        except Exception:
+            total = 0
+        self._pesquisa = {'termo': valor, 'modo': modo, 'ultimo_id': None, 'esgotada': False, 'a_carregar': False}
+        self._carregar_pagina_pesquisa()
+        try:
+            self.lbl_resultados.config(text=f"{total} resultado(s)")
+        except Exception:
+            pass
+        self._set_status(f"Filtro: '{termo}' ({total} resultados)")
+
+    def _carregar_pagina_pesquisa(self):
+        """Acrescenta ao fim da tabela a página seguinte de resultados da pesquisa ativa."""
+        pesquisa = getattr(self, '_pesquisa', None)
+        if not self._tabela_filtrada or not pesquisa or pesquisa['esgotada']:
+            return
+        pesquisa['a_carregar'] = False
+        try:
+            dados = self.db.procurar_por_bilhete_pagina(pesquisa['termo'], pesquisa['ultimo_id'], modo=pesquisa['modo'])
+        except Exception:
+            dados = []
+        for row in dados:
+            self._inserir_linha_tabela(row, no_fim=True)
+        if dados:
+            pesquisa['ultimo_id'] = dados[-1][0]
+        if len(dados) < PAGINA_PESQUISA:
+            pesquisa['esgotada'] = True
+
+    def _on_tree_yscroll(self, first, last):
+        self._tree_vscroll.set(first, last)
+        # perto do fim da vista: pedir a página seguinte (fora do callback de scroll)
+        pesquisa = getattr(self, '_pesquisa', None)
+        try:
+            perto_do_fim = float(last) >= 0.9
+        except Exception:
+            perto_do_fim = False
+        if self._tabela_filtrada and pesquisa and perto_do_fim and not pesquisa['esgotada'] and not pesquisa['a_carregar']:
+            pesquisa['a_carregar'] = True
+            self.root.after_idle(self._carregar_pagina_pesquisa)
 
     def fechar_dia(self):
         if self.dia_fechado:
@@ -1843,77 +4257,73 @@ class JanelaPrincipal:
     # BACKUP E RELATÓRIOS
     # --------------------------
     def criar_backup(self):
-        hoje = hoje_str()
-        pasta_backup = "backups"
-        os.makedirs(pasta_backup, exist_ok=True)
-        backup_nome = os.path.join(pasta_backup, f"backup_bilhetes_{hoje}.db")
-        try:
-            if os.path.exists(self.db.path):
-                shutil.copy(self.db.path, backup_nome)
-                messagebox.showinfo("Backup Criado", f"Cópia de segurança criada em:\n{backup_nome}")
+        """Cria a cópia de segurança do dia numa thread (ver criar_copia_seguranca)."""
+        if self._backup_thread is not None and self._backup_thread.is_alive():
+            self._set_status("Cópia de segurança já em curso...")
+            return
+        if not os.path.exists(self.db.path):
+            messagebox.showwarning("Aviso", "Ficheiro de BD não encontrado para backup.")
+            return
+        resultado = queue.Queue()
+
+        def _trabalho():
+            try:
+                resultado.put((True, criar_copia_seguranca(self.db.path)))
+            except Exception as e:
+                resultado.put((False, e))
+
+        def _verificar():
+            try:
+                ok, valor = resultado.get_nowait()
+            except queue.Empty:
+                self.root.after(200, _verificar)
+                return
+            if ok:
+                messagebox.showinfo("Backup Criado", f"Cópia de segurança criada e verificada em:\n{valor}")
             else:
-                messagebox.showwarning("Aviso", "Ficheiro de BD não encontrado para backup.")
-        except Exception as e:
-            messagebox.showerror("Erro no Backup", f"Falha ao criar cópia de segurança:\n{e}")
+                messagebox.showerror("Erro no Backup", f"Falha ao criar cópia de segurança:\n{valor}")
+
+        self._set_status("A criar cópia de segurança...")
+        self._backup_thread = threading.Thread(target=_trabalho, name="backup", daemon=True)
+        self._backup_thread.start()
+        self.root.after(200, _verificar)
 
     def gerar_excel(self):
         hoje = hoje_str()
         pasta = os.path.join("relatorios", hoje)
         os.makedirs(pasta, exist_ok=True)
-        dados = self.db.obter_registos_do_dia()
-        if not dados:
+        # o diário já tem as vendas do dia; acrescentar só as que ainda faltarem
+        try:
+            self.exportador.sincronizar(self.db, hoje)
+        except Exception as e:
+            messagebox.showerror("Erro Excel", f"Falha ao atualizar o diário do dia:\n{e}")
+            return
+        if not self.exportador.total:
             messagebox.showinfo("Sem Dados", "Não existem registos para hoje.")
             return
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Bilhetes do Dia"
-        cabecalho = ["Data/Hora", "Assistente", "Nacionalidade", "Número Bilhete", "Método Pagamento", "Recibo", "Contribuinte", "Preço", "Anotações"]
-        ws.append(cabecalho)
-        for col_num, _ in enumerate(cabecalho, 1):
-            ws[f"{get_column_letter(col_num)}1"].font = Font(bold=True)
-        for row in dados:
-            # row now includes preco before anotacoes
-            ws.append([str(x) if x is not None else "" for x in row])
-        # aplicar wrap na coluna 'Anotações' (última coluna)
-        try:
-            anot_col = len(cabecalho)
-            for cell in ws[get_column_letter(anot_col)]:
-                cell.alignment = Alignment(wrap_text=True, vertical='top')
-        except Exception:
-            pass
-        total = len(dados)
-        ws.append([])
-        ws.append(["Total de Bilhetes Vendidos:", total])
-        # Calcular e adicionar totais monetários ao Excel
+        rodape = [[], ["Total de Bilhetes Vendidos:", self.exportador.total]]
+        # totais monetários somados pelo SQLite (as mesmas vendas que o diário acabado de sincronizar);
+        # a tabela da janela não é mexida aqui
         try:
-            cash_amount = 0.0
-            card_amount = 0.0
-            for row in dados:
-                metodo = (row[4] or "").strip().lower()
-                try:
-                    preco_val = float(row[7]) if row[7] is not None else float(getattr(self, 'ticket_price', TICKET_PRICE))
-                except Exception:
-                    preco_val = float(getattr(self, 'ticket_price', TICKET_PRICE))
-                if metodo == 'dinheiro':
-                    cash_amount += preco_val
-                elif metodo.startswith('cart') or 'multibanco' in metodo or 'cartão' in metodo:
-                    card_amount += preco_val
-            numerario_total = INITIAL_CASH + cash_amount
-            caixa_total = numerario_total + card_amount
-            ws.append(["Numerário:", f"€{numerario_total:.2f}"])
-            ws.append(["Multibanco:", f"€{card_amount:.2f}"])
-            ws.append(["Caixa total:", f"€{caixa_total:.2f}"])
+            totais = self.db.totais_pagamento(hoje, preco_omissao=self.agregado.preco_omissao)
+            numerario = Centimos.de_euros(INITIAL_CASH) + totais.get(MetodoPagamento.DINHEIRO, Centimos(0))
+            cartao = Centimos(totais.get(MetodoPagamento.CARTAO, 0))
+            rodape.append(["Numerário:", numerario.formatar()])
+            rodape.append(["Multibanco:", cartao.formatar()])
+            rodape.append(["Caixa total:", (numerario + cartao).formatar()])
         except Exception:
             # não impedir criação do Excel se falhar o cálculo
             pass
+        # eventos do dia lidos numa só consulta e separados por tipo
+        eventos_dia = self.db.obter_eventos_por_tipo(('nao_entraram', 'organista_entrada', 'organista_saida'))
         # Incluir registos 'Não Entraram' (horas) na folha, se existirem eventos para hoje
         try:
-            eventos = self.db.obter_eventos_por_tipo('nao_entraram')
+            eventos = [ev for ev in eventos_dia if ev[2] == 'nao_entraram']
             if eventos:
-                ws.append([])
-                ws.append(["Registos 'Não Entraram' (horas):"])
+                rodape.append([])
+                rodape.append(["Registos 'Não Entraram' (horas):"])
                 # adicionar cabeçalho simples: Hora, Assistente, Quantidade
-                ws.append(["Hora", "Assistente", "Quantidade"])
+                rodape.append(["Hora", "Assistente", "Quantidade"])
                 # eventos is list of (id, timestamp, event_type, count, assistente, notes)
                 for ev in reversed(eventos):
                     _, ts, _, cnt, assist, notes = ev
@@ -1921,26 +4331,24 @@ class JanelaPrincipal:
                         hora = ts.split(' ')[1]
                     except Exception:
                         hora = ts
-                    ws.append([hora, assist or "", cnt or ""])
+                    rodape.append([hora, assist or "", cnt or ""])
                 # adicionar total de pessoas que não entraram
                 try:
                     total_nao_entraram = sum(int(ev[3] or 0) for ev in eventos)
-                    ws.append([])
-                    ws.append(["Total Não Entraram:", total_nao_entraram])
+                    rodape.append([])
+                    rodape.append(["Total Não Entraram:", total_nao_entraram])
                 except Exception:
                     pass
         except Exception:
             pass
         # Incluir registos de entrada/saída do organista
         try:
-            entradas = self.db.obter_eventos_por_tipo('organista_entrada') or []
-            saidas = self.db.obter_eventos_por_tipo('organista_saida') or []
-            organista_events = list(entradas) + list(saidas)
-            # ordenar por timestamp asc (opcional) - eventos já filtrados por dia na query
+            # entradas e saídas pela ordem em que foram registadas
+            organista_events = [ev for ev in eventos_dia if ev[2] != 'nao_entraram']
             if organista_events:
-                ws.append([])
-                ws.append(["Registos Organista:"])
-                ws.append(["Hora", "Registrado Por", "Evento", "Organista", "Notas"])
+                rodape.append([])
+                rodape.append(["Registos Organista:"])
+                rodape.append(["Hora", "Registrado Por", "Evento", "Organista", "Notas"])
                 # eventos is list of (id, timestamp, event_type, count, assistente, notes)
                 for ev in reversed(organista_events):
                     _, ts, ev_type, cnt, registrador, notes = ev
@@ -1959,61 +4367,40 @@ class JanelaPrincipal:
                                 notas_extra = parts[1]
                     except Exception:
                         organista_nome = str(notes)
-                    ws.append([hora, registrador or "", evento_nome, organista_nome or "", notas_extra or ""])
-        except Exception:
-            pass
-        # incluir anotações finais no Excel: uma linha após os totais e, opcionalmente, numa aba separada
-        try:
-            if hasattr(self, 'final_notes') and self.final_notes:
-                # adicionar linha simples abaixo
-                ws.append([])
-                ws.append(["Anotações Finais:", self.final_notes])
-                # criar página separada com notas (maior legibilidade)
-                notas_ws = wb.create_sheet(title="Notas Finais")
-                notas_ws.append(["Anotações Finais"])
-                # quebrar em linhas para inserir na sheet
-                for ln in (self.final_notes or '').split('\n'):
-                    notas_ws.append([ln])
-                # aplicar wrap na primeira coluna
-                for row in notas_ws.iter_rows(min_row=1, max_col=1):
-                    for cell in row:
-                        try:
-                            cell.alignment = Alignment(wrap_text=True, vertical='top')
-                        except Exception:
-                            pass
+                    rodape.append([hora, registrador or "", evento_nome, organista_nome or "", notas_extra or ""])
         except Exception:
             pass
-        for col in ws.columns:
-            max_len = max(len(str(c.value)) if c.value else 0 for c in col)
-            # limitar largura máxima razoável
-            width = min(max_len + 5, 100)
-            ws.column_dimensions[get_column_letter(col[0].column)].width = width
+        notas_finais = getattr(self, 'final_notes', None)
+        if notas_finais:
+            # incluir anotações finais: uma linha após os totais e numa aba separada
+            rodape.append([])
+            rodape.append(["Anotações Finais:", notas_finais])
         filename = os.path.join(pasta, f"Bilhetes_{hoje}.xlsx")
         try:
-            wb.save(filename)
+            self.exportador.gerar_excel(filename, rodape, notas_finais)
             messagebox.showinfo("Excel Gerado", f"Arquivo Excel criado: {filename}")
         except Exception as e:
             messagebox.showerror("Erro Excel", f"Falha ao criar Excel:\n{e}")
 
     def gerar_relatorio_horario(self):
-        """Gera/atualiza `relatorios/estatisticas_horario.xlsx` com as informações pedidas pelo utilizador.
+        """Guarda as estatísticas horárias do dia na BD e gera `relatorios/Estatísticas.xlsx`.
 
-        Para cada hora onde existam registos, escreve uma linha com:
+        Para cada hora onde existam registos, grava uma linha em estatisticas_horarias com:
         - Dia (YYYY-MM-DD)
         - Intervalo (HH:00-HH:59)
         - Dia da semana (pt)
-        - Assistente (nome mais frequente na hora)
+        - Assistentes (os dois mais frequentes na hora, com quantidades)
         - Organista (S/N) — 'S' se existir evento 'organista_entrada' nessa hora
         - Nacionalidades base e respetivas quantidades (formatadas)
         - Outras nacionalidades e respetiva quantidade (formatadas)
-        - Não pagantes por hora (registos com preco == 0)
+        - Não pagantes por hora (eventos 'nao_entraram')
         - Total de visitantes por hora (contagem de registos)
+        - Anotações dos registos da hora (e anotações finais do dia)
 
-        No final adiciona linhas de total do dia: total não pagantes e total visitantes.
+        A folha mensal do mês corrente é guardada em estatisticas_mensais. O livro é
+        depois gerado de raiz a partir da BD (ver escrever_estatisticas_xlsx).
         """
-        from collections import Counter
         from datetime import datetime
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 
         hoje = hoje_str()
         # mapa dia da semana em português
@@ -2023,552 +4410,279 @@ class JanelaPrincipal:
         os.makedirs(pasta, exist_ok=True)
         caminho = os.path.join(pasta, "Estatísticas.xlsx")
 
-        # definir nacionalidades base (consistente com a UI)
-        BASE_NACIONALIDADES = ["Português", "Brasileiro", "Espanhol", "Inglês", "Francês", "Italiano", "Asiático", "Alemão"]
-        base_lower = [b.lower() for b in BASE_NACIONALIDADES]
-
-        # obter todos os registos do dia para agrupar por hora (inclui anotacoes)
+        # primeira vez com a tabela: trazer o histórico do Excel antigo para a BD
         try:
-            self.db.cursor.execute(
-                "SELECT data_hora, assistente, nacionalidade, metodo_pagamento, preco, anotacoes FROM registos WHERE date(data_hora) = ? ORDER BY data_hora",
-                (hoje,)
-            )
-            rows = self.db.cursor.fetchall()
-        except Exception:
-            rows = []
-
-        # agrupar por hora
-        hora_groups = {}
-        for r in rows:
-            try:
-                dt = r[0]
-                hh = dt[11:13]  # 'YYYY-MM-DD HH:MM:SS'
-            except Exception:
-                continue
-            hora_groups.setdefault(hh, []).append({'data_hora': r[0], 'assistente': r[1], 'nacionalidade': r[2], 'metodo_pagamento': r[3], 'preco': r[4]})
+            if self.db.contar_estatisticas_horarias() == 0 and os.path.exists(caminho):
+                importar_estatisticas_xlsx(self.db, caminho)
+        except Exception as e:
+            print("Falha ao importar o Estatísticas.xlsx antigo:", e)
 
-        # organista: marcar horas onde existe evento de entrada
-        organista_hours = set()
-        try:
-            eventos = self.db.obter_eventos_por_tipo('organista_entrada', hoje)
-            for ev in eventos:
-                ts = ev[1]  # timestamp
-                try:
-                    h = ts[11:13]
-                    organista_hours.add(h)
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        # definir nacionalidades base (consistente com a UI)
+        BASE_NACIONALIDADES = ["Português", "Brasileiro", "Espanhol", "Inglês", "Francês", "Italiano", "Asiático", "Alemão"]
+        base_lower = {b.lower(): b for b in BASE_NACIONALIDADES}
 
-        # obter eventos 'nao_entraram' por hora (estes são os "não pagantes" solicitados agora)
-        nao_entraram_by_hour = {}
+        # agregados por hora vêm já calculados do SQLite; aqui só se formata
         try:
-            eventos_nao = self.db.obter_eventos_por_tipo('nao_entraram', hoje)
-            for ev in eventos_nao:
-                ts = ev[1]
-                cnt = int(ev[3] or 0)
-                try:
-                    h = ts[11:13]
-                    nao_entraram_by_hour[h] = nao_entraram_by_hour.get(h, 0) + cnt
-                except Exception:
-                    pass
+            horas = self.db.resumo_horario(hoje)
         except Exception:
-            nao_entraram_by_hour = {}
+            horas = []
 
-        # abrir ou criar workbook
+        dia_sem = ''
         try:
-            if os.path.exists(caminho):
-                wb = load_workbook(caminho)
-                ws = wb.active
-            else:
-                wb = Workbook()
-                ws = wb.active
-                ws.title = 'Estatísticas'
-                # título e metadados
-                ws.append(["Estatísticas Horário"])
-
-                # cabeçalho da tabela (agora com dois assistentes e coluna de anotações)
-                ws.append(["Dia", "Intervalo", "Dia da Semana", "Assistente 1", "Assistente 1 Quantidade", "Assistente 2", "Assistente 2 Quantidade", "Organista (S/N)", "Nacionalidades Base (contagens)", "Total Base", "Outras Nacionalidades (list)", "Total Outras", "Nao Pagantes Hora", "Total Visitantes Hora", "Anotacoes (Registos + Finais)"])
-        except Exception:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = 'Estatísticas'
-            ws.append(["Estatísticas Horário"])
-            ws.append([""])
-            ws.append(["Descrição das Colunas:"])
-            ws.append(["(ver descrições no topo do ficheiro)"])
-            ws.append([""])
-            ws.append(["Dia", "Intervalo", "Dia da Semana", "Assistente", "Organista (S/N)", "Nacionalidades Base (contagens)", "Total Base", "Outras Nacionalidades (list)", "Total Outras", "Nao Pagantes Hora", "Total Visitantes Hora"])
-
-        # remover linhas existentes do dia (para evitar duplicados ao re-fechar)
-        try:
-            to_delete = []
-            for row_idx in range(1, ws.max_row + 1):
-                try:
-                    cell = ws.cell(row=row_idx, column=1).value
-                    if cell == hoje:
-                        to_delete.append(row_idx)
-                except Exception:
-                    pass
-            for r in reversed(to_delete):
-                ws.delete_rows(r, 1)
+            dia_sem = weekdays_pt[datetime.strptime(hoje, "%Y-%m-%d").weekday()]
         except Exception:
-            pass
-
-        total_nao_pagantes_dia = sum(nao_entraram_by_hour.values())
-        total_visitantes_dia = 0
+            dia_sem = ''
+        final_notes = getattr(self, 'final_notes', None)
 
-        # identificar a linha do cabeçalho (primeira ocorrência do texto 'Intervalo')
-        header_row = None
-        for row_idx in range(1, ws.max_row + 1):
-            try:
-                if str(ws.cell(row=row_idx, column=1).value).strip().lower() == 'dia' and str(ws.cell(row=row_idx, column=2).value).strip().lower() in ('intervalo', 'intervalo'):
-                    header_row = row_idx
-                    break
-            except Exception:
-                continue
-        if header_row is None:
-            header_row = ws.max_row + 1
-            ws.append(["Dia", "Intervalo", "Dia da Semana", "Assistente 1", "Assistente 1 (cnt)", "Assistente 2", "Assistente 2 (cnt)", "Organista (S/N)", "Nacionalidades Base (contagens)", "Total Base", "Outras Nacionalidades (list)", "Total Outras", "Nao Pagantes Hora", "Total Visitantes Hora", "Anotacoes (Registos + Finais)"])
+        def _ordenar(contagens):
+            # mais frequentes primeiro; empate por ordem alfabética
+            return sorted(contagens.items(), key=lambda kv: (-kv[1], kv[0]))
 
+        linhas = []
         # iterar apenas horas com registos
-        for hh in sorted(hora_groups.keys()):
-            group = hora_groups[hh]
+        for h in horas:
+            hh = h['hora']
             intervalo = f"{hh}:00-{hh}:59"
-            dia_sem = ''
-            try:
-                dia_sem = weekdays_pt[datetime.strptime(hoje, "%Y-%m-%d").weekday()]
-            except Exception:
-                dia_sem = ''
 
             # assistentes na hora (até 2, com contagens) - evita sobreposição quando há dois
-            assistentes = [g['assistente'] or '' for g in group]
-            assistente_counter = Counter([a for a in assistentes if a])
-            top_ass = assistente_counter.most_common(2)
-            assistente_1 = top_ass[0][0] if len(top_ass) > 0 else ''
-            assistente_1_cnt = top_ass[0][1] if len(top_ass) > 0 else 0
-            assistente_2 = top_ass[1][0] if len(top_ass) > 1 else ''
-            assistente_2_cnt = top_ass[1][1] if len(top_ass) > 1 else 0
+            top_ass = _ordenar(h['assistentes'])[:2]
+            assistente_1, assistente_1_cnt = top_ass[0] if len(top_ass) > 0 else ('', 0)
+            assistente_2, assistente_2_cnt = top_ass[1] if len(top_ass) > 1 else ('', 0)
 
             # organista presente?
-            organista_flag = 'S' if hh in organista_hours else 'N'
-
-            # nacionalidades
-            base_counts = Counter()
-            outras_counts = Counter()
-            # coletar anotações deste grupo
-            anot_list = []
-            for g in group:
-                nat = (g.get('nacionalidade') or '').strip()
-                if not nat:
-                    continue
-                if nat.lower() in base_lower:
-                    idx = base_lower.index(nat.lower())
-                    base_key = BASE_NACIONALIDADES[idx]
-                    base_counts[base_key] += 1
+            organista_flag = 'S' if h['organista'] else 'N'
+
+            # nacionalidades base vs. outras
+            base_counts = {}
+            outras_counts = {}
+            for nat, cnt in h['nacionalidades'].items():
+                base_key = base_lower.get(nat.lower())
+                if base_key:
+                    base_counts[base_key] = base_counts.get(base_key, 0) + cnt
                 else:
-                    outras_counts[nat] += 1
-                # coletar anotacoes de cada registo
-                a = g.get('anotacoes')
-                if a:
-                    try:
-                        text = str(a).strip()
-                        if text:
-                            anot_list.append(text)
-                    except Exception:
-                        pass
-
+                    outras_counts[nat] = outras_counts.get(nat, 0) + cnt
             total_base = sum(base_counts.values())
             total_outras = sum(outras_counts.values())
 
-            # não pagantes por hora: usar eventos 'nao_entraram' agrupados por hora
-            nao_pagantes_hora = nao_entraram_by_hour.get(hh, 0)
-            total_visitantes_hora = len(group)
-
             # anotações: juntar anotações dos registos e anexar anotações finais do dia (se existirem)
-            anotacoes_comb = '; '.join(anot_list) if anot_list else ''
-            final_notes = getattr(self, 'final_notes', None)
+            anotacoes_comb = '; '.join(h['anotacoes'])
             if final_notes:
                 if anotacoes_comb:
                     anotacoes_comb = anotacoes_comb + ' || Finais: ' + str(final_notes)
                 else:
                     anotacoes_comb = 'Finais: ' + str(final_notes)
 
-            total_visitantes_dia += total_visitantes_hora
-
             # formatar colunas de nacionalidades
-            base_fmt = "; ".join([f"{k}: {v}" for k, v in base_counts.items()]) if base_counts else ""
-            outras_fmt = "; ".join([f"{k}: {v}" for k, v in outras_counts.items()]) if outras_counts else ""
+            base_fmt = "; ".join(f"{k}: {v}" for k, v in _ordenar(base_counts))
+            outras_fmt = "; ".join(f"{k}: {v}" for k, v in _ordenar(outras_counts))
 
-            ws.append([hoje, intervalo, dia_sem, assistente_1, assistente_1_cnt, assistente_2, assistente_2_cnt, organista_flag, base_fmt, total_base, outras_fmt, total_outras, nao_pagantes_hora, total_visitantes_hora, anotacoes_comb])
+            linhas.append((intervalo, dia_sem, assistente_1, assistente_1_cnt, assistente_2, assistente_2_cnt, organista_flag, base_fmt, total_base, outras_fmt, total_outras, h['nao_entraram'], h['visitantes'], anotacoes_comb))
 
-        # totais do dia
         try:
-            ws.append(['', '', '', '', '', '', '', '', '', '', '', 'Total não pagantes:', total_nao_pagantes_dia, 'Total visitantes:', total_visitantes_dia])
-            ws.append([])
-        except Exception:
-            pass
+            self.db.gravar_estatisticas_dia(hoje, linhas)
+        except Exception as e:
+            print("Falha ao gravar as estatísticas horárias:", e)
 
-        # formatação: cabeçalho em negrito, larguras, alinhamentos e filtro
+        # resumo do dia fechado (base das folhas mensal e anual)
         try:
-            # localizar a linha do cabeçalho novamente
-            hrow = None
-            for row_idx in range(1, ws.max_row + 1):
-                try:
-                    if str(ws.cell(row=row_idx, column=2).value).strip().lower() == 'intervalo':
-                        hrow = row_idx
-                        break
-                except Exception:
-                    continue
-            if hrow is None:
-                hrow = header_row
+            self.db.gravar_resumo_diario(hoje)
+        except Exception as e:
+            print("Falha ao gravar o resumo do dia:", e)
 
-            header_font = Font(bold=True)
-            for col in range(1, 16):
-                try:
-                    ws.cell(row=hrow, column=col).font = header_font
-                    ws.cell(row=hrow, column=col).alignment = Alignment(horizontal='center', vertical='center')
-                except Exception:
-                    pass
+        # --- folhas mensal e anual do período atual ---
+        try:
+            mes_key = hoje[:7]  # 'YYYY-MM'
+            self.db.gravar_estatisticas_mes(mes_key, self._linhas_estatisticas_mensais(mes_key))
+            self.db.gravar_estatisticas_mes(hoje[:4], self._linhas_estatisticas_anuais(hoje[:4]))
+        except Exception as e:
+            print("Falha ao calcular as estatísticas mensais:", e)
 
-            # congelar painéis após o cabeçalho
-            try:
-                ws.freeze_panes = ws.cell(row=hrow+1, column=1)
-            except Exception:
-                pass
+        try:
+            escrever_estatisticas_xlsx(self.db, caminho)
+        except Exception as e:
+            print("Falha ao gerar o Estatísticas.xlsx:", e)
 
-            # ajustar larguras de colunas automaticamente com base no conteúdo
-            from openpyxl.utils import get_column_letter
-            try:
-                last_row = ws.max_row
-                col_count = 15
-                max_widths = [0] * col_count
-                for col in range(1, col_count + 1):
-                    for row in range(hrow, last_row + 1):
-                        try:
-                            val = ws.cell(row=row, column=col).value
-                            if val is None:
-                                continue
-                            text = str(val)
-                            # considerar a linha mais longa em caso de wrap
-                            lines = text.splitlines()
-                            max_len = max((len(line) for line in lines), default=len(text))
-                            if max_len > max_widths[col - 1]:
-                                max_widths[col - 1] = max_len
-                        except Exception:
-                            continue
-
-                # aplicar largura com padding e limites mínimos/máximos
-                for i, mw in enumerate(max_widths, start=1):
-                    try:
-                        width = int(mw) + 2
-                        if width < 8:
-                            width = 8
-                        if width > 100:
-                            width = 100
-                        ws.column_dimensions[get_column_letter(i)].width = width
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+    def _linhas_estatisticas_mensais(self, mes_key):
+        """Linhas da folha Mensal_AAAA-MM (métricas, nacionalidades, horas, dias da semana e notas).
 
-            # wrap text for nationality and annotations columns
-            for row in ws.iter_rows(min_row=hrow+1, min_col=9, max_col=15):
-                for cell in row:
-                    try:
-                        cell.alignment = Alignment(wrap_text=True)
-                    except Exception:
-                        pass
+        Calculadas a partir de resumo_diario (no máximo 31 linhas), não dos registos.
+        """
+        from datetime import datetime
 
-            # aplicar autofiltro
+        # traduzir mês para nome em português (para exibição)
+        try:
+            month_num = int(mes_key.split('-')[1])
+            mes_nome_pt = MESES_PT[month_num - 1]
+        except Exception:
+            mes_nome_pt = mes_key
+
+        inicio, fim = intervalo_mes(mes_key)
+        self.db.preencher_resumos_em_falta(inicio, fim)
+        resumos = self.db.obter_resumos_diarios(inicio, fim)
+
+        total_visitors_month = 0
+        total_nao_entraram_month = 0
+        total_hours_with_visitors = 0
+        days_with_visitors = 0
+        visitors_with_organist = 0
+        hours_with_organist_count = 0
+        nat_counter = {}
+        visitors_by_hour_interval = {}
+        visitors_by_weekday = [0] * 7
+        hours_by_weekday = [0] * 7
+
+        for r in resumos:
+            total_visitors_month += r['visitantes']
+            total_nao_entraram_month += r['nao_entraram']
+            por_hora = r['por_hora']
+            if r['visitantes']:
+                days_with_visitors += 1
+            total_hours_with_visitors += len(por_hora)
+            for nat, n in r['por_nacionalidade'].items():
+                nat_counter[nat] = nat_counter.get(nat, 0) + n
+            for hh, n in por_hora.items():
+                k = f"{hh}:00-{hh}:59"
+                visitors_by_hour_interval[k] = visitors_by_hour_interval.get(k, 0) + n
+            for hh in r['horas_organista']:
+                visitors_with_organist += por_hora.get(hh, 0)
+                hours_with_organist_count += 1
+            # weekday: Monday=0
             try:
-                last_row = ws.max_row
-                ws.auto_filter.ref = f"A{hrow}:O{last_row}"
+                wd = datetime.strptime(r['dia'], "%Y-%m-%d").weekday()
+                visitors_by_weekday[wd] += r['visitantes']
+                hours_by_weekday[wd] += len(por_hora)
             except Exception:
                 pass
-        except Exception:
-            pass
-
-        try:
-            # --- Adicionar folha mensal com estatísticas do mês atual ---
-            try:
-                from collections import Counter
-                import calendar
-                from datetime import datetime
 
-                mes_key = hoje[:7]  # 'YYYY-MM'
-                # traduzir mês para nome em português (para exibição)
-                try:
-                    month_num = int(mes_key.split('-')[1])
-                    months_pt = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
-                    mes_nome_pt = months_pt[month_num - 1]
-                except Exception:
-                    mes_nome_pt = mes_key
-
-                # buscar registos do mês
-                try:
-                    self.db.cursor.execute(
-                        "SELECT data_hora, assistente, nacionalidade FROM registos WHERE substr(data_hora,1,7) = ? ORDER BY data_hora",
-                        (mes_key,)
-                    )
-                    month_rows = self.db.cursor.fetchall()
-                except Exception:
-                    month_rows = []
+        visitors_without_organist = total_visitors_month - visitors_with_organist
+        hours_without_organist_count = total_hours_with_visitors - hours_with_organist_count
+
+        visitors_per_hour_with_organist = visitors_with_organist / hours_with_organist_count if hours_with_organist_count else 0
+        visitors_per_hour_without_organist = visitors_without_organist / hours_without_organist_count if hours_without_organist_count else 0
+
+        avg_visitors_per_day = total_visitors_month / days_with_visitors if days_with_visitors else 0
+
+        linhas = []
+        # preencher com métricas principais
+        linhas.append([f"Estatísticas Mensais - {mes_nome_pt}"])
+        linhas.append([""])
+        linhas.append(["Métrica", "Valor"])
+        rows_metrics = [
+            ("Mês", mes_nome_pt),
+            ("Número de visitantes", total_visitors_month),
+            ("Número de não pagantes", total_nao_entraram_month),
+            ("Número de horas com visitas", total_hours_with_visitors),
+            ("Número de visitantes c/ organista", visitors_with_organist),
+            ("Número de horas com organista", hours_with_organist_count),
+            ("Número de visitantes s/ organista", visitors_without_organist),
+            ("Número de horas s/ organista", hours_without_organist_count),
+            ("Visitantes por hora (com organista)", round(visitors_per_hour_with_organist,2)),
+            ("Visitantes por hora (s/ organista)", round(visitors_per_hour_without_organist,2)),
+            ("Média de visitantes por dia", round(avg_visitors_per_day,2)),
+        ]
+        for m in rows_metrics:
+            linhas.append(list(m))
 
-                total_visitors_month = len(month_rows)
+        linhas.append([""])
 
-                # nao_entraram mensal (somar counts dos eventos)
-                try:
-                    self.db.cursor.execute(
-                        "SELECT SUM(count) FROM eventos WHERE event_type = 'nao_entraram' AND substr(timestamp,1,7) = ?",
-                        (mes_key,)
-                    )
-                    nao_sum = self.db.cursor.fetchone()[0]
-                    total_nao_entraram_month = int(nao_sum or 0)
-                except Exception:
-                    total_nao_entraram_month = 0
-
-                # nacionalidades do mês
-                nat_counter = Counter()
-                hours_set = set()
-                days_set = set()
-                visitors_by_hour_interval = {f"{h:02d}:00-{h:02d}:59": 0 for h in range(24)}
-                visitors_by_weekday = Counter()
-                hours_by_weekday_sets = {i: set() for i in range(7)}
-
-                for r in month_rows:
-                    dt = r[0]
-                    try:
-                        date_part = dt[:10]
-                        hour_key = dt[:13]  # YYYY-MM-DD HH
-                        hh = dt[11:13]
-                    except Exception:
-                        continue
-                    nat = (r[2] or '').strip()
-                    if nat:
-                        nat_counter[nat] += 1
-                    hours_set.add(hour_key)
-                    days_set.add(date_part)
-                    visitors_by_hour_interval[f"{int(hh):02d}:00-{int(hh):02d}:59"] += 1
-                    # weekday: Monday=0
-                    try:
-                        wd = datetime.strptime(date_part, "%Y-%m-%d").weekday()
-                        visitors_by_weekday[wd] += 1
-                        hours_by_weekday_sets[wd].add(hour_key)
-                    except Exception:
-                        pass
+        # nacionalidades tabela
+        linhas.append(["Nacionalidade", "Quantidade"])
+        for nat, cnt in sorted(nat_counter.items(), key=lambda kv: (-kv[1], kv[0])):
+            linhas.append([nat, cnt])
 
-                total_hours_with_visitors = len(hours_set)
+        linhas.append([""])
 
-                # organista hours across month
-                organist_hours_month = set()
-                try:
-                    self.db.cursor.execute(
-                        "SELECT timestamp FROM eventos WHERE event_type = 'organista_entrada' AND substr(timestamp,1,7) = ?",
-                        (mes_key,)
-                    )
-                    evs = self.db.cursor.fetchall()
-                    for e in evs:
-                        try:
-                            ts = e[0]
-                            organist_hours_month.add(ts[:13])
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
+        # visitantes por hora (intervalos)
+        linhas.append(["Intervalo Hora", "Visitantes no Mês"])
+        # listar apenas intervalos com visitantes (evitar linhas vazias)
+        for k in sorted(visitors_by_hour_interval.keys()):
+            cnt = visitors_by_hour_interval[k]
+            if cnt > 0:
+                linhas.append([k, cnt])
 
-                # visitors with/without organist
-                visitors_with_organist = 0
-                visitors_without_organist = 0
-                hours_with_organist = set()
-                for r in month_rows:
-                    try:
-                        hour_key = r[0][:13]
-                    except Exception:
-                        continue
-                    if hour_key in organist_hours_month:
-                        visitors_with_organist += 1
-                        hours_with_organist.add(hour_key)
-                    else:
-                        visitors_without_organist += 1
-
-                hours_with_organist_count = len(hours_with_organist)
-                hours_without_organist_count = total_hours_with_visitors - hours_with_organist_count
-
-                visitors_per_hour_with_organist = visitors_with_organist / hours_with_organist_count if hours_with_organist_count else 0
-                visitors_per_hour_without_organist = visitors_without_organist / hours_without_organist_count if hours_without_organist_count else 0
-
-                avg_visitors_per_day = total_visitors_month / len(days_set) if len(days_set) else 0
-
-                # visitors per weekday and hours per weekday and avg per hour per weekday
-                weekdays_pt = ["Segunda-feira", "Terça-feira", "Quarta-feira", "Quinta-feira", "Sexta-feira", "Sábado", "Domingo"]
-                visitors_by_weekday_named = {weekdays_pt[k]: v for k, v in visitors_by_weekday.items()}
-                hours_by_weekday = {weekdays_pt[k]: len(s) for k, s in hours_by_weekday_sets.items()}
-                avg_by_weekday = {}
-                for k in range(7):
-                    name = weekdays_pt[k]
-                    hrs = hours_by_weekday.get(name, 0)
-                    vis = visitors_by_weekday.get(k, 0)
-                    avg_by_weekday[name] = (vis / hrs) if hrs else 0
-
-                # criar ou substituir folha mensal
-                mensal_name = f"Mensal_{mes_key}"
-                if mensal_name in wb.sheetnames:
-                    ws_m = wb[mensal_name]
-                    wb.remove(ws_m)
-                ws_m = wb.create_sheet(title=mensal_name)
-
-                # preencher com métricas principais
-                ws_m.append([f"Estatísticas Mensais - {mes_nome_pt}"])
-                ws_m.append([""])
-                ws_m.append(["Métrica", "Valor"])
-                rows_metrics = [
-                    ("Mês", mes_nome_pt),
-                    ("Número de visitantes", total_visitors_month),
-                    ("Número de não pagantes", total_nao_entraram_month),
-                    ("Número de horas com visitas", total_hours_with_visitors),
-                    ("Número de visitantes c/ organista", visitors_with_organist),
-                    ("Número de horas com organista", hours_with_organist_count),
-                    ("Número de visitantes s/ organista", visitors_without_organist),
-                    ("Número de horas s/ organista", hours_without_organist_count),
-                    ("Visitantes por hora (com organista)", round(visitors_per_hour_with_organist,2)),
-                    ("Visitantes por hora (s/ organista)", round(visitors_per_hour_without_organist,2)),
-                    ("Média de visitantes por dia", round(avg_visitors_per_day,2)),
-                ]
-                for m in rows_metrics:
-                    ws_m.append(list(m))
-
-                ws_m.append([""])
-
-                # nacionalidades tabela
-                ws_m.append(["Nacionalidade", "Quantidade"])
-                for nat, cnt in nat_counter.most_common():
-                    ws_m.append([nat, cnt])
-
-                ws_m.append([""])
-
-                # visitantes por hora (intervalos)
-                ws_m.append(["Intervalo Hora", "Visitantes no Mês"])
-                # listar apenas intervalos com visitantes (evitar linhas vazias)
-                for k in sorted(visitors_by_hour_interval.keys()):
-                    cnt = visitors_by_hour_interval[k]
-                    if cnt > 0:
-                        ws_m.append([k, cnt])
-
-                ws_m.append([""])
-
-                # visitantes por dia da semana
-                ws_m.append(["Dia da Semana", "Visitantes", "Horas com visitas", "Média visitantes/hora"])
-                for name in weekdays_pt:
-                    vis = visitors_by_weekday.get(weekdays_pt.index(name), 0)
-                    hrs = hours_by_weekday.get(name, 0)
-                    avg = round(avg_by_weekday.get(name, 0), 2)
-                    ws_m.append([name, vis, hrs, avg])
-
-                # formatação simples para a folha mensal (negrito nos headers)
-                try:
-                    bold = Font(bold=True)
-                    # aplicar negrito às primeiras linhas de cabeçalho
-                    ws_m['A4'].font = bold
-                    # bold nas cabeças das tabelas (aproximamos: procurar linhas com texto específico)
-                    for row_idx in range(1, ws_m.max_row + 1):
-                        try:
-                            val = str(ws_m.cell(row=row_idx, column=1).value or '').lower()
-                            if any(h in val for h in ('nacionalidade', 'intervalo hora', 'diasemana', 'métrica', 'intervalo')):
-                                for col in range(1, ws_m.max_column + 1):
-                                    try:
-                                        ws_m.cell(row=row_idx, column=col).font = bold
-                                    except Exception:
-                                        pass
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-                # incluir anotações finais do mês (event_type = 'anotacoes_finais')
-                try:
-                    ws_m.append([""])
-                    ws_m.append(["Anotações Finais do Mês:"])
-                    # buscar eventos
-                    try:
-                        self.db.cursor.execute("SELECT timestamp, notes, assistente FROM eventos WHERE event_type = 'anotacoes_finais' AND substr(timestamp,1,7) = ? ORDER BY timestamp", (mes_key,))
-                        finals = self.db.cursor.fetchall()
-                    except Exception:
-                        finals = []
-                    if finals:
-                        ws_m.append(["Data", "Assistente (registo)", "Anotações"])
-                        for ts, notes, assist in finals:
-                            try:
-                                date_part = ts.split(' ')[0]
-                            except Exception:
-                                date_part = ts
-                            ws_m.append([date_part, assist or '', notes or ''])
-                    else:
-                        ws_m.append(["(Sem anotações finais registadas neste mês)"])
-                except Exception:
-                    pass
+        linhas.append([""])
 
-                # formatação adicional: auto-ajustar colunas, freeze e autofiltro
-                try:
-                    from openpyxl.utils import get_column_letter
-                    max_cols = ws_m.max_column
-                    max_rows = ws_m.max_row
-                    max_widths = [0] * max_cols
-                    for col in range(1, max_cols + 1):
-                        for row in range(1, max_rows + 1):
-                            try:
-                                v = ws_m.cell(row=row, column=col).value
-                                if v is None:
-                                    continue
-                                s = str(v)
-                                lines = s.splitlines()
-                                l = max((len(x) for x in lines), default=len(s))
-                                if l > max_widths[col - 1]:
-                                    max_widths[col - 1] = l
-                            except Exception:
-                                continue
-                    for i, mw in enumerate(max_widths, start=1):
-                        try:
-                            w = int(mw) + 2
-                            if w < 8:
-                                w = 8
-                            if w > 120:
-                                w = 120
-                            ws_m.column_dimensions[get_column_letter(i)].width = w
-                        except Exception:
-                            pass
-                    # wrap text for nationality column if present
-                    for row in ws_m.iter_rows(min_row=1, max_row=max_rows, min_col=1, max_col=max_cols):
-                        for cell in row:
-                            try:
-                                cell.alignment = Alignment(wrap_text=True)
-                            except Exception:
-                                pass
-                    # freeze top rows to keep title/legend visible
-                    try:
-                        ws_m.freeze_panes = ws_m['A6']
-                    except Exception:
-                        pass
-                    # apply autofilter to the main tables where possible: try to find the 'Intervalo Hora' header row
+        # visitantes por dia da semana
+        weekdays_pt = ["Segunda-feira", "Terça-feira", "Quarta-feira", "Quinta-feira", "Sexta-feira", "Sábado", "Domingo"]
+        linhas.append(["Dia da Semana", "Visitantes", "Horas com visitas", "Média visitantes/hora"])
+        for k, name in enumerate(weekdays_pt):
+            vis = visitors_by_weekday[k]
+            hrs = hours_by_weekday[k]
+            avg = round(vis / hrs, 2) if hrs else 0
+            linhas.append([name, vis, hrs, avg])
+
+        # incluir anotações finais do mês (event_type = 'anotacoes_finais')
+        try:
+            linhas.append([""])
+            linhas.append(["Anotações Finais do Mês:"])
+            # buscar eventos
+            try:
+                self.db.cursor.execute("SELECT timestamp, notes, assistente FROM eventos WHERE event_type = 'anotacoes_finais' AND timestamp >= ? AND timestamp < ? ORDER BY timestamp", (inicio, fim))
+                finals = self.db.cursor.fetchall()
+            except Exception:
+                finals = []
+            if finals:
+                linhas.append(["Data", "Assistente (registo)", "Anotações"])
+                for ts, notes, assist in finals:
                     try:
-                        for r in range(1, max_rows + 1):
-                            try:
-                                if str(ws_m.cell(row=r, column=1).value).strip().lower() == 'intervalo hora':
-                                    last = max_rows
-                                    ws_m.auto_filter.ref = f"A{r}:B{last}"
-                                    break
-                            except Exception:
-                                pass
+                        date_part = ts.split(' ')[0]
                     except Exception:
-                        pass
-                except Exception:
-                    pass
-            except Exception:
-                pass
-
-            wb.save(caminho)
+                        date_part = ts
+                    linhas.append([date_part, assist or '', notes or ''])
+            else:
+                linhas.append(["(Sem anotações finais registadas neste mês)"])
         except Exception:
             pass
+        return linhas
+
+    def _linhas_estatisticas_anuais(self, ano):
+        """Linhas da folha Anual_AAAA, a partir de resumo_diario (no máximo 366 linhas)."""
+        inicio, fim = f"{int(ano):04d}-01-01", f"{int(ano) + 1:04d}-01-01"
+        self.db.preencher_resumos_em_falta(inicio, fim)
+        resumos = self.db.obter_resumos_diarios(inicio, fim)
+
+        por_mes = {}
+        nacionalidades = {}
+        pagamentos = {}
+        for r in resumos:
+            m = por_mes.setdefault(int(r['dia'][5:7]), [0, 0, Centimos(0), 0])
+            m[0] += r['visitantes']
+            m[1] += r['nao_entraram']
+            m[2] += r['receita']
+            m[3] += 1 if r['visitantes'] else 0
+            for nat, n in r['por_nacionalidade'].items():
+                nacionalidades[nat] = nacionalidades.get(nat, 0) + n
+            for metodo, n in r['por_pagamento'].items():
+                metodo = metodo or '(sem método)'
+                pagamentos[metodo] = pagamentos.get(metodo, 0) + n
+
+        visitantes = sum(m[0] for m in por_mes.values())
+        dias = sum(m[3] for m in por_mes.values())
+        linhas = [
+            [f"Estatísticas Anuais - {ano}"],
+            [""],
+            ["Métrica", "Valor"],
+            ["Ano", str(ano)],
+            ["Número de visitantes", visitantes],
+            ["Número de não pagantes", sum(m[1] for m in por_mes.values())],
+            ["Receita", sum((m[2] for m in por_mes.values()), Centimos(0)).euros],
+            ["Dias com visitas", dias],
+            ["Média de visitantes por dia", round(visitantes / dias, 2) if dias else 0],
+            [""],
+            ["Mês", "Visitantes", "Não pagantes", "Receita", "Dias com visitas"],
+        ]
+        for num in sorted(por_mes):
+            v, nao, receita, d = por_mes[num]
+            linhas.append([MESES_PT[num - 1], v, nao, receita.euros, d])
+        linhas.append([""])
+        linhas.append(["Nacionalidade", "Quantidade"])
+        for nat, n in sorted(nacionalidades.items(), key=lambda kv: (-kv[1], kv[0])):
+            linhas.append([nat, n])
+        linhas.append([""])
+        linhas.append(["Método de Pagamento", "Bilhetes"])
+        for metodo, n in sorted(pagamentos.items(), key=lambda kv: (-kv[1], kv[0])):
+            linhas.append([metodo, n])
+        return linhas
 
     def gerar_pdf(self):
         hoje = hoje_str()
@@ -2577,115 +4691,65 @@ class JanelaPrincipal:
             return
         pasta = os.path.join("relatorios", hoje)
         os.makedirs(pasta, exist_ok=True)
-        dados = self.db.obter_registos_do_dia()
-        if not dados:
-            messagebox.showinfo("Sem Dados", "Não existem registos para hoje.")
-            return
-
         filename = os.path.join(pasta, f"Bilhetes_{hoje}.pdf")
-        pdf = SimpleDocTemplate(filename, pagesize=A4)
-        elementos = []
-        styles = getSampleStyleSheet()
-        elementos.append(Paragraph(f"<b>Relatório de Bilhetes - {hoje}</b>", styles["Title"]))
-        cabecalho = ["Data/Hora", "Assistente", "Nacionalidade", "Nº Bilhete", "Pagamento", "Recibo", "Contribuinte", "Preço", "Anotações"]
-        tabela_dados = [cabecalho]
-        for row in dados:
-            r = list(row)
-            try:
-                anot_text = str(r[-1]) if r[-1] is not None else ""
-            except Exception:
-                anot_text = ""
-            r[-1] = Paragraph(anot_text.replace('\n', '<br/>'), styles['BodyText'])
-            tabela_dados.append(r)
-
-        # Totais e summaries
-        total = len(dados)
-        empty_row = [""] * len(cabecalho)
-        row_total = [""] * len(cabecalho)
-        row_total[0] = "Total de Bilhetes Vendidos:"
-        row_total[1] = total
-        tabela_dados.append(empty_row)
-        tabela_dados.append(row_total)
-
-        # (campo 'Não Entraram' removido — não incluir essa linha no relatório)
-
-        # Anotações finais (se existirem)
-        try:
-            if hasattr(self, 'final_notes') and self.final_notes:
-                row_notes = [""] * len(cabecalho)
-                row_notes[0] = Paragraph(self.final_notes.replace('\n', '<br/>'), styles['BodyText'])
-                tabela_dados.append([""])  # spacer
-                tabela_dados.append(row_notes)
-        except Exception:
-            pass
-
-        t = Table(tabela_dados, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.whitesmoke)
-        ]))
-        elementos.append(t)
-        try:
-            pdf.build(elementos)
-            messagebox.showinfo("PDF Gerado", f"Arquivo PDF criado: {filename}")
+        try:
+            total = gerar_relatorio_pdf_dia(self.db, hoje, filename, getattr(self, 'final_notes', None))
         except Exception as e:
             messagebox.showerror("Erro PDF", f"Falha ao criar PDF:\n{e}")
+            return
+        if not total:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            messagebox.showinfo("Sem Dados", "Não existem registos para hoje.")
+            return
+        messagebox.showinfo("PDF Gerado", f"Arquivo PDF criado: {filename}")
+
 
     # --------------------------
     # ESTATÍSTICAS E STATUS
     # --------------------------
     def _atualizar_estatisticas(self):
-        # atualiza total e tabela por nacionalidade
-        dados = self.db.obter_registos_do_dia()
-        total = len(dados)
-        self.lbl_total_today.config(text=f"Total de bilhetes hoje: {total}")
-
-        # sumarizar por nacionalidade
-        summary = {}
-        for row in dados:
-            nat = row[2] or "Outros"
-            summary[nat] = summary.get(nat, 0) + 1
-
-        # calcular totais por método de pagamento usando o preço armazenado por registo
-        try:
-            cash_amount = 0.0
-            card_amount = 0.0
-            for row in dados:
-                metodo = (row[4] or "").strip().lower()
-                try:
-                    preco_val = float(row[7]) if row[7] is not None else float(getattr(self, 'ticket_price', TICKET_PRICE))
-                except Exception:
-                    preco_val = float(getattr(self, 'ticket_price', TICKET_PRICE))
-                if metodo == 'dinheiro':
-                    cash_amount += preco_val
-                elif metodo.startswith('cart') or 'multibanco' in metodo or 'cartão' in metodo:
-                    card_amount += preco_val
-        except Exception:
-            cash_amount = 0.0
-            card_amount = 0.0
+        # atualiza total, caixa e tabela por nacionalidade a partir do agregado em memória
+        ag = self.agregado
+        self.lbl_total_today.config(text=f"Total de bilhetes hoje: {ag.total}")
 
         # Numerário deve incluir o valor inicial da caixa
-        numerario_total = INITIAL_CASH + cash_amount
-        # Caixa total inclui numerário (com caixa inicial) e também o multibanco
-        caixa_total = numerario_total + card_amount
-
-        # atualizar rótulos de valores monetários
+        # atualizar rótulos de valores monetários (numerário inclui a caixa inicial;
+        # caixa total inclui também o multibanco)
         try:
-            self.lbl_numerario.config(text=f"Numerário: €{numerario_total:.2f}")
-            self.lbl_multibanco.config(text=f"Multibanco: €{card_amount:.2f}")
-            self.lbl_caixa_total.config(text=f"Caixa total: €{caixa_total:.2f}")
+            self.lbl_numerario.config(text=f"Numerário: {ag.numerario.formatar()}")
+            self.lbl_multibanco.config(text=f"Multibanco: {ag.cartao.formatar()}")
+            self.lbl_caixa_total.config(text=f"Caixa total: {ag.caixa_total.formatar()}")
         except Exception:
             pass
 
-        # limpar lista
-        for ch in self.lst_nacionalidades.get_children():
-            self.lst_nacionalidades.delete(ch)
-        for nat, cnt in sorted(summary.items(), key=lambda x: x[1], reverse=True):
-            self.lst_nacionalidades.insert("", "end", values=(nat, cnt))
+        # se o agregado foi recarregado (arranque ou novo dia) limpar a lista
+        if self._nat_versao != ag.versao:
+            for ch in self.lst_nacionalidades.get_children():
+                self.lst_nacionalidades.delete(ch)
+            self._nat_items = {}
+            self._nat_versao = ag.versao
+            alterados = set(ag.por_nacionalidade)
+            ag.consumir_alteracoes()
+        else:
+            alterados = ag.consumir_alteracoes()
+
+        # atualizar apenas as nacionalidades alteradas, mantendo a ordem por total decrescente
+        for nat in sorted(alterados, key=lambda n: ag.por_nacionalidade.get(n, 0), reverse=True):
+            cnt = ag.por_nacionalidade.get(nat, 0)
+            iid = self._nat_items.get(nat)
+            if iid is None:
+                iid = self.lst_nacionalidades.insert("", "end", values=(nat, cnt))
+                self._nat_items[nat] = iid
+            else:
+                self.lst_nacionalidades.item(iid, values=(nat, cnt))
+            pos = 0
+            for outro, outro_iid in self._nat_items.items():
+                if outro_iid != iid and ag.por_nacionalidade.get(outro, 0) > cnt:
+                    pos += 1
+            self.lst_nacionalidades.move(iid, "", pos)
 
     def _atualizar_status(self):
         # atualiza tabela e estatísticas
@@ -2702,6 +4766,22 @@ class JanelaPrincipal:
     # --------------------------
     def _on_close(self):
         if messagebox.askokcancel("Sair", "Deseja sair da aplicação?"):
+            try:
+                # deixar terminar os bilhetes que ainda estão na fila de impressão
+                self.fila_impressao.parar()
+            except Exception:
+                pass
+            try:
+                if self.replicador is not None:
+                    self.replicador.parar()
+            except Exception:
+                pass
+            try:
+                # não interromper uma cópia de segurança a meio
+                if self._backup_thread is not None:
+                    self._backup_thread.join(60)
+            except Exception:
+                pass
             try:
                 self.db.fechar()
             except Exception:
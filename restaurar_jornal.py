@@ -0,0 +1,97 @@
+"""Repõe uma BD a partir do diário de alterações da replicação contínua.
+
+O diário (alteracoes_AAAA-MM-DD.jsonl na pasta de replicação) tem uma linha por
+alteração a registos/eventos, com a linha completa identificada pelo id. Repor é
+voltar a aplicar essas linhas por ordem: cada uma substitui (ou apaga) a linha com o
+mesmo id, pelo que repetir linhas não tem efeito. Opcionalmente parte de uma cópia
+de segurança (backups/*.db ou *.db.gz) e aplica só o diário por cima.
+
+Uso:
+    python restaurar_jornal.py --jornal E:/replica --destino bilhetes_reposto.db
+    python restaurar_jornal.py --jornal E:/replica --base backups/backup_bilhetes_2026-10-16.db.gz --destino bilhetes_reposto.db
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import sys
+
+import bilhetes
+
+
+def _copiar_base(base, destino):
+    if base.endswith(".gz"):
+        with gzip.open(base, "rb") as gz, open(destino, "wb") as out:
+            shutil.copyfileobj(gz, out)
+    else:
+        shutil.copyfile(base, destino)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repõe a BD a partir do diário de alterações.")
+    parser.add_argument("--jornal", required=True, help="pasta de replicação (com alteracoes_*.jsonl)")
+    parser.add_argument("--destino", required=True, help="BD a criar (não pode existir)")
+    parser.add_argument("--base", help="cópia de segurança de partida (opcional)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.destino):
+        sys.exit(f"{args.destino} já existe; escolha outro destino.")
+    ficheiros = sorted(glob.glob(os.path.join(args.jornal, "alteracoes_*.jsonl")))
+    if not ficheiros:
+        sys.exit(f"Sem ficheiros alteracoes_*.jsonl em {args.jornal}.")
+    if args.base:
+        _copiar_base(args.base, args.destino)
+
+    # cria/atualiza o esquema como a aplicação faria
+    db = bilhetes.DatabaseManager(args.destino)
+    conn = db.conn
+    colunas = {t: [r[1] for r in conn.execute(f"PRAGMA table_info({t})")] for t in bilhetes.TABELAS_REPLICADAS}
+
+    aplicadas = apagadas = ignoradas = 0
+    for ficheiro in ficheiros:
+        with conn, open(ficheiro, encoding="utf-8") as f:
+            for n, texto in enumerate(f, 1):
+                texto = texto.strip()
+                if not texto:
+                    continue
+                try:
+                    alt = json.loads(texto)
+                except ValueError:
+                    # última linha cortada (p.ex. pen retirada a meio da escrita)
+                    print(f"  {os.path.basename(ficheiro)}:{n}: linha inválida ignorada")
+                    ignoradas += 1
+                    continue
+                tabela = alt.get('tabela')
+                if tabela not in colunas:
+                    ignoradas += 1
+                    continue
+                if alt.get('op') == 'd' or not alt.get('linha'):
+                    conn.execute(f"DELETE FROM {tabela} WHERE id = ?", (alt['id'],))
+                    apagadas += 1
+                    continue
+                linha = {k: v for k, v in alt['linha'].items() if k in colunas[tabela]}
+                nomes = list(linha)
+                # substituir a linha com o mesmo id ('registos' é uma vista: sem UPSERT)
+                conn.execute(f"DELETE FROM {tabela} WHERE id = ?", (alt['id'],))
+                conn.execute(
+                    f"INSERT INTO {tabela} ({', '.join(nomes)}) VALUES ({', '.join('?' * len(nomes))})",
+                    [linha[c] for c in nomes]
+                )
+                aplicadas += 1
+    with conn:
+        # a BD reposta começa sem alterações pendentes; as sequências voltam a ser
+        # inicializadas a partir do maior número de bilhete gravado
+        conn.execute("DELETE FROM alteracoes")
+        conn.execute("DELETE FROM sequencias")
+    resultado = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    registos = conn.execute("SELECT COUNT(*) FROM registos").fetchone()[0]
+    eventos = conn.execute("SELECT COUNT(*) FROM eventos").fetchone()[0]
+    db.fechar()
+    print(f"{len(ficheiros)} ficheiro(s): {aplicadas} linha(s) aplicadas, {apagadas} apagada(s), {ignoradas} ignorada(s)")
+    print(f"BD reposta em {args.destino}: {registos} registo(s), {eventos} evento(s), integridade: {resultado}")
+
+
+if __name__ == "__main__":
+    main()
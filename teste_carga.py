@@ -0,0 +1,99 @@
+"""Teste de carga: simula várias caixas a vender ao mesmo tempo na mesma BD.
+
+Cada caixa é um processo separado com a sua própria ligação (tal como no dia de
+festa, com duas ou três caixas à entrada). No fim verifica-se que não há números
+de bilhete repetidos e mostram-se os totais por caixa.
+
+Uso:
+    python teste_carga.py --caixas 3 --vendas 200 --bd teste_carga.db
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+
+import bilhetes
+
+
+NACIONALIDADES = ["Português", "Brasileiro", "Espanhol", "Inglês", "Francês", "Italiano", "Asiático", "Alemão"]
+
+
+def _caixa(path, caixa, vendas, max_qtd, resultados):
+    db = bilhetes.DatabaseManager(path, caixa=caixa)
+    latencias = []
+    erros = 0
+    for _ in range(vendas):
+        qtd = random.randint(1, max_qtd)
+        inicio = time.perf_counter()
+        try:
+            numeros = db.reservar_bilhetes(qtd)
+            db.inserir_venda(numeros, bilhetes.agora_str(), f"Assistente {caixa}", random.choice(NACIONALIDADES),
+                             random.choice(["Dinheiro", "Cartão"]), "Não", None, None, preco=bilhetes.TICKET_PRICE)
+        except Exception:
+            erros += 1
+            continue
+        latencias.append(time.perf_counter() - inicio)
+    db.fechar()
+    resultados.put((caixa, latencias, erros))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simula N caixas a vender em simultâneo na mesma BD.")
+    parser.add_argument("--caixas", type=int, default=3, help="número de caixas (processos)")
+    parser.add_argument("--vendas", type=int, default=200, help="vendas por caixa")
+    parser.add_argument("--max-qtd", type=int, default=5, help="máximo de bilhetes por venda")
+    parser.add_argument("--bd", default="teste_carga.db", help="ficheiro da BD de teste (é recriado)")
+    args = parser.parse_args()
+
+    for sufixo in ("", "-wal", "-shm"):
+        try:
+            os.remove(args.bd + sufixo)
+        except FileNotFoundError:
+            pass
+    # criar o esquema antes de arrancar as caixas
+    bilhetes.DatabaseManager(args.bd).fechar()
+
+    resultados = multiprocessing.Queue()
+    processos = [
+        multiprocessing.Process(target=_caixa, args=(args.bd, f"caixa{n + 1}", args.vendas, args.max_qtd, resultados))
+        for n in range(args.caixas)
+    ]
+    inicio = time.perf_counter()
+    for p in processos:
+        p.start()
+    por_caixa = [resultados.get() for _ in processos]
+    for p in processos:
+        p.join()
+    duracao = time.perf_counter() - inicio
+
+    conn = sqlite3.connect(args.bd)
+    total = conn.execute("SELECT COUNT(*) FROM registos").fetchone()[0]
+    repetidos = conn.execute(
+        "SELECT numero_bilhete, COUNT(*) FROM registos GROUP BY numero_bilhete HAVING COUNT(*) > 1"
+    ).fetchall()
+    por_caixa_bd = dict(conn.execute("SELECT caixa, COUNT(*) FROM registos GROUP BY caixa").fetchall())
+    conn.close()
+
+    vendas_ok = 0
+    print(f"{args.caixas} caixa(s), {args.vendas} venda(s) cada, {duracao:.2f}s")
+    for caixa, latencias, erros in sorted(por_caixa):
+        vendas_ok += len(latencias)
+        if latencias:
+            latencias.sort()
+            p50 = latencias[len(latencias) // 2] * 1000
+            p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))] * 1000
+        else:
+            p50 = p99 = 0.0
+        print(f"  {caixa}: {len(latencias)} vendas, {erros} erro(s), {por_caixa_bd.get(caixa, 0)} bilhetes, "
+              f"p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    print(f"Vendas/s: {vendas_ok / duracao:.1f}  Bilhetes gravados: {total}")
+    if repetidos:
+        print(f"ERRO: {len(repetidos)} número(s) de bilhete repetido(s), p.ex. {repetidos[:5]}")
+        raise SystemExit(1)
+    print("Sem números de bilhete repetidos.")
+
+
+if __name__ == "__main__":
+    main()
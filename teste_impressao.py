@@ -0,0 +1,118 @@
+"""Teste de débito da impressão ESC/POS sem impressora (nem Windows).
+
+Gera vendas para a FilaImpressao e envia-as para uma impressora virtual: no mesmo
+processo (destino 'ficheiro') ou num servidor TCP local que imita uma impressora de
+rede na porta RAW (destino 'rede'). A impressora virtual grava os bytes recebidos e
+simula a velocidade de impressão. No fim mostram-se bilhetes/s, bytes por bilhete e
+a latência na fila (da submissão da venda até ao fim do envio). Antes disso
+verifica-se que o modelo do bilhete imprime o troco de um pagamento certo (€0.00).
+
+Uso:
+    python teste_impressao.py --vendas 200 --max-qtd 3 --velocidade 40000 --destino rede
+"""
+import argparse
+import os
+import random
+import socketserver
+import threading
+import time
+
+import bilhetes
+
+
+class _ServidorVirtual(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    # server_close() espera pelos pedidos em curso (a impressora ainda a "imprimir")
+    daemon_threads = False
+
+    def __init__(self, endereco, impressora):
+        self.impressora = impressora
+        super().__init__(endereco, _PedidoVirtual)
+
+
+class _PedidoVirtual(socketserver.BaseRequestHandler):
+    def handle(self):
+        partes = []
+        while True:
+            bloco = self.request.recv(65536)
+            if not bloco:
+                break
+            partes.append(bloco)
+        # um trabalho por ligação, tal como na porta 9100 de uma impressora real
+        self.server.impressora.enviar(b"".join(partes))
+
+
+def _verificar_troco_zero():
+    """Um pagamento certo em dinheiro tem de imprimir 'Troco: €0.00' (troco 0.0 é falso em Python)."""
+    contextos = bilhetes._contextos_bilhetes(["IG0000-1"], bilhetes.agora_str(), "Teste", metodo_pagamento="Dinheiro",
+                                             recebido=bilhetes.TICKET_PRICE, troco=0.0, quantidade=1,
+                                             preco=bilhetes.TICKET_PRICE)
+    dados = bilhetes._gerar_escpos_contextos(contextos)
+    if b"Troco" not in dados or b"Recebido" not in dados:
+        raise SystemExit("Modelo do bilhete: falta a linha Recebido/Troco num pagamento certo em dinheiro.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o débito da impressão ESC/POS numa impressora virtual.")
+    parser.add_argument("--vendas", type=int, default=200, help="número de vendas a imprimir")
+    parser.add_argument("--max-qtd", type=int, default=3, help="máximo de bilhetes por venda")
+    parser.add_argument("--intervalo", type=float, default=0.0, help="segundos entre vendas")
+    parser.add_argument("--velocidade", type=float, default=0, help="bytes/s da impressora virtual (0 = instantânea)")
+    parser.add_argument("--tempo-corte", type=float, default=0.0, help="segundos por corte de papel")
+    parser.add_argument("--janela", type=float, default=0.3, help="janela de agrupamento da fila (s)")
+    parser.add_argument("--destino", choices=("ficheiro", "rede"), default="ficheiro")
+    parser.add_argument("--saida", default="impressora_virtual.bin", help="ficheiro com os bytes recebidos (é recriado)")
+    args = parser.parse_args()
+    _verificar_troco_zero()
+
+    try:
+        os.remove(args.saida)
+    except FileNotFoundError:
+        pass
+    virtual = bilhetes.ImpressoraVirtual(args.saida, args.velocidade, args.tempo_corte)
+    servidor = None
+    if args.destino == "rede":
+        servidor = _ServidorVirtual(("127.0.0.1", 0), virtual)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        impressora = bilhetes.ImpressoraRede("127.0.0.1", servidor.server_address[1])
+    else:
+        impressora = virtual
+
+    fila = bilhetes.FilaImpressao(config={'modo': 'escpos'}, janela=args.janela, impressora=impressora)
+    total_bilhetes = 0
+    inicio = time.perf_counter()
+    for n in range(args.vendas):
+        qtd = random.randint(1, args.max_qtd)
+        numeros = [f"IG0000-{total_bilhetes + i + 1}" for i in range(qtd)]
+        total_bilhetes += qtd
+        metodo = random.choice(["Dinheiro", "Cartão"])
+        extra = {'recebido': 20.0, 'troco': 20.0 - qtd * bilhetes.TICKET_PRICE} if metodo == "Dinheiro" else {}
+        fila.submeter(numeros, bilhetes.agora_str(), "Teste", metodo_pagamento=metodo, quantidade=qtd,
+                      preco=bilhetes.TICKET_PRICE, **extra)
+        if args.intervalo:
+            time.sleep(args.intervalo)
+    fila.parar(timeout=None)
+    if servidor:
+        # as ligações já enviadas podem ainda não ter sido aceites: esperar por elas antes de parar
+        limite = time.monotonic() + 30
+        while virtual.trabalhos < fila.trabalhos_enviados and time.monotonic() < limite:
+            time.sleep(0.01)
+        servidor.shutdown()
+        servidor.server_close()
+    duracao = time.perf_counter() - inicio
+
+    while not fila.mensagens.empty():
+        print("  fila:", fila.mensagens.get())
+    latencias = sorted(fila.latencias)
+    if latencias:
+        p50 = latencias[len(latencias) // 2] * 1000
+        p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))] * 1000
+    else:
+        p50 = p99 = 0.0
+    print(f"{args.vendas} venda(s), {virtual.bilhetes} bilhete(s) impressos em {virtual.trabalhos} trabalho(s), {duracao:.2f}s")
+    print(f"Bilhetes/s: {virtual.bilhetes / duracao:.1f}  Bytes/bilhete: {virtual.bytes / max(1, virtual.bilhetes):.0f}")
+    print(f"Latência na fila: p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()